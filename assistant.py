@@ -9,345 +9,6549 @@ Author: Your Name
 License: MIT
 """
 
-import os
-import json
-import subprocess
-from typing import List, Dict, Optional
-from ollama import chat
-from rich.console import Console
-from rich.markdown import Markdown
-from rich.panel import Panel
-from rich.progress import Progress, SpinnerColumn, TextColumn
+import time
 
-console = Console()
+# Measured by --startup-profile
+MODULE_LOADING_STARTED = time.perf_counter()
+
+import os  # noqa: E402
+import re  # noqa: E402
+import ast  # noqa: E402
+import json  # noqa: E402
+import errno  # noqa: E402
+import codecs  # noqa: E402
+import mmap  # noqa: E402
+import queue  # noqa: E402
+import shlex  # noqa: E402
+import select  # noqa: E402
+import signal  # noqa: E402
+import stat  # noqa: E402
+import struct  # noqa: E402
+import sys  # noqa: E402
+import zlib  # noqa: E402
+import bisect  # noqa: E402
+import pickle  # noqa: E402
+import glob  # noqa: E402
+import difflib  # noqa: E402
+import tempfile  # noqa: E402
+import shutil  # noqa: E402
+import weakref  # noqa: E402
+import atexit  # noqa: E402
+import fnmatch  # noqa: E402
+import uuid  # noqa: E402
+import asyncio  # noqa: E402
+import hashlib  # noqa: E402
+import importlib.util  # noqa: E402
+import argparse  # noqa: E402
+import logging  # noqa: E402
+import threading  # noqa: E402
+import subprocess  # noqa: E402
+import multiprocessing  # noqa: E402
+from array import array  # noqa: E402
+from collections import OrderedDict, deque  # noqa: E402
+from contextlib import contextmanager  # noqa: E402
+from functools import partial  # noqa: E402
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor  # noqa: E402
+from logging.handlers import RotatingFileHandler  # noqa: E402
+import urllib.error  # noqa: E402
+import urllib.parse  # noqa: E402
+import urllib.request  # noqa: E402
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Dict, Iterator, List, Optional  # noqa: E402
+
+# ollama (~0.25s) and rich (~60ms for rich.console) are imported where first
+# needed so the prompt comes up sooner
+if TYPE_CHECKING:
+    from ollama import AsyncClient
+    from rich.console import Console
+
+
+class LazyConsole:
+    """Stands in for a rich Console, importing rich when first used."""
+    
+    def __init__(self):
+        self._console: Optional['Console'] = None
+        self._lock = threading.Lock()
+    
+    def get(self) -> 'Console':
+        """Return the real Console, creating it on first use."""
+        with self._lock:
+            if self._console is None:
+                from rich.console import Console
+                self._console = Console()
+            return self._console
+    
+    def __getattr__(self, name: str):
+        return getattr(self.get(), name)
+
+
+console = LazyConsole()
+
+MODULE_LOADED = time.perf_counter()
+
+# Tools that only read the filesystem and can safely run concurrently
+READ_ONLY_TOOLS = {
+    'read_file', 'read_files', 'list_files', 'search_code',
+    'find_definition', 'find_references', 'file_outline', 'semantic_search',
+    'fetch_result'
+}
+
+# Tools that modify exactly the file named by their 'filepath' argument
+FILE_WRITE_TOOLS = {'write_file', 'edit_file'}
+
+# Timing and token fields Ollama reports on the final response chunk
+USAGE_FIELDS = (
+    'total_duration', 'load_duration', 'prompt_eval_count',
+    'prompt_eval_duration', 'eval_count', 'eval_duration'
+)
+
+MAX_ITERATIONS_MESSAGE = (
+    "⚠️ Max iterations reached. The task may be too complex or the assistant may need more guidance."
+)
+
+# How long Ollama keeps the model loaded after the last request
+KEEP_ALIVE = '30m'
+
+# Default cap on the content returned by read_file
+READ_MAX_BYTES = 64 * 1024
+
+# Total content budget and file limit of one read_files call
+READ_FILES_MAX_BYTES = 128 * 1024
+READ_FILES_MAX_COUNT = 50
+
+# Files at least this large are memory-mapped instead of read
+MMAP_THRESHOLD = 1024 * 1024
+
+# Memory for speculatively read files, and how many are read per tool result
+PREFETCH_MAX_BYTES = 16 * 1024 * 1024
+PREFETCH_MAX_FILES = 8
+
+# Minimum similarity for an edit to match text that differs from the file
+FUZZY_EDIT_RATIO = 0.85
+
+# Default and maximum number of entries on one list_files page
+LIST_FILES_LIMIT = 100
+LIST_FILES_MAX_LIMIT = 1000
+
+# Most definitions and reference lines reported by the symbol tools
+FIND_DEFINITION_LIMIT = 20
+FIND_REFERENCES_LIMIT = 50
+
+# Embedding model, chunk size and batch size of the semantic_search index
+EMBEDDING_MODEL = 'nomic-embed-text'
+CHUNK_MAX_LINES = 60
+CHUNK_MAX_CHARS = 2000
+EMBED_BATCH_SIZE = 32
+
+# Default and maximum number of semantic_search results
+SEMANTIC_SEARCH_LIMIT = 5
+SEMANTIC_SEARCH_MAX_LIMIT = 20
+
+# Seconds semantic_search embeds before answering from a partial index
+SEMANTIC_INDEX_SECONDS = 10.0
+
+# Tool results longer than this go to the session's blob store; the
+# conversation gets the head and tail plus a handle for fetch_result
+TOOL_RESULT_INLINE_CHARS = 6000
+TOOL_RESULT_PREVIEW_HEAD = 2000
+TOOL_RESULT_PREVIEW_TAIL = 1000
+
+# Most lines and characters one fetch_result call returns
+FETCH_RESULT_LINES = 200
+FETCH_RESULT_MAX_CHARS = 8000
+
+# Default and maximum execute_command timeout, in seconds
+COMMAND_TIMEOUT = 30
+COMMAND_MAX_TIMEOUT = 600
+
+# Command output kept from the start and the end of each stream
+COMMAND_HEAD_CHARS = 8 * 1024
+COMMAND_TAIL_CHARS = 24 * 1024
+
+# Changes reported within this many seconds are published together
+WATCH_COALESCE_SECONDS = 0.1
+
+# Seconds between scans when the file watcher has to poll
+WATCH_POLL_INTERVAL = 2.0
+
+# Seconds an index collects changes before writing itself to disk
+INDEX_SAVE_DELAY = 2.0
+
+# Most seconds a session log record stays unsynced while a turn goes on
+SESSION_LOG_SYNC_INTERVAL = 1.0
+
+# Largest request body the session API accepts
+SERVER_MAX_BODY_BYTES = 1024 * 1024
+
+# Size and number of rotated span files kept under the cache directory
+TRACE_FILE_MAX_BYTES = 5 * 1024 * 1024
+TRACE_FILE_BACKUPS = 3
+
+# Directories never worth listing or searching
+SKIP_DIRS = {
+    'node_modules', '.git', '__pycache__', 'venv', '.venv',
+    '.idea', '.vscode', 'dist', 'build', '.egg-info'
+}
+
+
+def cache_directory(*parts: str) -> str:
+    """
+    Get (and create) a directory under the assistant's cache root.
+    
+    Args:
+        parts: Path components below the cache root
+        
+    Returns:
+        Absolute path of the directory
+    """
+    root = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    path = os.path.join(root, 'qwen-code-assistant', *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def ollama_url(host: Optional[str] = None) -> str:
+    """
+    Resolve the Ollama base URL the way the ollama client does.
+    
+    Args:
+        host: Host or URL (default: OLLAMA_HOST or localhost:11434)
+        
+    Returns:
+        URL with scheme and port
+    """
+    host = host or os.environ.get('OLLAMA_HOST') or 'localhost:11434'
+    if '://' not in host:
+        host = 'http://' + host
+    parts = urllib.parse.urlsplit(host)
+    hostname = parts.hostname or 'localhost'
+    if ':' in hostname:
+        hostname = f"[{hostname}]"
+    port = parts.port or (443 if parts.scheme == 'https' else 11434)
+    return f"{parts.scheme}://{hostname}:{port}{parts.path.rstrip('/')}"
+
+
+def model_available(model: str, names: List[str]) -> bool:
+    """
+    Check whether a model tag is among the installed models.
+    
+    Args:
+        model: Requested model, with or without a tag
+        names: Names of installed models as listed by /api/tags
+        
+    Returns:
+        True if the model is installed
+    """
+    def normalize(name: str) -> str:
+        return name if ':' in name else name + ':latest'
+    return normalize(model) in {normalize(name) for name in names}
+
+
+def check_ollama(model: str, host: Optional[str] = None, timeout: float = 5.0) -> Optional[str]:
+    """
+    Check that Ollama is reachable and has the model, without importing ollama.
+    
+    Args:
+        model: Model that will be used
+        host: Ollama URL (default: OLLAMA_HOST or http://localhost:11434)
+        timeout: Seconds to wait for the server
+        
+    Returns:
+        None if all is well, else a message (with rich markup) saying what to do
+    """
+    try:
+        with urllib.request.urlopen(ollama_url(host) + '/api/tags', timeout=timeout) as response:
+            tags = json.load(response)
+    except (urllib.error.URLError, OSError) as e:
+        return (
+            f"[red]❌ Ollama service is not running! ({getattr(e, 'reason', e)})[/red]\n"
+            "Please start Ollama: [yellow]ollama serve[/yellow]"
+        )
+    except ValueError as e:
+        return f"[red]❌ Cannot connect to Ollama: {e}[/red]\nPlease make sure Ollama is installed and running."
+    
+    names = [entry.get('model') or entry.get('name', '') for entry in tags.get('models', [])]
+    if not model_available(model, names):
+        return (
+            f"[red]❌ Model {model} is not installed.[/red]\n"
+            f"Pull it first: [yellow]ollama pull {model}[/yellow]"
+        )
+    return None
+
+
+def regex_literals(pattern: str) -> List[str]:
+    """
+    Extract substrings that every match of a regular expression must contain.
+    
+    This is deliberately conservative: anything inside groups, optional or
+    repeated characters and alternations are skipped. An empty list means
+    nothing is known and every file has to be checked.
+    
+    Args:
+        pattern: Regular expression
+        
+    Returns:
+        Required literal substrings (lower-cased, at least 3 characters)
+    """
+    if '|' in pattern:
+        return []
+    
+    literals: List[str] = []
+    current = ''
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        literal = None
+        if char == '\\' and i + 1 < len(pattern):
+            escaped = pattern[i + 1]
+            i += 2
+            if escaped.isalnum():
+                # Character classes, anchors and back-references
+                literals.append(current)
+                current = ''
+                continue
+            literal = escaped
+        elif char == '[':
+            # Skip the whole character class
+            i += 2 if pattern[i + 1:i + 2] == ']' else 1
+            while i < len(pattern) and pattern[i] != ']':
+                i += 2 if pattern[i] == '\\' else 1
+            i += 1
+            literals.append(current)
+            current = ''
+            continue
+        elif char in '*?{':
+            # The preceding character is optional
+            literals.append(current[:-1])
+            current = ''
+            if char == '{':
+                i = pattern.find('}', i) + 1 or len(pattern)
+            else:
+                i += 1
+            continue
+        elif char == '+':
+            literals.append(current)
+            current = ''
+            i += 1
+            continue
+        elif char in '()':
+            depth += 1 if char == '(' else -1
+            literals.append(current)
+            current = ''
+            i += 1
+            continue
+        elif char in '.^$':
+            literals.append(current)
+            current = ''
+            i += 1
+            continue
+        else:
+            literal = char
+            i += 1
+        
+        if depth == 0:
+            current += literal
+    literals.append(current)
+    
+    return [literal.lower() for literal in literals if len(literal) >= 3]
+
+
+# Indexes with changes not written to disk yet
+_UNSAVED_INDEXES: "weakref.WeakSet" = weakref.WeakSet()
+
+
+@atexit.register
+def _save_indexes():
+    """Write the pending changes of every index before the interpreter exits."""
+    for index in list(_UNSAVED_INDEXES):
+        index.save()
+
+
+class TreeIndex:
+    """
+    Base class of the indexes kept over one directory tree and cached on disk.
+    
+    Subclasses hold the indexed data: they list the attributes to persist
+    in PERSISTED and implement _reset(), _refresh() (re-scan the whole
+    tree) and _refresh_dirty() (re-check the files reported through
+    invalidate()), each returning whether indexed content changed. This
+    class decides which of the two an update needs, and loads and saves
+    the data.
+    
+    Without a FileWatcher, edits made outside the assistant are found by
+    re-scanning: on every use (at most every RESCAN_MIN_INTERVAL seconds)
+    while a scan takes under RESCAN_CHEAP_SECONDS, else every refresh_interval.
+    
+    Changes are written to disk INDEX_SAVE_DELAY seconds after the first
+    of them, from a timer thread, so a burst of edits costs one save and
+    queries do not wait for the disk; anything still unsaved is written at exit.
+    """
+    
+    VERSION = 1
+    CACHE_NAME = 'index'  # Directory under the cache root
+    PERSISTED: tuple = ()
+    RESCAN_MIN_INTERVAL = 0.5
+    RESCAN_CHEAP_SECONDS = 0.1
+    
+    def __init__(self, root: str, refresh_interval: float = 10.0):
+        """
+        Create the index for a directory (loaded or built on first use).
+        
+        Args:
+            root: Directory tree to index
+            refresh_interval: Seconds between re-scans of an unwatched tree
+                whose scans are too slow to run on every use
+        """
+        self.root = root
+        self.refresh_interval = refresh_interval
+        digest = hashlib.sha1(root.encode('utf-8')).hexdigest()[:16]
+        self.index_path = os.path.join(cache_directory(self.CACHE_NAME), f"{digest}.pickle")
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.last_refresh = 0.0
+        self.scan_seconds = 0.0  # duration of the last full re-scan
+        self.generation = 0
+        self.dirty: set = set()
+        # Set while a FileWatcher reports every change, so re-scans are only needed after lost events
+        self.watched = False
+        self.unsaved = False
+        self.save_lock = threading.Lock()  # Serializes writes to index_path
+        self._save_timer: Optional[threading.Timer] = None
+        self._reset()
+    
+    def _reset(self):
+        """Drop all indexed data."""
+        raise NotImplementedError
+    
+    def _refresh(self) -> bool:
+        """Re-scan the whole tree and clear dirty (caller holds the lock)."""
+        raise NotImplementedError
+    
+    def _refresh_dirty(self) -> bool:
+        """Re-check only the files in dirty and clear it (caller holds the lock)."""
+        raise NotImplementedError
+    
+    def _load(self):
+        """Load the index from disk if a compatible one exists."""
+        self.loaded = True
+        try:
+            with open(self.index_path, 'rb') as f:
+                data = pickle.load(f)
+            if data.get('version') != self.VERSION or data.get('root') != self.root:
+                return
+            for name in self.PERSISTED:
+                setattr(self, name, data[name])
+        except Exception:
+            self._reset()
+    
+    def _dump(self) -> bytes:
+        """Serialize the index (caller holds the lock)."""
+        data = {'version': self.VERSION, 'root': self.root}
+        data.update((name, getattr(self, name)) for name in self.PERSISTED)
+        return pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+    
+    def _schedule_save(self):
+        """Save in INDEX_SAVE_DELAY seconds unless a save is already due (caller holds the lock)."""
+        self.unsaved = True
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(INDEX_SAVE_DELAY, self.save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+            _UNSAVED_INDEXES.add(self)
+    
+    def save(self):
+        """Write the index to disk atomically if it has unsaved changes."""
+        with self.save_lock:
+            with self.lock:
+                if self._save_timer is not None:
+                    self._save_timer.cancel()
+                    self._save_timer = None
+                _UNSAVED_INDEXES.discard(self)
+                if not self.unsaved:
+                    return
+                self.unsaved = False
+                data = self._dump()
+            # Only the serializing needs the lock; queries go on during the write
+            temp_path = f"{self.index_path}.{os.getpid()}.tmp"
+            try:
+                with open(temp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_path, self.index_path)
+            except OSError:
+                pass
+    
+    def invalidate(self, path: Optional[str] = None):
+        """
+        Report a change to the tree.
+        
+        Args:
+            path: Absolute path of a modified file, or None if anything may have changed
+        """
+        with self.lock:
+            if path is None:
+                self.last_refresh = 0.0
+                return
+            relpath = os.path.relpath(os.path.abspath(path), self.root)
+            if not relpath.startswith(os.pardir):
+                self.dirty.add(relpath)
+    
+    def _stale(self) -> bool:
+        """Whether the whole tree has to be re-scanned (caller holds the lock)."""
+        if not self.last_refresh:
+            return True
+        if self.watched:
+            return False
+        age = time.monotonic() - self.last_refresh
+        return age > self.refresh_interval or (
+            age > self.RESCAN_MIN_INTERVAL and self.scan_seconds < self.RESCAN_CHEAP_SECONDS
+        )
+    
+    def _update(self):
+        """Bring the index up to date (caller holds the lock)."""
+        if not self.loaded:
+            self._load()
+        if self._stale():
+            changed = self._refresh()
+        else:
+            changed = self._refresh_dirty()
+        if changed:
+            self._changed()
+    
+    def _changed(self):
+        """Note that indexed content changed (caller holds the lock)."""
+        self.generation += 1
+        self._schedule_save()
+    
+    def update(self) -> int:
+        """
+        Bring the index up to date with the tree.
+        
+        Returns:
+            Generation number, which changes whenever indexed content changes
+        """
+        with self.lock:
+            self._update()
+            return self.generation
+
+
+class SearchIndex(TreeIndex):
+    """
+    Persistent trigram index over the text files of one directory tree.
+    
+    Lower-cased trigrams are hashed into a fixed number of buckets, and each
+    bucket keeps a bitmap of the file ids containing one of its trigrams.
+    A query ANDs the bitmaps of its trigrams to get candidate files, which
+    the caller then verifies. Changed files get a fresh id and their old id
+    is retired, so updates never have to rewrite existing bitmaps.
+    """
+    
+    BUCKETS = 8191
+    MAX_INDEXED_BYTES = 1024 * 1024
+    CACHE_NAME = 'search'
+    PERSISTED = ('files', 'paths', 'buckets', 'live', 'unindexed', 'retired')
+    
+    def _reset(self):
+        """Drop all indexed data."""
+        self.files: Dict[str, tuple] = {}  # path -> (id or -1, mtime_ns, size)
+        self.paths: List[Optional[str]] = []  # id -> path, None once retired
+        self.buckets = [bytearray() for _ in range(self.BUCKETS)]
+        self.live = bytearray()
+        self.unindexed: set = set()  # text files too large to index
+        self.retired = 0
+    
+    def _walk(self) -> Iterator[tuple]:
+        """Yield (relative path, mtime_ns, size) for every file in the tree."""
+        stack = [self.root]
+        while stack:
+            try:
+                entries = os.scandir(stack.pop())
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name not in SKIP_DIRS and not entry.name.endswith('.egg-info'):
+                                stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            stat = entry.stat(follow_symlinks=False)
+                            yield (
+                                os.path.relpath(entry.path, self.root),
+                                stat.st_mtime_ns,
+                                stat.st_size
+                            )
+                    except OSError:
+                        continue
+    
+    def _retire(self, relpath: str):
+        """Forget a file, retiring its id."""
+        file_id = self.files.pop(relpath)[0]
+        self.unindexed.discard(relpath)
+        if file_id >= 0:
+            self.live[file_id // 8] &= ~(1 << (file_id % 8)) & 0xFF
+            self.paths[file_id] = None
+            self.retired += 1
+    
+    def _index_file(self, relpath: str, mtime: int, size: int):
+        """(Re-)index a single file."""
+        if relpath in self.files:
+            self._retire(relpath)
+        
+        if size > self.MAX_INDEXED_BYTES:
+            self.files[relpath] = (-1, mtime, size)
+            self.unindexed.add(relpath)
+            return
+        
+        try:
+            with open(os.path.join(self.root, relpath), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return
+        
+        # Binary files are remembered but never searched
+        if b'\0' in data[:8192]:
+            self.files[relpath] = (-1, mtime, size)
+            return
+        
+        file_id = len(self.paths)
+        self.paths.append(relpath)
+        self.files[relpath] = (file_id, mtime, size)
+        byte, mask = file_id // 8, 1 << (file_id % 8)
+        
+        data = data.lower()
+        trigrams = {data[i:i + 3] for i in range(len(data) - 2)}
+        bitmaps = {int.from_bytes(trigram, 'little') % self.BUCKETS for trigram in trigrams}
+        for bitmap in [self.live] + [self.buckets[bucket] for bucket in bitmaps]:
+            if len(bitmap) <= byte:
+                bitmap.extend(bytes(byte + 1 - len(bitmap)))
+            bitmap[byte] |= mask
+    
+    def _refresh(self) -> bool:
+        """Re-scan the whole tree, indexing new and changed files."""
+        started = time.monotonic()
+        changed = False
+        seen = set()
+        for relpath, mtime, size in self._walk():
+            seen.add(relpath)
+            known = self.files.get(relpath)
+            if known is None or known[1:] != (mtime, size):
+                self._index_file(relpath, mtime, size)
+                changed = True
+        
+        for relpath in list(self.files):
+            if relpath not in seen:
+                self._retire(relpath)
+                changed = True
+        
+        self.dirty.clear()
+        self.last_refresh = time.monotonic()
+        self.scan_seconds = self.last_refresh - started
+        return changed
+    
+    def _refresh_dirty(self) -> bool:
+        """Re-check only the files reported as modified."""
+        changed = False
+        for relpath in self.dirty:
+            # Opening a FIFO or device would block while holding the lock
+            stat = regular_file_stat(os.path.join(self.root, relpath))
+            if stat is None:
+                if relpath in self.files:
+                    self._retire(relpath)
+                    changed = True
+                continue
+            known = self.files.get(relpath)
+            if known is None or known[1:] != (stat.st_mtime_ns, stat.st_size):
+                self._index_file(relpath, stat.st_mtime_ns, stat.st_size)
+                changed = True
+        self.dirty.clear()
+        return changed
+    
+    def _candidate_mask(self, literals: List[str]) -> int:
+        """Bitmap of the files that may contain all of the literals."""
+        mask = int.from_bytes(self.live, 'little')
+        for literal in literals:
+            data = literal.encode('utf-8').lower()
+            for i in range(len(data) - 2):
+                trigram = data[i:i + 3]
+                if max(trigram) >= 0x80:
+                    continue  # Non-ASCII case folding differs from bytes.lower()
+                bucket = self.buckets[int.from_bytes(trigram, 'little') % self.BUCKETS]
+                mask &= int.from_bytes(bucket, 'little')
+                if not mask:
+                    return 0
+        return mask
+    
+    def _changed(self):
+        """Note that indexed content changed (caller holds the lock)."""
+        # Rebuild once retired ids outnumber live ones; watched indexes
+        # only ever take the _refresh_dirty path, so _refresh cannot do it
+        if self.retired > 1000 and self.retired > len(self.paths) - self.retired:
+            self._reset()
+            for relpath, mtime, size in self._walk():
+                self._index_file(relpath, mtime, size)
+        super()._changed()
+    
+    def candidates(self, queries: List[str], regex: bool = False) -> List[str]:
+        """
+        Find the files that may match any of the queries.
+        
+        Args:
+            queries: Case-insensitive substrings or regular expressions
+            regex: Whether the queries are regular expressions
+            
+        Returns:
+            Sorted relative paths of files that still need to be verified
+        """
+        with self.lock:
+            self._update()
+            
+            mask = 0
+            for query in queries:
+                mask |= self._candidate_mask(regex_literals(query) if regex else [query])
+            
+            bits = bin(mask)[:1:-1]
+            paths = []
+            file_id = bits.find('1')
+            while file_id != -1:
+                paths.append(self.paths[file_id])
+                file_id = bits.find('1', file_id + 1)
+            return sorted(paths + list(self.unindexed))
+
+
+class ToolError(str):
+    """
+    A tool result reporting a failure.
+    
+    Tools return their errors as text for the model, like any other result;
+    the type tells callers it failed without guessing from the text, which
+    may as well be a file or command output starting with "Error".
+    """
+
+
+def optional_int(value) -> Optional[int]:
+    """
+    Convert a tool argument to an int, tolerating strings and omissions.
+    
+    Args:
+        value: Argument value as sent by the model
+        
+    Returns:
+        The integer, or None if the value is missing or not a number
+    """
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def file_stamp(path: str) -> Optional[tuple]:
+    """
+    Identify the current version of a file or directory.
+    
+    Args:
+        path: Absolute path
+        
+    Returns:
+        (mtime_ns, size, inode), or None if the path does not exist
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def regular_file_stat(path: str) -> Optional[os.stat_result]:
+    """
+    Stat a path the way the tree walks see it, without following symlinks.
+    
+    Args:
+        path: Absolute path
+        
+    Returns:
+        The stat result of a regular file; None for anything else (missing
+        files, symlinks, FIFOs, sockets, devices), which must never be opened
+    """
+    try:
+        result = os.lstat(path)
+    except OSError:
+        return None
+    return result if stat.S_ISREG(result.st_mode) else None
+
+
+def gitignore_regex(pattern: str) -> str:
+    """
+    Translate a gitignore pattern into a regular expression.
+    
+    Args:
+        pattern: Pattern without its '!' prefix or trailing '/'
+        
+    Returns:
+        Regex to fullmatch against '/'-separated paths relative to the
+        directory of the ignore file
+    """
+    # A slash anywhere but the end anchors the pattern to the ignore file's directory
+    regex = '' if '/' in pattern else '(?:.*/)?'
+    pattern = pattern.lstrip('/')
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+        elif pattern.startswith('/**', i) and i + 3 == len(pattern):
+            regex += '/.*'
+            i += 3
+        elif pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+        elif pattern[i] == '*':
+            regex += '[^/]*'
+            i += 1
+        elif pattern[i] == '?':
+            regex += '[^/]'
+            i += 1
+        elif pattern[i] == '[' and pattern.find(']', i + 2) > 0:
+            end = pattern.find(']', i + 2)
+            body = pattern[i + 1:end]
+            regex += '[' + ('^' + body[1:] if body.startswith('!') else body) + ']'
+            i = end + 1
+        elif pattern[i] == '\\' and i + 1 < len(pattern):
+            regex += re.escape(pattern[i + 1])
+            i += 2
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return regex
+
+
+class IgnoreRules:
+    """The compiled rules of one .gitignore or .ignore file."""
+    
+    def __init__(self, base: str, lines: List[str]):
+        """
+        Compile the rules.
+        
+        Args:
+            base: Directory of the ignore file relative to the walk root,
+                '/'-separated with a trailing slash ('' for the root)
+            lines: Lines of the ignore file
+        """
+        self.base = base
+        self.rules = []
+        for line in lines:
+            if not line.endswith('\\ '):
+                line = line.rstrip()
+            if not line or line.startswith('#'):
+                continue
+            negated = line.startswith('!')
+            if negated:
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            if not line:
+                continue
+            try:
+                self.rules.append((re.compile(gitignore_regex(line)), negated, dir_only))
+            except re.error:
+                # Git skips patterns it cannot parse, such as '[z-a]'
+                continue
+        
+        # One combined pattern rejects the common case of no rule matching
+        self.any = re.compile('|'.join(f'(?:{regex.pattern})' for regex, _, _ in self.rules) or '(?!)')
+    
+    def match(self, path: str, is_dir: bool) -> Optional[bool]:
+        """
+        Apply the rules to a path.
+        
+        Args:
+            path: '/'-separated path relative to the walk root
+            is_dir: Whether the path is a directory
+            
+        Returns:
+            True if ignored, False if re-included by a '!' rule, None if no rule applies
+        """
+        if not path.startswith(self.base):
+            return None
+        path = path[len(self.base):]
+        if not self.any.fullmatch(path):
+            return None
+        # The last matching rule wins
+        for regex, negated, dir_only in reversed(self.rules):
+            if (is_dir or not dir_only) and regex.fullmatch(path):
+                return not negated
+        return None
+
+
+class TreeWalker:
+    """
+    Walks a directory tree with os.scandir, honoring .gitignore and .ignore files.
+    
+    Entries are visited depth-first in name order, so a walk can stop as soon
+    as enough files were seen and later pages come out the same way. Rules
+    from ignore files above the walked directory (up to the repository root)
+    apply as well, and ignored directories are never entered.
+    """
+    
+    IGNORE_FILES = ('.gitignore', '.ignore')
+    
+    def __init__(self, top: str, boundary: str, max_depth: Optional[int] = None, extensions: Optional[List[str]] = None):
+        """
+        Prepare a walk.
+        
+        Args:
+            top: Directory to walk
+            boundary: Outermost directory whose ignore files apply when no
+                repository root is found above top
+            max_depth: Deepest level to visit; 1 lists only top's own files (default: unlimited)
+            extensions: Only yield files with these extensions (e.g. ['.py', 'ts'])
+        """
+        self.top = os.path.abspath(top)
+        self.max_depth = max_depth
+        self.extensions = tuple(
+            ('' if ext.startswith('.') else '.') + ext.lower() for ext in extensions or []
+        ) or None
+        # Stamps of the directories and ignore files the walk read, each
+        # taken before reading it, for caching its result
+        self.stamps: Dict[str, Optional[tuple]] = {}
+        self.root = self._find_root(os.path.abspath(boundary))
+        self.rules: List[IgnoreRules] = []
+        # Rules in effect inside each directory, for includes()
+        self._directory_rules: Dict[str, List[IgnoreRules]] = {}
+        
+        exclude = os.path.join(self.root, '.git', 'info', 'exclude')
+        self.rules = self._load(exclude, '', self.rules)
+        ancestors = []
+        directory = self.top
+        while directory != self.root and directory.startswith(self.root + os.sep):
+            directory = os.path.dirname(directory)
+            ancestors.append(directory)
+        for directory in reversed(ancestors):
+            self.rules = self._load_directory(directory, self.rules)
+    
+    def _find_root(self, boundary: str) -> str:
+        """Return the repository root above top, else boundary (or top if outside it)."""
+        directory = self.top
+        while True:
+            if os.path.exists(os.path.join(directory, '.git')):
+                return directory
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                break
+            directory = parent
+        if self.top == boundary or self.top.startswith(boundary + os.sep):
+            return boundary
+        return self.top
+    
+    def _relative(self, path: str) -> str:
+        """Return path relative to the root, '/'-separated."""
+        relpath = os.path.relpath(path, self.root)
+        return '' if relpath == '.' else relpath.replace(os.sep, '/')
+    
+    def _load(self, path: str, base: str, rules: List[IgnoreRules]) -> List[IgnoreRules]:
+        """Return rules extended by the ignore file at path, if it exists."""
+        stamp = file_stamp(path)
+        try:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return rules
+        self.stamps[path] = stamp
+        compiled = IgnoreRules(base, lines)
+        return rules + [compiled] if compiled.rules else rules
+    
+    def _load_directory(self, directory: str, rules: List[IgnoreRules], names=None) -> List[IgnoreRules]:
+        """Return rules extended by the ignore files of a directory."""
+        relpath = self._relative(directory)
+        base = relpath + '/' if relpath else ''
+        for name in self.IGNORE_FILES:
+            if names is None or name in names:
+                rules = self._load(os.path.join(directory, name), base, rules)
+        return rules
+    
+    @staticmethod
+    def _ignored(path: str, is_dir: bool, rules: List[IgnoreRules]) -> bool:
+        """Apply rules from the outermost ignore file inwards; later decisions win."""
+        ignored = False
+        for compiled in rules:
+            decision = compiled.match(path, is_dir)
+            if decision is not None:
+                ignored = decision
+        return ignored
+    
+    def includes(self, path: str) -> bool:
+        """
+        Check whether walk() would yield a file, without walking the tree.
+        
+        Args:
+            path: Absolute path of a file
+            
+        Returns:
+            False if the file is outside top, too deep, filtered out by
+            extension, hidden, or ignored (itself or through a directory)
+        """
+        relpath = os.path.relpath(os.path.abspath(path), self.top)
+        parts = relpath.split(os.sep)
+        if relpath == '.' or parts[0] == os.pardir:
+            return False
+        if self.max_depth is not None and len(parts) > self.max_depth:
+            return False
+        if self.extensions is not None and not parts[-1].lower().endswith(self.extensions):
+            return False
+        
+        rules = self.rules
+        directory = self.top
+        for position, name in enumerate(parts):
+            is_dir = position < len(parts) - 1
+            if is_dir and (name in SKIP_DIRS or name.endswith('.egg-info')):
+                return False
+            if not is_dir and name.startswith('.'):
+                return False
+            if directory not in self._directory_rules:
+                self._directory_rules[directory] = self._load_directory(directory, rules)
+            rules = self._directory_rules[directory]
+            if rules and self._ignored(self._relative(os.path.join(directory, name)), is_dir, rules):
+                return False
+            directory = os.path.join(directory, name)
+        return True
+    
+    def walk(self) -> Iterator[tuple]:
+        """
+        Walk the tree.
+        
+        Yields:
+            (os.DirEntry, depth) for every file that is not ignored
+        """
+        yield from self._walk_directory(self.top, 1, self.rules)
+    
+    def _walk_directory(self, directory: str, depth: int, rules: List[IgnoreRules]) -> Iterator[tuple]:
+        """Yield the files below one directory."""
+        self.stamps[directory] = file_stamp(directory)
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            return
+        
+        rules = self._load_directory(directory, rules, {entry.name for entry in entries})
+        prefix = self._relative(directory)
+        prefix = prefix + '/' if prefix else ''
+        
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if is_dir:
+                    if entry.name in SKIP_DIRS or entry.name.endswith('.egg-info'):
+                        continue
+                elif entry.name.startswith('.') or not entry.is_file(follow_symlinks=False):
+                    continue
+            except OSError:
+                continue
+            if rules and self._ignored(prefix + entry.name, is_dir, rules):
+                continue
+            
+            if is_dir:
+                if self.max_depth is None or depth < self.max_depth:
+                    yield from self._walk_directory(entry.path, depth + 1, rules)
+            elif self.extensions is None or entry.name.lower().endswith(self.extensions):
+                yield entry, depth
+
+
+def format_size(size: float) -> str:
+    """
+    Format a byte count for people.
+    
+    Args:
+        size: Number of bytes
+        
+    Returns:
+        E.g. '512 B' or '3.4 MB'
+    """
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+class _PythonSymbolVisitor(ast.NodeVisitor):
+    """Collects the definitions and identifier uses of a Python module."""
+    
+    def __init__(self):
+        self.definitions: List[tuple] = []
+        self.references: Dict[str, set] = {}
+        self.scope: List[tuple] = []  # (qualified name, kind) of enclosing definitions
+    
+    def _reference(self, name: str, line: int):
+        self.references.setdefault(name, set()).add(line)
+    
+    def _define(self, node, name: str, kind: str):
+        container = self.scope[-1][0] if self.scope else None
+        qualname = f"{container}.{name}" if container else name
+        self.definitions.append((name, kind, node.lineno, getattr(node, 'end_lineno', None), qualname))
+        return qualname
+    
+    def _visit_function(self, node):
+        kind = 'method' if self.scope and self.scope[-1][1] == 'class' else 'function'
+        qualname = self._define(node, node.name, kind)
+        for decorator in node.decorator_list:
+            self.visit(decorator)
+        self.visit(node.args)
+        if node.returns:
+            self.visit(node.returns)
+        self.scope.append((qualname, kind))
+        for child in node.body:
+            self.visit(child)
+        self.scope.pop()
+    
+    visit_FunctionDef = _visit_function
+    visit_AsyncFunctionDef = _visit_function
+    
+    def visit_ClassDef(self, node):
+        qualname = self._define(node, node.name, 'class')
+        for child in node.decorator_list + node.bases + node.keywords:
+            self.visit(child)
+        self.scope.append((qualname, 'class'))
+        for child in node.body:
+            self.visit(child)
+        self.scope.pop()
+    
+    def _define_target(self, target):
+        if isinstance(target, ast.Name):
+            self._define(target, target.id, 'variable')
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            for element in target.elts:
+                self._define_target(element)
+        elif isinstance(target, ast.Starred):
+            self._define_target(target.value)
+    
+    def _visit_assignment(self, node):
+        # Module and class attributes are definitions; locals are not
+        if not self.scope or self.scope[-1][1] == 'class':
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            for target in targets:
+                self._define_target(target)
+        self.generic_visit(node)
+    
+    visit_Assign = _visit_assignment
+    visit_AnnAssign = _visit_assignment
+    
+    def visit_Name(self, node):
+        self._reference(node.id, node.lineno)
+    
+    def visit_Attribute(self, node):
+        self._reference(node.attr, node.end_lineno or node.lineno)
+        self.visit(node.value)
+    
+    def visit_Import(self, node):
+        for alias in node.names:
+            for part in alias.name.split('.'):
+                self._reference(part, node.lineno)
+    
+    def visit_ImportFrom(self, node):
+        for part in (node.module or '').split('.') + [alias.name for alias in node.names]:
+            if part and part != '*':
+                self._reference(part, node.lineno)
+    
+    def visit_arg(self, node):
+        if node.annotation:
+            self.visit(node.annotation)
+
+
+def parse_python_symbols(text: str) -> tuple:
+    """
+    Extract symbols from Python source with the ast module.
+    
+    Args:
+        text: Source code
+        
+    Returns:
+        (definitions, references): definitions are (name, kind, line,
+        end line, qualified name) tuples; references map identifiers to the
+        sorted lines using them
+    """
+    visitor = _PythonSymbolVisitor()
+    visitor.visit(ast.parse(text))
+    references = {name: sorted(lines) for name, lines in visitor.references.items()}
+    return visitor.definitions, references
+
+
+# Definition patterns of languages without a bundled parser; the first
+# group is the name
+REGEX_SYMBOL_PATTERNS = {
+    'javascript': [
+        ('function', r'^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*([A-Za-z_$][\w$]*)'),
+        ('class', r'^\s*(?:export\s+)?(?:default\s+)?(?:abstract\s+)?class\s+([A-Za-z_$][\w$]*)'),
+        ('function', r'^\s*(?:export\s+)?(?:const|let|var)\s+([A-Za-z_$][\w$]*)\s*=\s*(?:async\s+)?(?:function\b|\([^)]*\)\s*=>|[A-Za-z_$][\w$]*\s*=>)'),
+        ('type', r'^\s*(?:export\s+)?(?:declare\s+)?(?:interface|type|enum)\s+([A-Za-z_$][\w$]*)'),
+        ('method', r'^\s+(?:(?:public|private|protected|static|async|readonly|override|get|set)\s+)*(?!(?:if|for|while|switch|catch|return|function)\b)([A-Za-z_$][\w$]*)\s*\([^)]*\)\s*(?::[^{]*)?\{\s*$'),
+    ],
+    'go': [
+        ('function', r'^func\s+(?:\([^)]*\)\s*)?([A-Za-z_]\w*)'),
+        ('type', r'^type\s+([A-Za-z_]\w*)'),
+    ],
+    'rust': [
+        ('function', r'^\s*(?:pub(?:\([^)]*\))?\s+)?(?:const\s+)?(?:async\s+)?(?:unsafe\s+)?(?:extern\s+"[^"]*"\s+)?fn\s+([A-Za-z_]\w*)'),
+        ('type', r'^\s*(?:pub(?:\([^)]*\))?\s+)?(?:struct|enum|trait|type|union)\s+([A-Za-z_]\w*)'),
+        ('module', r'^\s*(?:pub(?:\([^)]*\))?\s+)?mod\s+([A-Za-z_]\w*)'),
+    ],
+    'java': [
+        ('class', r'^\s*(?:(?:public|private|protected|abstract|final|static|sealed|data|open|internal)\s+)*(?:class|interface|enum|record|object)\s+([A-Za-z_]\w*)'),
+        ('method', r'^\s*(?:(?:public|private|protected|static|final|abstract|synchronized|native|override|suspend)\s+)+(?:<[^>]*>\s*)?(?:[\w<>\[\],.?]+\s+)?([A-Za-z_]\w*)\s*\('),
+        ('function', r'^\s*(?:(?:private|internal|public|inline|suspend)\s+)*fun\s+(?:<[^>]*>\s*)?(?:[\w.]+\.)?([A-Za-z_]\w*)'),
+    ],
+    'c': [
+        ('type', r'^\s*(?:typedef\s+)?(?:struct|union|enum|class|namespace)\s+([A-Za-z_]\w*)\s*(?:[:{]|$)'),
+        ('function', r'^(?!\s*(?:return|if|for|while|switch|else)\b)[A-Za-z_][\w\s\*&:<>,]*?[\s\*&]([A-Za-z_]\w*(?:::~?[A-Za-z_]\w*)?)\s*\([^;]*$'),
+        ('macro', r'^\s*#\s*define\s+([A-Za-z_]\w*)'),
+    ],
+    'ruby': [
+        ('method', r'^\s*def\s+(?:self\.)?([A-Za-z_]\w*[?!=]?)'),
+        ('class', r'^\s*(?:class|module)\s+([A-Z]\w*(?:::[A-Z]\w*)*)'),
+    ],
+}
+
+_IDENTIFIER = re.compile(r'[A-Za-z_$][\w$]*')
+_compiled_symbol_patterns: Dict[str, List[tuple]] = {}
+
+
+def parse_regex_symbols(language: str, text: str) -> tuple:
+    """
+    Extract symbols with the line patterns of a language.
+    
+    Args:
+        language: Key of REGEX_SYMBOL_PATTERNS
+        text: Source code
+        
+    Returns:
+        (definitions, references) as for parse_python_symbols; end lines
+        and containers are unknown
+    """
+    patterns = _compiled_symbol_patterns.get(language)
+    if patterns is None:
+        patterns = [(kind, re.compile(pattern)) for kind, pattern in REGEX_SYMBOL_PATTERNS[language]]
+        _compiled_symbol_patterns[language] = patterns
+    
+    definitions = []
+    references: Dict[str, List[int]] = {}
+    for number, line in enumerate(text.split('\n'), 1):
+        for kind, pattern in patterns:
+            match = pattern.match(line)
+            if match:
+                name = match.group(1)
+                definitions.append((name.split('::')[-1], kind, number, None, name))
+                break
+        for name in set(_IDENTIFIER.findall(line)):
+            references.setdefault(name, []).append(number)
+    return definitions, references
+
+
+# Symbol parser for each file extension; add entries to support more languages
+SYMBOL_PARSERS: Dict[str, Callable[[str], tuple]] = {'.py': parse_python_symbols, '.pyi': parse_python_symbols}
+for _language, _extensions in [
+    ('javascript', ('.js', '.jsx', '.mjs', '.cjs', '.ts', '.tsx')),
+    ('go', ('.go',)),
+    ('rust', ('.rs',)),
+    ('java', ('.java', '.kt', '.kts', '.cs', '.scala')),
+    ('c', ('.c', '.h', '.cc', '.cpp', '.cxx', '.hpp', '.hh')),
+    ('ruby', ('.rb',)),
+]:
+    for _extension in _extensions:
+        SYMBOL_PARSERS[_extension] = partial(parse_regex_symbols, _language)
+
+
+def parse_symbols_file(path: str) -> Optional[tuple]:
+    """
+    Read and parse one source file; runs in worker processes.
+    
+    Args:
+        path: Absolute path of the file
+        
+    Returns:
+        (definitions, references), where each definition also carries its
+        stripped source line, or None if the file cannot be parsed
+    """
+    parser = SYMBOL_PARSERS.get(os.path.splitext(path)[1].lower())
+    if parser is None:
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        definitions, references = parser(text)
+    except (OSError, UnicodeDecodeError, SyntaxError, ValueError, RecursionError):
+        return None
+    
+    lines = text.split('\n')
+    definitions = [
+        (name, kind, line, end_line, qualname, lines[line - 1].strip()[:160])
+        for name, kind, line, end_line, qualname in definitions
+    ]
+    return definitions, references
+
+
+class SymbolIndex(TreeIndex):
+    """
+    Persistent index of the definitions and identifier uses in one directory tree.
+    
+    Files are parsed by the parser registered in SYMBOL_PARSERS for their
+    extension. Only new and changed files (by mtime and size) are parsed
+    again; large batches are spread over a process pool.
+    """
+    
+    MAX_PARSED_BYTES = 1024 * 1024
+    PARALLEL_THRESHOLD = 256
+    CACHE_NAME = 'symbols'
+    PERSISTED = ('files',)
+    
+    def _reset(self):
+        """Drop all indexed data."""
+        # path -> (mtime_ns, size, definitions, references)
+        self.files: Dict[str, tuple] = {}
+        self._by_name: Optional[Dict[str, List[tuple]]] = None
+    
+    def _parse(self, changed: List[tuple]):
+        """Parse (relative path, mtime_ns, size) entries and store the results."""
+        paths = [os.path.join(self.root, relpath) for relpath, _, _ in changed]
+        results = None
+        workers = min(os.cpu_count() or 1, 16)
+        if len(paths) >= self.PARALLEL_THRESHOLD and workers > 1:
+            try:
+                # spawn: forking a process that runs threads is not safe
+                with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                    results = list(pool.map(
+                        parse_symbols_file, paths, chunksize=max(16, len(paths) // (workers * 4))
+                    ))
+            except Exception:
+                results = None
+        if results is None:
+            results = [parse_symbols_file(path) for path in paths]
+        
+        for (relpath, mtime, size), result in zip(changed, results):
+            definitions, references = result or ([], {})
+            self.files[relpath] = (mtime, size, definitions, references)
+    
+    def _refresh(self) -> bool:
+        """Re-scan the whole tree, parsing new and changed files."""
+        started = time.monotonic()
+        walker = TreeWalker(self.root, self.root, extensions=list(SYMBOL_PARSERS))
+        seen = set()
+        changed = []
+        oversized = False
+        for entry, _ in walker.walk():
+            try:
+                stat = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            relpath = os.path.relpath(entry.path, self.root)
+            seen.add(relpath)
+            known = self.files.get(relpath)
+            if known is None or known[:2] != (stat.st_mtime_ns, stat.st_size):
+                if stat.st_size <= self.MAX_PARSED_BYTES:
+                    changed.append((relpath, stat.st_mtime_ns, stat.st_size))
+                else:
+                    self.files[relpath] = (stat.st_mtime_ns, stat.st_size, [], {})
+                    oversized = True
+        
+        removed = [relpath for relpath in self.files if relpath not in seen]
+        for relpath in removed:
+            del self.files[relpath]
+        self.scan_seconds = time.monotonic() - started
+        self._parse(changed)
+        
+        self.dirty.clear()
+        self.last_refresh = time.monotonic()
+        return bool(changed or removed or oversized)
+    
+    def _refresh_dirty(self) -> bool:
+        """Re-parse only the files reported as modified."""
+        if any(os.path.basename(relpath) in TreeWalker.IGNORE_FILES for relpath in self.dirty):
+            # Changed ignore rules can add or drop any file
+            return self._refresh()
+        changed = []
+        removed = False
+        walker = TreeWalker(self.root, self.root, extensions=list(SYMBOL_PARSERS)) if self.dirty else None
+        for relpath in self.dirty:
+            if os.path.splitext(relpath)[1].lower() not in SYMBOL_PARSERS:
+                continue
+            path = os.path.join(self.root, relpath)
+            # Only what a full walk would yield, so ignored files never get in
+            stat = regular_file_stat(path) if walker.includes(path) else None
+            if stat is None:
+                removed = self.files.pop(relpath, None) is not None or removed
+                continue
+            known = self.files.get(relpath)
+            if known is None or known[:2] != (stat.st_mtime_ns, stat.st_size):
+                changed.append((relpath, stat.st_mtime_ns, stat.st_size))
+        self._parse(changed)
+        self.dirty.clear()
+        return bool(changed) or removed
+    
+    def _changed(self):
+        """Note that indexed content changed (caller holds the lock)."""
+        self._by_name = None
+        super()._changed()
+    
+    def definitions(self, name: str) -> List[tuple]:
+        """
+        Find the definitions of a symbol.
+        
+        Args:
+            name: Plain name ('parse') or a qualified suffix ('Parser.parse')
+            
+        Returns:
+            Sorted (relative path, definition) pairs
+        """
+        with self.lock:
+            self._update()
+            if self._by_name is None:
+                self._by_name = {}
+                for relpath, (_, _, definitions, _) in self.files.items():
+                    for definition in definitions:
+                        self._by_name.setdefault(definition[0], []).append((relpath, definition))
+            
+            matches = self._by_name.get(name.split('.')[-1], [])
+            if '.' in name:
+                matches = [
+                    (relpath, definition) for relpath, definition in matches
+                    if definition[4] == name or definition[4].endswith('.' + name)
+                ]
+            return sorted(matches, key=lambda match: (match[0], match[1][2]))
+    
+    def references(self, name: str) -> List[tuple]:
+        """
+        Find the lines using an identifier.
+        
+        Args:
+            name: Identifier; for a qualified name, its last part
+            
+        Returns:
+            Sorted (relative path, lines) pairs
+        """
+        name = name.split('.')[-1]
+        with self.lock:
+            self._update()
+            return sorted(
+                (relpath, entry[3][name]) for relpath, entry in self.files.items() if name in entry[3]
+            )
+    
+    def snapshot(self) -> Dict[str, tuple]:
+        """
+        Bring the index up to date and copy its per-file data.
+        
+        Returns:
+            Mapping of relative path to (mtime_ns, size, definitions)
+        """
+        with self.lock:
+            self._update()
+            return {relpath: entry[:3] for relpath, entry in self.files.items()}
+    
+    def outline(self, relpath: str) -> Optional[List[tuple]]:
+        """
+        Return the definitions of one indexed file.
+        
+        Args:
+            relpath: Path relative to the root
+            
+        Returns:
+            Definitions in line order, or None if the file is not indexed
+        """
+        with self.lock:
+            self._update()
+            if relpath not in self.files:
+                # Ignored files stay out of the index; the caller parses them
+                return None
+            # Re-check the file itself, whose edits may not have been reported yet
+            self.dirty.add(relpath)
+            self._update()
+            entry = self.files.get(relpath)
+            return None if entry is None else sorted(entry[2], key=lambda definition: definition[2])
+
+
+def numpy_available() -> bool:
+    """Whether the optional NumPy dependency (needed by semantic_search) is installed."""
+    return importlib.util.find_spec('numpy') is not None
+
+
+class OllamaEmbeddings:
+    """Embeds text with a local Ollama embedding model."""
+    
+    def __init__(self, client, model: str = EMBEDDING_MODEL):
+        """
+        Create the backend.
+        
+        Args:
+            client: ollama.Client to use
+            model: Embedding model (default: EMBEDDING_MODEL)
+        """
+        self.client = client
+        self.model = model
+        self.name = model
+    
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed a batch of texts.
+        
+        Args:
+            texts: Texts to embed
+            
+        Returns:
+            One vector per text
+        """
+        return [list(vector) for vector in self.client.embed(model=self.model, input=texts)['embeddings']]
+
+
+class HashEmbeddings:
+    """
+    Deterministic bag-of-words embeddings that need no model.
+    
+    Identifiers are split into words (snake_case and camelCase) and hashed
+    into a fixed number of signed dimensions, so texts sharing words come
+    out similar. Meant for tests and benchmarks.
+    """
+    
+    WORD = re.compile(r'[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+')
+    
+    def __init__(self, dimensions: int = 256):
+        """
+        Create the backend.
+        
+        Args:
+            dimensions: Length of the vectors
+        """
+        self.dimensions = dimensions
+        self.name = f"hash-{dimensions}"
+    
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed a batch of texts.
+        
+        Args:
+            texts: Texts to embed
+            
+        Returns:
+            One vector per text
+        """
+        vectors = []
+        for text in texts:
+            vector = [0.0] * self.dimensions
+            for word in self.WORD.findall(text):
+                digest = hashlib.blake2b(word.lower().encode('utf-8'), digest_size=8).digest()
+                value = int.from_bytes(digest, 'little')
+                vector[value % self.dimensions] += 1.0 if value >> 63 else -1.0
+            vectors.append(vector)
+        return vectors
+
+
+def chunk_source(text: str, definitions: List[tuple]) -> List[tuple]:
+    """
+    Split a source file into function- and class-level chunks.
+    
+    Definitions with a known end (Python) become one chunk each; a class
+    chunk covers its header and the start of its body, while its methods get
+    their own chunks. Otherwise a definition runs until the next one. Files
+    without definitions are cut into windows.
+    
+    Args:
+        text: File content
+        definitions: Definitions as stored in the symbol index
+        
+    Returns:
+        (first line, last line, title) tuples, 1-based and inclusive
+    """
+    line_count = text.count('\n') + 1
+    definitions = sorted(
+        (d for d in definitions if d[1] != 'variable'), key=lambda definition: definition[2]
+    )
+    if not definitions:
+        return [
+            (start, min(start + CHUNK_MAX_LINES - 1, line_count), '')
+            for start in range(1, line_count + 1, CHUNK_MAX_LINES)
+        ]
+    
+    chunks = []
+    for position, (_, kind, line, end_line, qualname, _) in enumerate(definitions):
+        if end_line is None:
+            following = definitions[position + 1][2] - 1 if position + 1 < len(definitions) else line_count
+            end_line = max(line, following)
+        chunks.append((line, min(end_line, line + CHUNK_MAX_LINES - 1), f"{kind} {qualname}"))
+    
+    # Module docstrings and imports before the first definition
+    if definitions[0][2] > 3:
+        chunks.insert(0, (1, min(definitions[0][2] - 1, CHUNK_MAX_LINES), 'module'))
+    return chunks
+
+
+class EmbeddingIndex:
+    """
+    Embedding vectors of the function- and class-level chunks of a directory tree.
+    
+    Files and their definitions come from the tree's SymbolIndex, so only
+    files it reports as new or changed are chunked and embedded again (in
+    batches). An update can be limited in time; the files it did not get
+    to stay pending for the next one. Vectors are kept unit-length in one
+    float32 NumPy matrix that is saved next to a pickle of the chunk
+    metadata; a search is one matrix-vector product.
+    """
+    
+    VERSION = 1
+    
+    def __init__(self, symbols: SymbolIndex, backend):
+        """
+        Create the index (loaded or built on first use).
+        
+        Args:
+            symbols: Symbol index of the tree
+            backend: Object with a name and an embed(texts) method, e.g. OllamaEmbeddings
+        """
+        self.symbols = symbols
+        self.root = symbols.root
+        self.backend = backend
+        digest = hashlib.sha1(f"{self.root}\0{backend.name}".encode('utf-8')).hexdigest()[:16]
+        base = os.path.join(cache_directory('embeddings'), digest)
+        self.matrix_path = base + '.npy'
+        self.meta_path = base + '.pickle'
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.synced = -1  # symbol index generation last synced with
+        self.generation = 0
+        self.pending = 0  # files left to embed by the last update
+        self._updater: Optional[threading.Thread] = None
+        self._reset()
+    
+    def _reset(self):
+        """Drop all embedded data."""
+        import numpy as np
+        
+        self.files: Dict[str, tuple] = {}  # path -> (mtime_ns, size, rows)
+        self.chunks: List[Optional[tuple]] = []  # row -> (path, first line, last line, title)
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.live = np.zeros(0, dtype=bool)
+    
+    def _load(self):
+        """Load the index from disk if a compatible one exists."""
+        import numpy as np
+        
+        self.loaded = True
+        try:
+            with open(self.meta_path, 'rb') as f:
+                data = pickle.load(f)
+            matrix = np.load(self.matrix_path)
+            if (
+                data.get('version') != self.VERSION or data.get('root') != self.root
+                or len(data['chunks']) != matrix.shape[0]
+            ):
+                return
+            self.files = data['files']
+            self.chunks = data['chunks']
+            self.matrix = matrix
+            self.live = np.array([chunk is not None for chunk in self.chunks], dtype=bool)
+        except Exception:
+            self._reset()
+    
+    def _save(self):
+        """Write the matrix and the metadata to disk atomically."""
+        import numpy as np
+        
+        try:
+            for path, write in [
+                (self.matrix_path, lambda f: np.save(f, self.matrix)),
+                (self.meta_path, lambda f: pickle.dump(
+                    {'version': self.VERSION, 'root': self.root, 'files': self.files, 'chunks': self.chunks},
+                    f, protocol=pickle.HIGHEST_PROTOCOL
+                )),
+            ]:
+                temp_path = f"{path}.{os.getpid()}.tmp"
+                with open(temp_path, 'wb') as f:
+                    write(f)
+                os.replace(temp_path, path)
+        except OSError:
+            pass
+    
+    def _embed(self, texts: List[str]):
+        """Embed texts in batches and return unit-length float32 rows."""
+        import numpy as np
+        
+        vectors = []
+        for start in range(0, len(texts), EMBED_BATCH_SIZE):
+            vectors.extend(self.backend.embed(texts[start:start + EMBED_BATCH_SIZE]))
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+    
+    def _chunks(self, relpath: str, entry: tuple) -> Iterator[tuple]:
+        """
+        Cut a file into chunks for embedding.
+        
+        Args:
+            relpath: Path relative to the root
+            entry: Its symbol index entry (mtime_ns, size, definitions, references)
+            
+        Yields:
+            ((path, first line, last line, title), text to embed) pairs
+        """
+        lines = []
+        if entry[1] <= SymbolIndex.MAX_PARSED_BYTES:
+            try:
+                with open(os.path.join(self.root, relpath), 'r', encoding='utf-8') as f:
+                    lines = f.read().split('\n')
+            except (OSError, UnicodeDecodeError):
+                pass
+        for start, end, title in chunk_source('\n'.join(lines), entry[2]) if lines else []:
+            body = '\n'.join(lines[start - 1:end])
+            yield (relpath, start, end, title), f"{relpath} {title}\n{body}"[:CHUNK_MAX_CHARS]
+    
+    def _drop(self, relpath: str):
+        """Retire the rows of a file (caller holds the lock)."""
+        for row in self.files.pop(relpath, (None, None, []))[2]:
+            self.chunks[row] = None
+            self.live[row] = False
+    
+    def _update(self, seconds: Optional[float] = None):
+        """
+        Bring the index up to date (caller holds the lock).
+        
+        Args:
+            seconds: Start no further batch after this long (the first always
+                runs, so every call makes progress); the rest is left in
+                pending (default: no limit)
+        """
+        import numpy as np
+        
+        if not self.loaded:
+            self._load()
+        generation = self.symbols.update()
+        if generation == self.synced:
+            return
+        deadline = None if seconds is None else time.monotonic() + seconds
+        
+        snapshot = self.symbols.snapshot()
+        changed = [
+            relpath for relpath, entry in snapshot.items()
+            if self.files.get(relpath, (None, None))[:2] != entry[:2]
+        ]
+        removed = [relpath for relpath in self.files if relpath not in snapshot]
+        for relpath in removed:
+            self._drop(relpath)
+        
+        position = stored = 0
+        try:
+            while position < len(changed):
+                # A batch of whole files, embedded before anything is replaced
+                # so that a failing backend leaves their old rows in place
+                batch, new_chunks, texts = [], [], []
+                while position < len(changed) and len(texts) < EMBED_BATCH_SIZE:
+                    batch.append(changed[position])
+                    for chunk, text in self._chunks(changed[position], snapshot[changed[position]]):
+                        new_chunks.append(chunk)
+                        texts.append(text)
+                    position += 1
+                vectors = self._embed(texts) if texts else None
+                
+                rows: Dict[str, List[int]] = {relpath: [] for relpath in batch}
+                for row, chunk in enumerate(new_chunks, len(self.chunks)):
+                    rows[chunk[0]].append(row)
+                for relpath in batch:
+                    self._drop(relpath)
+                    self.files[relpath] = (snapshot[relpath][0], snapshot[relpath][1], rows[relpath])
+                if vectors is not None:
+                    self.chunks.extend(new_chunks)
+                    self.matrix = vectors if not self.matrix.size else np.vstack([self.matrix, vectors])
+                    self.live = np.concatenate([self.live, np.ones(len(new_chunks), dtype=bool)])
+                stored = position
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+        finally:
+            self.pending = len(changed) - stored
+            
+            # Drop dead rows once they outnumber live ones
+            dead = len(self.chunks) - int(self.live.sum())
+            if dead > 1000 and dead > len(self.chunks) // 2:
+                keep = np.flatnonzero(self.live)
+                renumber = {int(old): new for new, old in enumerate(keep)}
+                self.chunks = [self.chunks[old] for old in keep]
+                self.matrix = self.matrix[keep]
+                self.live = np.ones(len(keep), dtype=bool)
+                self.files = {
+                    relpath: (mtime, size, [renumber[row] for row in file_rows])
+                    for relpath, (mtime, size, file_rows) in self.files.items()
+                }
+            
+            if not self.pending:
+                self.synced = generation
+            if stored or removed:
+                self.generation += 1
+                self._save()
+    
+    def update(self, seconds: Optional[float] = None) -> int:
+        """
+        Bring the index up to date with the tree.
+        
+        Args:
+            seconds: Time limit; files left over are counted in pending
+                (default: no limit)
+        
+        Returns:
+            Generation number, which changes whenever embedded content changes
+        """
+        with self.lock:
+            self._update(seconds)
+            return self.generation
+    
+    def update_in_background(self):
+        """Embed the pending files on a background thread, releasing the lock between slices."""
+        def run():
+            try:
+                while self.pending:
+                    self.update(SEMANTIC_INDEX_SECONDS)
+            except Exception:
+                # The next semantic_search reports the error
+                pass
+        
+        with self.lock:
+            if not self.pending or (self._updater is not None and self._updater.is_alive()):
+                return
+            self._updater = threading.Thread(target=run, name="embed", daemon=True)
+            self._updater.start()
+    
+    def search(self, query: str, limit: int = SEMANTIC_SEARCH_LIMIT, file_pattern: Optional[str] = None) -> List[tuple]:
+        """
+        Find the chunks most similar to a query, among those embedded so far.
+        
+        Call update() first to bring the index up to date.
+        
+        Args:
+            query: Natural-language description of the code
+            limit: Number of results
+            file_pattern: Only consider files matching this pattern (e.g. *.py)
+            
+        Returns:
+            (cosine similarity, path, first line, last line, title) tuples, best first
+        """
+        import numpy as np
+        
+        with self.lock:
+            if not self.live.any():
+                return []
+            scores = self.matrix @ self._embed([query])[0]
+            scores[~self.live] = -np.inf
+            if file_pattern:
+                match_path = '/' in file_pattern or os.sep in file_pattern
+                for row in np.flatnonzero(self.live):
+                    relpath = self.chunks[row][0]
+                    name = relpath.replace(os.sep, '/') if match_path else os.path.basename(relpath)
+                    if not fnmatch.fnmatch(name, file_pattern):
+                        scores[row] = -np.inf
+            
+            limit = min(limit, len(scores))
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            top = top[np.argsort(-scores[top])]
+            return [
+                (float(scores[row]),) + self.chunks[row]
+                for row in top if np.isfinite(scores[row])
+            ]
+
+
+class FileWatcher:
+    """
+    Background watcher that reports changed files under a directory tree.
+    
+    On Linux the tree is watched with inotify (through ctypes, so nothing
+    needs installing); elsewhere, or when inotify is unavailable or runs
+    out of watches, the tree is polled every poll_interval seconds.
+    Changes arriving within the coalesce window are published together,
+    as a set of absolute paths, or as None when events were lost and
+    anything may have changed. Directories in SKIP_DIRS are not watched.
+    """
+    
+    # Event bits from <sys/inotify.h>
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ONLYDIR = 0x1000000
+    IN_DONT_FOLLOW = 0x2000000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = (
+        IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+        IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW
+    )
+    EVENT = struct.Struct('iIII')  # wd, mask, cookie, name length
+    
+    def __init__(
+        self,
+        root: str,
+        poll_interval: float = WATCH_POLL_INTERVAL,
+        coalesce: float = WATCH_COALESCE_SECONDS,
+        use_inotify: bool = True
+    ):
+        """
+        Create a watcher (not started yet).
+        
+        Args:
+            root: Directory tree to watch
+            poll_interval: Seconds between scans when polling
+            coalesce: Seconds to wait for more events before publishing a batch
+            use_inotify: Use inotify where available (default: True)
+        """
+        self.root = os.path.abspath(root)
+        self.poll_interval = poll_interval
+        self.coalesce = coalesce
+        self.use_inotify = use_inotify
+        self.mode: Optional[str] = None  # 'inotify' or 'polling' once started
+        self.subscribers: List[Callable[[Optional[set]], None]] = []
+        self.lock = threading.Lock()
+        self.pending: set = set()
+        self.lost = False
+        self.batches = 0
+        self._fd = -1
+        self._libc = None
+        self._watches: Dict[int, str] = {}
+        self._out_of_watches = False
+        self._snapshot: Dict[str, tuple] = {}
+        self._stop = threading.Event()
+        self._wake = (-1, -1)
+        self._thread: Optional[threading.Thread] = None
+    
+    def subscribe(self, callback: Callable[[Optional[set]], None]):
+        """
+        Call a function with every published batch of changes.
+        
+        Args:
+            callback: Receives a set of absolute paths, or None if anything may have changed
+        """
+        self.subscribers.append(callback)
+    
+    def start(self) -> "FileWatcher":
+        """Start watching in a background thread."""
+        if self.use_inotify and sys.platform.startswith('linux'):
+            self._open_inotify()
+        if self.mode is None:
+            self.mode = 'polling'
+        self._thread = threading.Thread(target=self._run, name="file-watcher", daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        """Stop watching; no batches are published afterwards."""
+        self._stop.set()
+        self.subscribers = []
+        if self._thread is None:
+            self._close()
+            return
+        if self._wake[1] >= 0:
+            try:
+                os.write(self._wake[1], b'\0')
+            except OSError:
+                pass
+        self._thread.join(timeout=1.0)
+    
+    def flush(self) -> bool:
+        """
+        Publish the changes made so far right away.
+        
+        Returns:
+            True if every change up to now has been published, False when
+            polling (changes since the last scan are not known yet)
+        """
+        if self.mode != 'inotify' or self._stop.is_set():
+            return False
+        self._drain()
+        self._publish()
+        return not self._out_of_watches
+    
+    def stats(self) -> Dict:
+        """
+        Watcher state.
+        
+        Returns:
+            Mode, number of watched directories and number of published batches
+        """
+        return {'mode': self.mode, 'watches': len(self._watches), 'batches': self.batches}
+    
+    @staticmethod
+    def _skipped(name: str) -> bool:
+        """Whether a directory is left out, as in SearchIndex."""
+        return name in SKIP_DIRS or name.endswith('.egg-info')
+    
+    def _open_inotify(self):
+        """Create the inotify instance, leaving mode unset if that fails."""
+        import ctypes
+        
+        try:
+            # The interpreter's own symbols include libc
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd < 0:
+            return
+        self._libc = libc
+        self._fd = fd
+        self._wake = os.pipe()
+        self.mode = 'inotify'
+    
+    def _close(self):
+        """Release the inotify instance and the wake-up pipe."""
+        for fd in (self._fd,) + self._wake:
+            if fd >= 0:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._fd = -1
+        self._wake = (-1, -1)
+        self._watches = {}
+    
+    def _watch_tree(self, top: str, report: bool):
+        """
+        Add watches for a directory and everything below it.
+        
+        Args:
+            top: Directory to watch
+            report: Also report the files found, which may have been
+                created before their directory was watched
+                
+        Raises:
+            OSError: If the inotify watch limit is reached
+        """
+        import ctypes
+        
+        stack = [top]
+        while stack:
+            directory = stack.pop()
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), self.WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error == errno.ENOSPC:
+                    raise OSError(error, "inotify watch limit reached")
+                continue  # Gone already, or not readable
+            self._watches[wd] = directory
+            try:
+                entries = os.scandir(directory)
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not self._skipped(entry.name):
+                                stack.append(entry.path)
+                        elif report:
+                            self.pending.add(entry.path)
+                    except OSError:
+                        continue
+    
+    def _unwatch_tree(self, top: str):
+        """Drop the watches of a directory that moved away and of everything below it."""
+        prefix = top + os.sep
+        for wd, directory in list(self._watches.items()):
+            if directory == top or directory.startswith(prefix):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._watches[wd]
+    
+    def _handle(self, wd: int, mask: int, name: str):
+        """Record one inotify event (caller holds the lock)."""
+        if mask & self.IN_Q_OVERFLOW:
+            self.lost = True
+            return
+        if mask & self.IN_IGNORED:
+            self._watches.pop(wd, None)
+            return
+        directory = self._watches.get(wd)
+        if directory is None:
+            return
+        if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+            # Reported by the parent, except for the root itself
+            if directory == self.root:
+                self.lost = True
+            return
+        
+        path = os.path.join(directory, name)
+        if mask & self.IN_ISDIR:
+            if self._skipped(name):
+                return
+            if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                self._watch_tree(path, report=True)
+            elif mask & self.IN_MOVED_FROM:
+                # The files below it left without events of their own
+                self._unwatch_tree(path)
+                self.lost = True
+            return
+        self.pending.add(path)
+    
+    def _drain(self):
+        """Read every queued inotify event."""
+        with self.lock:
+            while self._fd >= 0:
+                try:
+                    data = os.read(self._fd, 64 * 1024)
+                except (BlockingIOError, InterruptedError):
+                    return
+                offset = 0
+                while offset < len(data):
+                    wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+                    start = offset + self.EVENT.size
+                    name = os.fsdecode(data[start:start + length].rstrip(b'\0'))
+                    offset = start + length
+                    try:
+                        self._handle(wd, mask, name)
+                    except OSError:
+                        self._out_of_watches = True
+                        self.lost = True
+    
+    def _publish(self, lost: bool = False):
+        """Hand the collected changes to the subscribers."""
+        with self.lock:
+            paths, lost = self.pending, self.lost or lost
+            self.pending, self.lost = set(), False
+        if not paths and not lost:
+            return
+        self.batches += 1
+        for callback in list(self.subscribers):
+            try:
+                callback(None if lost else paths)
+            except Exception:
+                pass
+    
+    def _scan(self) -> Dict[str, tuple]:
+        """Map every file in the tree to its (mtime_ns, size)."""
+        snapshot = {}
+        stack = [self.root]
+        while stack:
+            try:
+                entries = os.scandir(stack.pop())
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not self._skipped(entry.name):
+                                stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            stat = entry.stat(follow_symlinks=False)
+                            snapshot[entry.path] = (stat.st_mtime_ns, stat.st_size)
+                    except OSError:
+                        continue
+        return snapshot
+    
+    def _fall_back_to_polling(self):
+        """Switch to polling, e.g. after running out of inotify watches."""
+        with self.lock:
+            self._close()
+            self._out_of_watches = False
+            self.mode = 'polling'
+        self._snapshot = self._scan()
+    
+    def _wait_for_events(self):
+        """Block until inotify events arrive, then collect them until things quiet down."""
+        readable, _, _ = select.select([self._fd, self._wake[0]], [], [])
+        if self._wake[0] in readable:
+            return
+        self._drain()
+        deadline = time.monotonic() + self.coalesce * 10
+        while time.monotonic() < deadline and not self._stop.is_set():
+            readable, _, _ = select.select([self._fd], [], [], self.coalesce)
+            if not readable:
+                break
+            self._drain()
+    
+    def _poll(self):
+        """Wait one interval, then compare the tree with the last scan."""
+        if self._stop.wait(self.poll_interval):
+            return
+        snapshot = self._scan()
+        changed = {path for path, stamp in snapshot.items() if self._snapshot.get(path) != stamp}
+        changed.update(path for path in self._snapshot if path not in snapshot)
+        self._snapshot = snapshot
+        with self.lock:
+            self.pending |= changed
+    
+    def _run(self):
+        """Body of the watcher thread."""
+        try:
+            if self.mode == 'inotify':
+                try:
+                    with self.lock:
+                        self._watch_tree(self.root, report=False)
+                except OSError:
+                    self._fall_back_to_polling()
+            else:
+                self._snapshot = self._scan()
+            # Anything may have changed while the watches were being set up
+            self._publish(lost=True)
+            
+            while not self._stop.is_set():
+                if self.mode == 'inotify':
+                    self._wait_for_events()
+                    if self._out_of_watches:
+                        self._fall_back_to_polling()
+                        self.lost = True
+                else:
+                    self._poll()
+                if not self._stop.is_set():
+                    self._publish()
+        finally:
+            with self.lock:
+                self._close()
+
+
+class ToolResultCache:
+    """
+    Bounded LRU cache of tool results, validated against the filesystem.
+    
+    Each entry remembers the stamps (mtime, size, inode) of the paths it was
+    computed from and is only served while all of them are unchanged.
+    Memory is bounded by the total UTF-8 size of the cached results.
+    """
+    
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        """
+        Create an empty cache.
+        
+        Args:
+            max_bytes: Maximum total size of the cached results, in UTF-8 bytes
+        """
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (value, stamps, bytes)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    @staticmethod
+    def stamp(paths: List[str]) -> Dict[str, Optional[tuple]]:
+        """
+        Take stamps of paths; call this before reading them.
+        
+        Args:
+            paths: Absolute paths the result will depend on
+            
+        Returns:
+            Mapping of path to stamp
+        """
+        return {path: file_stamp(path) for path in paths}
+    
+    def get(self, key: tuple) -> Optional[str]:
+        """
+        Look up a result, checking that its inputs are unchanged.
+        
+        Args:
+            key: Cache key
+            
+        Returns:
+            The cached result, or None on a miss
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None and all(
+            file_stamp(path) == stamp for path, stamp in entry[1].items()
+        ):
+            with self.lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                self.hits += 1
+            return entry[0]
+        
+        with self.lock:
+            self.misses += 1
+            if entry is not None and self.entries.get(key) is entry:
+                self._remove(key)
+        return None
+    
+    def put(self, key: tuple, value: str, stamps: Dict[str, Optional[tuple]]):
+        """
+        Store a result.
+        
+        Args:
+            key: Cache key
+            value: Tool result
+            stamps: Stamps of the inputs, taken before computing the result
+        """
+        # Characters undercount non-ASCII text by up to 4x
+        size = len(value.encode('utf-8', 'surrogatepass'))
+        if size > self.max_bytes // 4:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, stamps, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+    
+    def _remove(self, key: tuple):
+        """Drop an entry (caller holds the lock)."""
+        self.size -= self.entries.pop(key)[2]
+    
+    def invalidate(self, path: Optional[str] = None):
+        """
+        Drop entries that may be affected by a change.
+        
+        Args:
+            path: Absolute path that was modified, or None to drop everything
+        """
+        with self.lock:
+            if path is None:
+                self.invalidations += len(self.entries)
+                self.entries.clear()
+                self.size = 0
+                return
+            # The file itself and the listings of its parent directories
+            affected = {path}
+            parent = os.path.dirname(path)
+            while parent and parent not in affected:
+                affected.add(parent)
+                parent = os.path.dirname(parent)
+            for key in [k for k, (_, stamps, _) in self.entries.items() if affected & stamps.keys()]:
+                self._remove(key)
+                self.invalidations += 1
+    
+    def stats(self) -> Dict[str, float]:
+        """
+        Cache counters.
+        
+        Returns:
+            Entries, size, hits, misses, hit rate, evictions and invalidations
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+class Prefetcher:
+    """
+    Speculative reads of the files the model is likely to ask for next.
+    
+    After read_file, search_code and list_files, a background thread reads
+    the files the result points at (local modules imported by the file
+    just read, the tests of that module, files named in search hits, entry
+    points in a listing) while the model is still generating. Later reads
+    of those files are served from memory as long as their stamp is
+    unchanged. Memory is bounded by max_bytes; the oldest entries go first.
+    """
+    
+    TRIGGERS = ('read_file', 'search_code', 'list_files')
+    
+    # Files worth reading first when they show up in a listing
+    ENTRY_POINTS = {
+        'README', 'README.md', 'README.rst', 'README.txt', 'pyproject.toml', 'setup.py',
+        'setup.cfg', 'package.json', 'Cargo.toml', 'go.mod', 'Makefile', 'main.py',
+        '__main__.py', 'app.py', 'manage.py', 'index.js', 'index.ts', 'main.go', 'main.rs', 'lib.rs',
+    }
+    
+    PYTHON_IMPORT = re.compile(
+        r'^[ \t]*(?:from[ \t]+(\.*)([\w.]*)[ \t]+import[ \t]+\(?([\w, \t]*)|import[ \t]+([\w., \t]+))',
+        re.MULTILINE
+    )
+    SCRIPT_IMPORT = re.compile(
+        r'(?:\bfrom[ \t]+|\bimport[ \t]*\(?[ \t]*|\brequire[ \t]*\([ \t]*)[\'"](\.{1,2}/[^\'"]+)[\'"]',
+        re.MULTILINE
+    )
+    SCRIPT_EXTENSIONS = ('.ts', '.tsx', '.js', '.jsx', '.mjs', '.cjs')
+    
+    def __init__(
+        self,
+        max_bytes: int = PREFETCH_MAX_BYTES,
+        max_files: int = PREFETCH_MAX_FILES,
+        max_file_bytes: int = READ_MAX_BYTES
+    ):
+        """
+        Create an empty prefetcher.
+        
+        Args:
+            max_bytes: Maximum total size of the prefetched files
+            max_files: Most files read after one tool result
+            max_file_bytes: Larger files are left to read_file
+        """
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.max_file_bytes = min(max_file_bytes, max_bytes // 4)
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()  # path -> (stamp, data)
+        self.size = 0
+        self.lock = threading.Lock()
+        # One thread, so prefetching never competes with the tools for the disk
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        self.predicted = 0
+        self.prefetched = 0
+        self.prefetched_bytes = 0
+        self.hits = 0
+        self.hit_bytes = 0
+        self.misses = 0
+        self.wasted = 0
+    
+    def schedule(self, root: str, tool_name: str, arguments: Dict, result: str):
+        """
+        Prefetch the files a tool result points at, in the background.
+        
+        Args:
+            root: Working directory the tool ran in
+            tool_name: Name of the tool
+            arguments: Arguments of the call
+            result: What the tool returned
+        """
+        if tool_name not in self.TRIGGERS or isinstance(result, ToolError):
+            return
+        try:
+            self.executor.submit(self._prefetch, root, tool_name, arguments, result)
+        except RuntimeError:
+            # Shut down
+            pass
+    
+    def _prefetch(self, root: str, tool_name: str, arguments: Dict, result: str):
+        """Read the predicted files into memory (runs on the prefetch thread)."""
+        try:
+            paths = self.predict(root, tool_name, arguments, result)
+        except Exception:
+            return
+        with self.lock:
+            self.predicted += len(paths)
+        for path in paths:
+            stamp = file_stamp(path)
+            if stamp is None or stamp[1] > self.max_file_bytes:
+                continue
+            with self.lock:
+                entry = self.entries.get(path)
+                if entry is not None and entry[0] == stamp:
+                    continue
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read(self.max_file_bytes + 1)
+            except OSError:
+                continue
+            if len(data) != stamp[1]:
+                # Changing while we read; leave it to read_file
+                continue
+            with self.lock:
+                if path in self.entries:
+                    self._remove(path)
+                self.entries[path] = (stamp, data)
+                self.size += len(data)
+                self.prefetched += 1
+                self.prefetched_bytes += len(data)
+                while self.size > self.max_bytes:
+                    self._remove(next(iter(self.entries)))
+                    self.wasted += 1
+    
+    def predict(self, root: str, tool_name: str, arguments: Dict, result: str) -> List[str]:
+        """
+        Guess which files will be read next.
+        
+        Args:
+            root: Working directory the tool ran in
+            tool_name: Name of the tool
+            arguments: Arguments of the call
+            result: What the tool returned
+            
+        Returns:
+            Absolute paths of existing files, most likely first, at most max_files
+        """
+        candidates: List[str] = []
+        if tool_name == 'read_file':
+            full_path = os.path.normpath(os.path.join(root, arguments.get('filepath', '')))
+            try:
+                with open(full_path, 'rb') as f:
+                    text = f.read(READ_MAX_BYTES).decode('utf-8', errors='replace')
+            except OSError:
+                return []
+            candidates.extend(self._imports(root, full_path, text))
+            candidates.extend(self._tests(root, full_path))
+            seen = {full_path}
+        else:
+            seen = set()
+            for line in result.split('\n'):
+                line = line.rstrip()
+                if tool_name == 'search_code':
+                    # File headings end with ':'; matches are indented
+                    if not line.endswith(':') or line[:1].isspace():
+                        continue
+                    line = line[:-1]
+                elif os.path.basename(line) not in self.ENTRY_POINTS:
+                    continue
+                candidates.append(os.path.normpath(os.path.join(root, line)))
+        
+        paths = []
+        for path in candidates:
+            if path in seen:
+                continue
+            seen.add(path)
+            inside = path.startswith(root.rstrip(os.sep) + os.sep)
+            parts = os.path.relpath(path, root).split(os.sep)
+            if inside and not SKIP_DIRS.intersection(parts) and os.path.isfile(path):
+                paths.append(path)
+                if len(paths) == self.max_files:
+                    break
+        return paths
+    
+    def _imports(self, root: str, full_path: str, text: str) -> List[str]:
+        """
+        Resolve the local modules a source file imports to candidate paths.
+        
+        Args:
+            root: Working directory
+            full_path: Absolute path of the importing file
+            text: Its source
+            
+        Returns:
+            Candidate paths, which need not exist
+        """
+        directory = os.path.dirname(full_path)
+        extension = os.path.splitext(full_path)[1]
+        candidates = []
+        if extension in ('.py', '.pyi'):
+            bases = [root, os.path.join(root, 'src'), directory]
+            for match in self.PYTHON_IMPORT.finditer(text):
+                dots, module, names, imported = match.groups()
+                if imported is not None:
+                    modules = [
+                        (bases, name.split()[0].replace('.', os.sep))
+                        for name in imported.split(',') if name.strip()
+                    ]
+                else:
+                    # Relative imports start from the package of the file
+                    base = directory
+                    for _ in range(len(dots) - 1):
+                        base = os.path.dirname(base)
+                    module_path = module.replace('.', os.sep)
+                    modules = [([base] if dots else bases, module_path)]
+                    # "from package import module" imports a submodule
+                    modules.extend(
+                        ([base] if dots else bases, os.path.join(module_path, name.split()[0]))
+                        for name in names.split(',') if name.strip()
+                    )
+                for module_bases, module_path in modules:
+                    for base in module_bases:
+                        candidates.append(os.path.join(base, module_path + '.py'))
+                        candidates.append(os.path.join(base, module_path, '__init__.py'))
+        elif extension in self.SCRIPT_EXTENSIONS:
+            for match in self.SCRIPT_IMPORT.finditer(text):
+                target = os.path.join(directory, match.group(1))
+                candidates.append(target)
+                candidates.extend(target + suffix for suffix in self.SCRIPT_EXTENSIONS)
+                candidates.extend(
+                    os.path.join(target, 'index' + suffix) for suffix in self.SCRIPT_EXTENSIONS
+                )
+        return candidates
+    
+    @staticmethod
+    def _tests(root: str, full_path: str) -> List[str]:
+        """
+        Candidate paths of the tests of a module.
+        
+        Args:
+            root: Working directory
+            full_path: Absolute path of the module
+            
+        Returns:
+            Candidate paths, which need not exist
+        """
+        directory = os.path.dirname(full_path)
+        stem, extension = os.path.splitext(os.path.basename(full_path))
+        if stem.startswith('test_') or stem.endswith(('_test', '.test', '.spec')):
+            return []
+        if extension == '.py':
+            names = [f'test_{stem}.py', f'{stem}_test.py']
+        else:
+            names = [f'{stem}.test{extension}', f'{stem}.spec{extension}', f'{stem}_test{extension}']
+        directories = [
+            directory,
+            os.path.join(directory, 'tests'),
+            os.path.join(directory, '__tests__'),
+            os.path.join(root, 'tests'),
+            os.path.join(root, 'test'),
+        ]
+        return [os.path.join(d, name) for d in directories for name in names]
+    
+    def take(self, path: str, stamp: Optional[tuple]) -> Optional[bytes]:
+        """
+        Claim a prefetched file, if it is still current.
+        
+        Args:
+            path: Absolute path
+            stamp: Stamp of the file taken by the reader
+            
+        Returns:
+            The file contents, or None on a miss
+        """
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None:
+                self._remove(path)
+                if entry[0] == stamp and stamp is not None:
+                    self.hits += 1
+                    self.hit_bytes += len(entry[1])
+                    return entry[1]
+                self.wasted += 1
+            self.misses += 1
+        return None
+    
+    def _remove(self, path: str):
+        """Drop an entry (caller holds the lock)."""
+        _, data = self.entries.pop(path)
+        self.size -= len(data)
+    
+    def invalidate(self, path: Optional[str] = None):
+        """
+        Drop prefetched files that changed.
+        
+        Args:
+            path: Absolute path that was modified, or None to drop everything
+        """
+        with self.lock:
+            paths = list(self.entries) if path is None else [path] if path in self.entries else []
+            for changed in paths:
+                self._remove(changed)
+                self.wasted += 1
+    
+    def stats(self) -> Dict[str, float]:
+        """
+        Prefetch counters.
+        
+        Returns:
+            Entries, size, predicted and prefetched files, hits, misses,
+            hit rate, bytes served and wasted prefetches
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'predicted': self.predicted,
+                'prefetched': self.prefetched,
+                'prefetched_bytes': self.prefetched_bytes,
+                'hits': self.hits,
+                'hit_bytes': self.hit_bytes,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'wasted': self.wasted,
+            }
+
+
+class BlobStore:
+    """
+    Session-scoped store for large tool results.
+    
+    Results live in memory until the store exceeds its budget; the oldest
+    are then spilled to files in a private temporary directory, which is
+    removed when the store is closed or garbage collected.
+    """
+    
+    def __init__(self, memory_limit: int = 16 * 1024 * 1024):
+        """
+        Create an empty store.
+        
+        Args:
+            memory_limit: Characters kept in memory before spilling to disk
+        """
+        self.memory_limit = memory_limit
+        self.memory: "OrderedDict[str, str]" = OrderedDict()
+        self.memory_size = 0
+        self.spilled: Dict[str, str] = {}  # handle -> file path
+        self.lazy: Dict[str, Callable[[], Optional[str]]] = {}  # handle -> loader
+        self.spill_directory: Optional[str] = None
+        self.count = 0
+        self.lock = threading.Lock()
+        self._finalizer = None
+    
+    def put(self, text: str) -> str:
+        """
+        Store a result.
+        
+        Args:
+            text: Result text
+            
+        Returns:
+            Handle to retrieve it with
+        """
+        with self.lock:
+            self.count += 1
+            handle = f"result-{self.count}"
+            self.memory[handle] = text
+            self.memory_size += len(text)
+            while self.memory_size > self.memory_limit and len(self.memory) > 1:
+                self._spill(*self.memory.popitem(last=False))
+            return handle
+    
+    def _spill(self, handle: str, text: str):
+        """Move one result to disk (caller holds the lock)."""
+        self.memory_size -= len(text)
+        try:
+            if self.spill_directory is None:
+                self.spill_directory = tempfile.mkdtemp(prefix='qwen-results-')
+                self._finalizer = weakref.finalize(self, shutil.rmtree, self.spill_directory, True)
+            path = os.path.join(self.spill_directory, f"{handle}.txt")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            self.spilled[handle] = path
+        except OSError:
+            # Without a usable disk the result is simply gone
+            pass
+    
+    def add_lazy(self, handle: str, loader: Callable[[], Optional[str]]):
+        """
+        Register a result that is only loaded when asked for, e.g. from a session log.
+        
+        Args:
+            handle: Handle the result was stored under
+            loader: Returns the result text (or None if it is gone)
+        """
+        with self.lock:
+            self.lazy[handle] = loader
+            number = handle.rpartition('-')[2]
+            if number.isdigit():
+                self.count = max(self.count, int(number))
+    
+    def get(self, handle: str) -> Optional[str]:
+        """
+        Retrieve a result.
+        
+        Args:
+            handle: Handle returned by put()
+            
+        Returns:
+            The result, or None for an unknown handle
+        """
+        with self.lock:
+            text = self.memory.get(handle)
+            path = self.spilled.get(handle)
+            loader = self.lazy.get(handle)
+        if text is None and path is None and loader is not None:
+            return loader()
+        if text is not None or path is None:
+            return text
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+    
+    def stats(self) -> Dict[str, int]:
+        """
+        Report what the store holds.
+        
+        Returns:
+            Result counts and the characters held in memory
+        """
+        with self.lock:
+            return {
+                'results': len(self.memory) + len(self.spilled) + len(self.lazy),
+                'in_memory': len(self.memory),
+                'spilled': len(self.spilled),
+                'lazy': len(self.lazy),
+                'memory_chars': self.memory_size,
+            }
+    
+    def clear(self):
+        """Drop every stored result and delete the spill directory."""
+        with self.lock:
+            self.memory.clear()
+            self.memory_size = 0
+            self.spilled.clear()
+            self.lazy.clear()
+            self.spill_directory = None
+            if self._finalizer is not None:
+                self._finalizer()
+                self._finalizer = None
+
+
+def _json_default(value):
+    """Serialize the pydantic objects (such as tool calls) found in messages."""
+    if hasattr(value, 'model_dump'):
+        return value.model_dump(exclude_none=True)
+    return str(value)
+
+
+class SessionLog:
+    """
+    Append-only, crash-safe log of one conversation.
+    
+    Every message is written as it is added to the history: one JSON line
+    per record, or with compression one gzip member or zstd frame per
+    record, so a crash loses at most the record being written. Writes are
+    flushed at once and fsynced in batches, at the end of every turn and
+    otherwise at most every sync_interval seconds. Large tool results are
+    written as separate blob records; resuming only notes where they are
+    and reads them back when fetch_result asks for them.
+    """
+    
+    SUFFIXES = {None: '.jsonl', 'gzip': '.jsonl.gz', 'zstd': '.jsonl.zst'}
+    BLOB_PREFIX = b'{"type": "blob", "handle": "'
+    
+    def __init__(
+        self,
+        path: str,
+        compression: Optional[str] = None,
+        header: Optional[Dict] = None,
+        sync_interval: float = SESSION_LOG_SYNC_INTERVAL
+    ):
+        """
+        Create a log (the file is created with the first record).
+        
+        Args:
+            path: Log file
+            compression: None, 'gzip' or 'zstd' (needs the zstandard package)
+            header: Session record written first to a new file
+            sync_interval: Most seconds a written record may stay unsynced
+                while the turn goes on
+                
+        Raises:
+            ValueError: If the compression is unknown or unavailable
+        """
+        if compression not in self.SUFFIXES:
+            raise ValueError(f"Unknown compression '{compression}' (expected gzip or zstd)")
+        self._zstd = None
+        if compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError as e:
+                raise ValueError("zstd compression needs the zstandard package (pip install zstandard)") from e
+            self._zstd = zstandard
+        self.path = path
+        self.compression = compression
+        self.header = header
+        self.sync_interval = sync_interval
+        self.file = None
+        self.last_sync = time.monotonic()
+        self.unsynced = False
+        self.failed = False
+        self.lock = threading.Lock()
+    
+    @classmethod
+    def create(cls, session_id: str, compression: Optional[str] = None, **header) -> "SessionLog":
+        """
+        Create the log of a new session in the cache directory.
+        
+        Args:
+            session_id: Session id, used as the file name
+            compression: None, 'gzip' or 'zstd'
+            header: Extra fields of the session record (model, working directory)
+            
+        Returns:
+            The log
+        """
+        path = os.path.join(cache_directory('sessions'), session_id + cls.SUFFIXES[compression])
+        return cls(path, compression, {'type': 'session', 'id': session_id, 'created': time.time(), **header})
+    
+    @classmethod
+    def open(cls, path: str) -> "SessionLog":
+        """
+        Open an existing log, with the compression given by its suffix.
+        
+        Args:
+            path: Log file
+            
+        Returns:
+            The log
+        """
+        compression = next(
+            (name for name, suffix in cls.SUFFIXES.items() if name and path.endswith(suffix)), None
+        )
+        return cls(path, compression)
+    
+    @classmethod
+    def find(cls, session_id: str) -> Optional[str]:
+        """
+        Find the log of a session.
+        
+        Args:
+            session_id: Session id, or an unambiguous prefix of one
+            
+        Returns:
+            Path of the log, or None if there is no single match
+        """
+        matches = [
+            session['path'] for session in cls.sessions(limit=None)
+            if session['id'].startswith(session_id)
+        ]
+        exact = [path for path in matches if os.path.basename(path).split('.')[0] == session_id]
+        if exact or len(matches) == 1:
+            return (exact or matches)[0]
+        return None
+    
+    @classmethod
+    def sessions(cls, limit: Optional[int] = 20) -> List[Dict]:
+        """
+        List the logged sessions, most recently active first.
+        
+        Only the start of each log is read, for its header and first message.
+        
+        Args:
+            limit: Most sessions to return (None for all)
+            
+        Returns:
+            Dicts with id, path, modified, size, header and prompt
+        """
+        directory = cache_directory('sessions')
+        entries = []
+        for name in os.listdir(directory):
+            if not name.endswith(tuple(suffix for suffix in cls.SUFFIXES.values())):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name.split('.')[0], path))
+        entries.sort(reverse=True)
+        
+        sessions = []
+        for modified, size, session_id, path in entries[:limit]:
+            session = {'id': session_id, 'path': path, 'modified': modified, 'size': size, 'header': {}, 'prompt': ''}
+            try:
+                log = cls.open(path)
+                with open(path, 'rb') as f:
+                    head = f.read(64 * 1024)
+                for _, _, payload in log._records(head):
+                    record = json.loads(payload)
+                    if record.get('type') == 'session':
+                        session['header'] = record
+                    elif record.get('type') == 'message' and record['message'].get('role') == 'user':
+                        session['prompt'] = record['message'].get('content') or ''
+                        break
+            except (OSError, ValueError):
+                pass
+            sessions.append(session)
+        return sessions
+    
+    def _compress(self, data: bytes) -> bytes:
+        """Frame one record."""
+        if self.compression == 'gzip':
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            return compressor.compress(data) + compressor.flush()
+        if self.compression == 'zstd':
+            return self._zstd.ZstdCompressor().compress(data)
+        return data
+    
+    def _decompressor(self):
+        """Decompression object for one gzip member or zstd frame."""
+        if self.compression == 'gzip':
+            return zlib.decompressobj(31)
+        return self._zstd.ZstdDecompressor().decompressobj()
+    
+    def _records(self, data: bytes) -> Iterator[tuple]:
+        """
+        Split log data into records, stopping at a torn or corrupt one.
+        
+        Args:
+            data: Contents of the log file (or its start)
+            
+        Yields:
+            (offset, length, JSON bytes) of each complete record
+        """
+        offset = 0
+        if self.compression is None:
+            while True:
+                end = data.find(b'\n', offset)
+                if end < 0:
+                    return
+                yield offset, end + 1 - offset, data[offset:end]
+                offset = end + 1
+        
+        view = memoryview(data)
+        while offset < len(data):
+            decompressor = self._decompressor()
+            parts = []
+            fed = offset
+            try:
+                # Fed in pieces so unused_data never copies the rest of the file
+                while not decompressor.eof and fed < len(data):
+                    piece = view[fed:fed + 64 * 1024]
+                    fed += len(piece)
+                    parts.append(decompressor.decompress(piece))
+            except Exception:
+                return
+            if not decompressor.eof:
+                return
+            end = fed - len(decompressor.unused_data)
+            yield offset, end - offset, b''.join(parts).rstrip(b'\n')
+            offset = end
+    
+    def _write(self, record: Dict, sync: bool):
+        """Append one record, fsyncing when due."""
+        data = json.dumps(record, default=_json_default).encode('utf-8') + b'\n'
+        with self.lock:
+            if self.failed:
+                return
+            if self.file is None:
+                self.file = open(self.path, 'ab')
+                if self.header is not None and self.file.tell() == 0:
+                    header = json.dumps(self.header, default=_json_default).encode('utf-8') + b'\n'
+                    self.file.write(self._compress(header))
+            self.file.write(self._compress(data))
+            self.file.flush()
+            self.unsynced = True
+            if sync or time.monotonic() - self.last_sync >= self.sync_interval:
+                self._sync()
+    
+    def _sync(self):
+        """fsync the file (caller holds the lock)."""
+        if self.file is not None and self.unsynced:
+            os.fsync(self.file.fileno())
+            self.unsynced = False
+        self.last_sync = time.monotonic()
+    
+    def append(self, message: Dict):
+        """
+        Log a message added to the history.
+        
+        A final assistant message (one without tool calls) ends the turn
+        and is synced at once.
+        
+        Args:
+            message: The message
+        """
+        final = message.get('role') == 'assistant' and not message.get('tool_calls')
+        try:
+            self._write({'type': 'message', 'message': message}, sync=final)
+        except OSError as e:
+            console.print(f"[yellow]⚠️  Session log disabled: {e}[/yellow]")
+            self.close()
+            self.failed = True
+    
+    def append_directory(self, directory: str):
+        """
+        Log a change of the working directory.
+        
+        Args:
+            directory: New working directory
+        """
+        try:
+            self._write({'type': 'directory', 'path': directory}, sync=False)
+        except OSError:
+            pass
+    
+    def append_blob(self, handle: str, text: str):
+        """
+        Log the full text of a large tool result.
+        
+        Args:
+            handle: Blob store handle of the result
+            text: The result
+        """
+        # Key order matters: resume spots blobs by BLOB_PREFIX without parsing them
+        try:
+            self._write({'type': 'blob', 'handle': handle, 'text': text}, sync=False)
+        except OSError:
+            pass
+    
+    def load(self) -> tuple:
+        """
+        Read the log back in one pass, skipping the text of blob records.
+        
+        Returns:
+            (session record with the latest working_directory, messages,
+            {handle: (offset, length)}, end of the last complete record)
+        """
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        header: Dict = {}
+        messages = []
+        blobs: Dict[str, tuple] = {}
+        end = 0
+        for offset, length, payload in self._records(data):
+            end = offset + length
+            if payload.startswith(self.BLOB_PREFIX):
+                start = len(self.BLOB_PREFIX)
+                blobs[payload[start:payload.index(b'"', start)].decode('ascii')] = (offset, length)
+                continue
+            try:
+                record = json.loads(payload)
+            except ValueError:
+                continue
+            if record.get('type') == 'session':
+                header = record
+            elif record.get('type') == 'message':
+                messages.append(record['message'])
+            elif record.get('type') == 'directory':
+                header['working_directory'] = record['path']
+        return header, messages, blobs, end
+    
+    def read_blob(self, offset: int, length: int) -> Optional[str]:
+        """
+        Read one blob record written by append_blob.
+        
+        Args:
+            offset: Offset of the record in the file
+            length: Length of the record in the file
+            
+        Returns:
+            The result text, or None if it cannot be read
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                data = f.read(length)
+            for _, _, payload in self._records(data):
+                return json.loads(payload)['text']
+        except (OSError, ValueError, KeyError):
+            pass
+        return None
+    
+    def truncate(self, end: int):
+        """
+        Cut off a record torn by a crash, so new records follow complete ones.
+        
+        Args:
+            end: End of the last complete record
+        """
+        with self.lock:
+            try:
+                if os.path.getsize(self.path) > end:
+                    os.truncate(self.path, end)
+            except OSError:
+                pass
+    
+    def sync(self):
+        """fsync whatever was written since the last sync."""
+        with self.lock:
+            try:
+                self._sync()
+            except OSError:
+                pass
+    
+    def close(self):
+        """Sync and close the file."""
+        with self.lock:
+            if self.file is not None:
+                try:
+                    self._sync()
+                    self.file.close()
+                except OSError:
+                    pass
+                self.file = None
+
+
+class ContextWindow:
+    """
+    Token budget for the conversation sent to the model.
+    
+    Token counts are tracked per message: the exact eval_count Ollama reports
+    for model output, and a character-based estimate (calibrated against
+    those counts and the prompt_eval_count of whole prompts) for everything
+    else. When the history outgrows the budget
+    it is pruned in one large step to well below the limit - old tool results
+    are elided first, then the oldest exchanges are dropped. Pruning rarely
+    and deterministically keeps the message prefix byte-identical for many
+    turns, so Ollama can reuse its prompt cache instead of re-prefilling.
+    """
+    
+    # Chat template tokens wrapped around every message
+    MESSAGE_OVERHEAD = 4
+    ELIDED_PREFIX = "[Elided "
+    # Handle of a large result kept out of the conversation (_store_large_result)
+    STORED_RESULT = re.compile(r"\[Full result stored as (\S+):")
+    
+    def __init__(self, max_tokens: int = 32768, reserve_tokens: int = 4096, prune_ratio: float = 0.6):
+        """
+        Create a context budget.
+        
+        Args:
+            max_tokens: Context size requested from Ollama (num_ctx)
+            reserve_tokens: Tokens kept free for tool definitions and the reply
+            prune_ratio: Fraction of the budget to prune down to when it is exceeded
+        """
+        self.max_tokens = max_tokens
+        self.reserve_tokens = reserve_tokens
+        self.prune_ratio = prune_ratio
+        self.chars_per_token = 4.0
+        self.token_counts: List[int] = []
+        self.usage: Dict[str, int] = {}
+        self.prunes = 0
+    
+    @property
+    def budget(self) -> int:
+        """Tokens available for the conversation history."""
+        return self.max_tokens - self.reserve_tokens
+    
+    @staticmethod
+    def _message_chars(message: Dict) -> int:
+        """Number of characters the model sees for a message."""
+        chars = len(message.get('content') or '')
+        for tool_call in message.get('tool_calls') or []:
+            function = tool_call['function']
+            chars += len(function['name']) + len(json.dumps(function['arguments'], default=str))
+        return chars
+    
+    def estimate(self, message: Dict) -> int:
+        """
+        Estimate the tokens a message takes up in the prompt.
+        
+        Args:
+            message: Conversation message
+            
+        Returns:
+            Estimated token count
+        """
+        return int(self._message_chars(message) / self.chars_per_token) + self.MESSAGE_OVERHEAD
+    
+    def append(self, messages: List[Dict], message: Dict, tokens: Optional[int] = None):
+        """
+        Add a message to the conversation and record its size.
+        
+        Args:
+            messages: The conversation history
+            message: Message to append
+            tokens: Exact token count if known (e.g. eval_count)
+        """
+        self._sync(messages)
+        messages.append(message)
+        if tokens:
+            self.token_counts.append(tokens + self.MESSAGE_OVERHEAD)
+        else:
+            self.token_counts.append(self.estimate(message))
+    
+    def record_usage(
+        self,
+        usage: Dict[str, int],
+        message: Dict,
+        prompt: Optional[List[Dict]] = None,
+        tools: Optional[List[Dict]] = None
+    ):
+        """
+        Remember the counts Ollama reported and calibrate the estimator.
+        
+        Args:
+            usage: Timing and token fields of the final response chunk
+            message: The assistant message that was generated
+            prompt: The conversation history the response was generated from
+            tools: Tool definitions sent along with it
+        """
+        self.usage = usage
+        eval_count = usage.get('eval_count')
+        chars = self._message_chars(message)
+        if eval_count and chars > 200:
+            ratio = min(max(chars / eval_count, 1.5), 8.0)
+            self.chars_per_token = 0.8 * self.chars_per_token + 0.2 * ratio
+        
+        prompt_eval_count = usage.get('prompt_eval_count')
+        if not prompt_eval_count or prompt is None:
+            return
+        prompt_chars = sum(self._message_chars(m) for m in prompt)
+        prompt_chars += len(json.dumps(tools, default=str)) if tools else 0
+        text_tokens = prompt_eval_count - self.MESSAGE_OVERHEAD * len(prompt)
+        if prompt_chars <= 200 or text_tokens <= 0:
+            return
+        # Ollama does not count a prefix it reused from its cache, so the
+        # count is a lower bound: it can only show the estimate was too low
+        ratio = max(prompt_chars / text_tokens, 1.5)
+        if ratio < self.chars_per_token:
+            self.chars_per_token = ratio
+            self._sync(prompt)
+            self.token_counts = [
+                max(count, self.estimate(m)) for count, m in zip(self.token_counts, prompt)
+            ]
+    
+    def _sync(self, messages: List[Dict]):
+        """Re-estimate all counts if the history was changed behind our back."""
+        if len(self.token_counts) != len(messages):
+            self.token_counts = [self.estimate(m) for m in messages]
+    
+    def total(self, messages: List[Dict]) -> int:
+        """
+        Total tokens of the conversation.
+        
+        Args:
+            messages: The conversation history
+            
+        Returns:
+            Token count
+        """
+        self._sync(messages)
+        return sum(self.token_counts)
+    
+    def _elide(self, messages: List[Dict], index: int) -> int:
+        """Replace a tool result by a short note; returns tokens freed."""
+        message = messages[index]
+        content = message.get('content') or ''
+        if content.startswith(self.ELIDED_PREFIX):
+            return 0
+        
+        first_line = content.strip().split('\n', 1)[0][:120]
+        stored = self.STORED_RESULT.search(content)
+        if stored:
+            hint = f"Read it with fetch_result(handle='{stored.group(1)}') if it is still needed."
+        else:
+            hint = "Run the tool again if it is still needed."
+        elided = {
+            'role': message.get('role', 'tool'),
+            'content': (
+                f"{self.ELIDED_PREFIX}{message.get('tool_name', 'tool')} result: "
+                f"{content.count(chr(10)) + 1} lines, {len(content)} chars. "
+                f"Began with: {first_line}. {hint}]"
+            )
+        }
+        if message.get('tool_name'):
+            elided['tool_name'] = message['tool_name']
+        
+        messages[index] = elided
+        old_tokens = self.token_counts[index]
+        self.token_counts[index] = self.estimate(elided)
+        return max(old_tokens - self.token_counts[index], 0)
+    
+    def fit(self, messages: List[Dict]) -> int:
+        """
+        Prune the conversation in place if it exceeds the budget.
+        
+        The current turn (from the last user message on) is only touched if
+        it alone is over the budget, and then its latest message is kept.
+        
+        Args:
+            messages: The conversation history
+            
+        Returns:
+            Number of tokens freed (0 if nothing had to be pruned)
+        """
+        total = self.total(messages)
+        if total <= self.budget:
+            return 0
+        
+        target = int(self.budget * self.prune_ratio)
+        start_total = total
+        
+        def current_turn() -> int:
+            for index in range(len(messages) - 1, -1, -1):
+                if messages[index].get('role') == 'user':
+                    return index
+            return len(messages)
+        
+        # 1. Elide old tool results, oldest first
+        for index in range(current_turn()):
+            if total <= target:
+                break
+            if messages[index].get('role') == 'tool':
+                total -= self._elide(messages, index)
+        
+        # 2. Drop the oldest exchanges (system messages are kept)
+        while total > target:
+            first = next(
+                (i for i, m in enumerate(messages) if m.get('role') != 'system'),
+                None
+            )
+            boundary = next(
+                (i for i in range(first + 1, current_turn()) if messages[i].get('role') == 'user'),
+                None
+            ) if first is not None else None
+            if boundary is None:
+                break
+            total -= sum(self.token_counts[first:boundary])
+            del messages[first:boundary]
+            del self.token_counts[first:boundary]
+        
+        # 3. The current turn alone is too large: elide all but its latest result
+        for index in range(current_turn(), len(messages) - 1):
+            if total <= target:
+                break
+            if messages[index].get('role') == 'tool':
+                total -= self._elide(messages, index)
+        
+        self.prunes += 1
+        return start_total - total
+    
+    def reset(self):
+        """Forget all tracked counts."""
+        self.token_counts = []
+        self.usage = {}
+
+
+class EditConflict(Exception):
+    """An edit could not be located unambiguously in the file."""
+
+
+def parse_unified_diff(diff: str) -> List[tuple]:
+    """
+    Turn the hunks of a unified diff into search/replace edits.
+    
+    Args:
+        diff: Unified diff of a single file
+        
+    Returns:
+        List of (search, replace, line hint) tuples
+        
+    Raises:
+        EditConflict: If the diff contains no hunks or changes another file
+            after the first hunk
+    """
+    edits = []
+    old_lines: Optional[List[str]] = None
+    new_lines: List[str] = []
+    hint = None
+    # Lines left in the current hunk according to its header
+    old_left = new_left = 0
+    
+    def finish():
+        if old_lines is not None:
+            edits.append(('\n'.join(old_lines), '\n'.join(new_lines), hint))
+    
+    lines = diff.splitlines()
+    for number, line in enumerate(lines):
+        header = re.match(r'^@@ -(\d+)(?:,(\d+))? \+\d+(?:,(\d+))? @@', line)
+        if header:
+            finish()
+            old_lines, new_lines = [], []
+            hint = int(header.group(1))
+            old_left = int(header.group(2) or 1)
+            new_left = int(header.group(3) or 1)
+            continue
+        if old_lines is None or line.startswith('\\'):
+            continue  # File headers and "\ No newline at end of file"
+        
+        # Inside a hunk '--- x' removes the line '-- x'; a file header is
+        # recognized by its '+++' partner or by following a complete hunk
+        following = lines[number + 1] if number + 1 < len(lines) else ''
+        if (line.startswith('--- ') and following.startswith('+++ ')) or (
+            old_left <= 0 and new_left <= 0 and line.startswith(('--- ', '+++ '))
+        ):
+            raise EditConflict(
+                "the diff changes more than one file; send a separate edit_file call for each file"
+            )
+        
+        if line.startswith('-'):
+            old_lines.append(line[1:])
+            old_left -= 1
+        elif line.startswith('+'):
+            new_lines.append(line[1:])
+            new_left -= 1
+        else:
+            context = line[1:] if line.startswith(' ') else line
+            old_lines.append(context)
+            new_lines.append(context)
+            old_left -= 1
+            new_left -= 1
+    finish()
+    
+    if not edits:
+        raise EditConflict("the diff contains no hunks (expected '@@ -a,b +c,d @@' headers)")
+    return edits
+
+
+def _indent(line: str) -> str:
+    """Leading whitespace of a line."""
+    return line[:len(line) - len(line.lstrip())]
+
+
+def _find_block(lines: List[str], block: List[str], hint: Optional[int]) -> tuple:
+    """
+    Locate a block of lines, first exactly, then ignoring surrounding
+    whitespace, then by fuzzy similarity.
+    
+    Args:
+        lines: Lines of the file
+        block: Lines to find
+        hint: Expected 1-based line number, used to break ties
+        
+    Returns:
+        (start index, match kind)
+        
+    Raises:
+        EditConflict: If the block is missing or ambiguous
+    """
+    size = len(block)
+    windows = range(len(lines) - size + 1)
+    
+    def pick(matches: List[int], kind: str) -> Optional[tuple]:
+        if len(matches) == 1:
+            return matches[0], kind
+        if len(matches) > 1:
+            if hint is None:
+                raise EditConflict(
+                    f"the search text matches {len(matches)} places "
+                    f"(lines {', '.join(str(m + 1) for m in matches[:5])}); "
+                    "include more surrounding lines to make it unique"
+                )
+            return min(matches, key=lambda m: abs(m + 1 - hint)), kind
+        return None
+    
+    found = pick([i for i in windows if lines[i:i + size] == block], 'exact')
+    if found:
+        return found
+    
+    stripped = [line.strip() for line in block]
+    found = pick(
+        [i for i in windows if [line.strip() for line in lines[i:i + size]] == stripped],
+        'whitespace'
+    )
+    if found:
+        return found
+    
+    # Fuzzy match: the most similar window, if it is clearly the best
+    target = '\n'.join(stripped)
+    scores = []
+    for i in windows:
+        matcher = difflib.SequenceMatcher(
+            None, '\n'.join(line.strip() for line in lines[i:i + size]), target
+        )
+        if matcher.real_quick_ratio() >= FUZZY_EDIT_RATIO and matcher.quick_ratio() >= FUZZY_EDIT_RATIO:
+            ratio = matcher.ratio()
+            if ratio >= FUZZY_EDIT_RATIO:
+                scores.append((ratio, i))
+    
+    if not scores:
+        raise EditConflict("the search text was not found in the file")
+    scores.sort(reverse=True)
+    best_ratio, best = scores[0]
+    rivals = [i for ratio, i in scores[1:] if ratio >= best_ratio - 0.02 and abs(i - best) >= size]
+    if rivals and hint is None:
+        raise EditConflict(
+            f"the search text only approximately matches, at lines {best + 1} and "
+            f"{rivals[0] + 1}; include more surrounding lines to make it unique"
+        )
+    if rivals:
+        best = min([best] + rivals, key=lambda m: abs(m + 1 - hint))
+    return best, f"fuzzy, {best_ratio:.0%} similar"
+
+
+def apply_edit(content: str, search: str, replace: str, hint: Optional[int] = None) -> tuple:
+    """
+    Replace one block of text in a file's content.
+    
+    Args:
+        content: Current file content (with '\\n' line endings)
+        search: Text to replace
+        replace: Replacement text
+        hint: Expected 1-based line number of the search text
+        
+    Returns:
+        (new content, 1-based line of the change, match kind)
+        
+    Raises:
+        EditConflict: If the search text is missing or ambiguous
+    """
+    if not search.strip():
+        if content.strip():
+            raise EditConflict("the search text is empty but the file is not")
+        return replace, 1, 'exact'
+    
+    count = content.count(search)
+    if count > 1 and hint is None:
+        raise EditConflict(
+            f"the search text matches {count} places; "
+            "include more surrounding lines to make it unique"
+        )
+    if count == 1:
+        index = content.index(search)
+        line = content.count('\n', 0, index) + 1
+        return content[:index] + replace + content[index + len(search):], line, 'exact'
+    
+    # Fall back to matching whole lines
+    lines = content.split('\n')
+    block = search.strip('\n').split('\n')
+    start, kind = _find_block(lines, block, hint)
+    new_lines = replace.strip('\n').split('\n') if replace.strip('\n') else []
+    
+    # Shift the replacement by the indentation difference of the match
+    found_indent = _indent(next((l for l in lines[start:start + len(block)] if l.strip()), ''))
+    search_indent = _indent(next((l for l in block if l.strip()), ''))
+    if kind != 'exact' and found_indent != search_indent:
+        new_lines = [
+            found_indent + line[len(search_indent):] if line.startswith(search_indent) else line
+            for line in new_lines
+        ]
+    
+    lines[start:start + len(block)] = new_lines
+    return '\n'.join(lines), start + 1, kind
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """
+    Nearest-rank percentile of a list of numbers.
+    
+    Args:
+        values: Samples (need not be sorted)
+        fraction: Percentile as a fraction, e.g. 0.95
+        
+    Returns:
+        The percentile, or 0.0 for an empty list
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+_trace_logger: Optional[logging.Logger] = None
+_trace_logger_lock = threading.Lock()
+
+
+def trace_logger() -> logging.Logger:
+    """
+    Logger writing spans to a rotating JSONL file, shared by all sessions.
+    
+    Returns:
+        The trace logger
+    """
+    global _trace_logger
+    with _trace_logger_lock:
+        if _trace_logger is None:
+            logger = logging.getLogger('qwen_code_assistant.trace')
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            handler = RotatingFileHandler(
+                os.path.join(cache_directory('traces'), 'spans.jsonl'),
+                maxBytes=TRACE_FILE_MAX_BYTES,
+                backupCount=TRACE_FILE_BACKUPS,
+                encoding='utf-8',
+                delay=True
+            )
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+            _trace_logger = logger
+        return _trace_logger
+
+
+class Tracer:
+    """
+    Records a timing span for every model call and tool call of a session.
+    
+    Spans are kept in memory for /stats and appended as JSON lines to a
+    rotating file. Model spans carry Ollama's timing fields plus the derived
+    prefill and decode speeds in tokens per second.
+    """
+    
+    def __init__(self, session_id: Optional[str] = None, keep: int = 10000, enabled: bool = True):
+        """
+        Create a tracer.
+        
+        Args:
+            session_id: Identifier written with every span (default: random)
+            keep: Number of spans kept in memory
+            enabled: Whether spans are written to the trace file
+        """
+        self.session_id = session_id or uuid.uuid4().hex[:12]
+        self.spans: deque = deque(maxlen=keep)
+        self.enabled = enabled
+        self.turn = 0
+        self.lock = threading.Lock()
+    
+    @contextmanager
+    def span(self, kind: str, name: str, **attributes) -> Iterator[Dict]:
+        """
+        Time a block of work.
+        
+        Args:
+            kind: 'model' or 'tool'
+            name: Model or tool name
+            attributes: Extra fields to record
+            
+        Yields:
+            The span record, to which the block may add fields
+        """
+        record = {
+            'session': self.session_id,
+            'turn': self.turn,
+            'kind': kind,
+            'name': name,
+            'start': time.time(),
+            **attributes
+        }
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['duration'] = time.perf_counter() - started
+            self._finish(record)
+    
+    def record(self, kind: str, name: str, **attributes) -> Dict:
+        """
+        Record an instantaneous event, such as a routing decision.
+        
+        Args:
+            kind: Event kind, e.g. 'route'
+            name: Model or tool name
+            attributes: Extra fields to record
+            
+        Returns:
+            The event record
+        """
+        record = {
+            'session': self.session_id,
+            'turn': self.turn,
+            'kind': kind,
+            'name': name,
+            'start': time.time(),
+            'duration': 0.0,
+            **attributes
+        }
+        self._finish(record)
+        return record
+    
+    def _finish(self, record: Dict):
+        """Derive throughput fields and store the span."""
+        prompt_seconds = (record.get('prompt_eval_duration') or 0) / 1e9
+        eval_seconds = (record.get('eval_duration') or 0) / 1e9
+        if record.get('prompt_eval_count') and prompt_seconds > 0:
+            record['prefill_tokens_per_second'] = record['prompt_eval_count'] / prompt_seconds
+        if record.get('eval_count') and eval_seconds > 0:
+            record['decode_tokens_per_second'] = record['eval_count'] / eval_seconds
+        
+        with self.lock:
+            self.spans.append(record)
+        if self.enabled:
+            try:
+                trace_logger().info(json.dumps(record, default=str))
+            except OSError:
+                self.enabled = False
+    
+    def stats(self) -> Dict:
+        """
+        Summarize the spans recorded so far.
+        
+        Returns:
+            Totals and latency percentiles for model calls and for each tool
+        """
+        with self.lock:
+            spans = list(self.spans)
+        
+        def summary(durations: List[float]) -> Dict[str, float]:
+            return {
+                'count': len(durations),
+                'total': sum(durations),
+                'p50': percentile(durations, 0.5),
+                'p95': percentile(durations, 0.95),
+                'max': max(durations, default=0.0),
+            }
+        
+        models = [span for span in spans if span['kind'] == 'model']
+        model = summary([span['duration'] for span in models])
+        for field in ('prefill_tokens_per_second', 'decode_tokens_per_second', 'first_token'):
+            values = [span[field] for span in models if span.get(field)]
+            model[field] = sum(values) / len(values) if values else None
+        model['prompt_tokens'] = sum(span.get('prompt_eval_count') or 0 for span in models)
+        model['output_tokens'] = sum(span.get('eval_count') or 0 for span in models)
+        model['load_seconds'] = sum(span.get('load_duration') or 0 for span in models) / 1e9
+        
+        tools: Dict[str, Dict] = {}
+        for name in sorted({span['name'] for span in spans if span['kind'] == 'tool'}):
+            calls = [span for span in spans if span['kind'] == 'tool' and span['name'] == name]
+            tools[name] = summary([span['duration'] for span in calls])
+            tools[name]['errors'] = sum(1 for span in calls if not span.get('ok', True))
+        
+        routing: Dict[str, Dict] = {}
+        for span in models:
+            phase = routing.setdefault(span.get('phase', 'answer'), {'models': set(), 'calls': 0, 'seconds': 0.0})
+            phase['models'].add(span['name'])
+            phase['calls'] += 1
+            phase['seconds'] += span['duration']
+        for phase in routing.values():
+            phase['models'] = sorted(phase['models'])
+        escalations = [span for span in spans if span['kind'] == 'route']
+        if escalations:
+            reasons: Dict[str, int] = {}
+            for span in escalations:
+                reasons[span['reason']] = reasons.get(span['reason'], 0) + 1
+            routing['escalations'] = reasons
+        
+        return {
+            'session': self.session_id,
+            'turns': self.turn,
+            'model': model,
+            'routing': routing,
+            'tools': tools
+        }
+
+
+class OutputBuffer:
+    """
+    Keeps the head and tail of a stream of text, dropping the middle.
+    
+    Memory stays bounded however much a command prints; the start of the
+    output (what ran) and its end (the summary or traceback) are usually
+    what matters.
+    """
+    
+    def __init__(self, head_chars: int = COMMAND_HEAD_CHARS, tail_chars: int = COMMAND_TAIL_CHARS):
+        """
+        Create an empty buffer.
+        
+        Args:
+            head_chars: Characters kept from the start
+            tail_chars: Characters kept from the end
+        """
+        self.head_chars = head_chars
+        self.tail_chars = tail_chars
+        self.head = ""
+        self.tail: deque = deque()
+        self.tail_size = 0
+        self.dropped = 0
+    
+    def write(self, text: str):
+        """
+        Append text.
+        
+        Args:
+            text: Text to append
+        """
+        if len(self.head) < self.head_chars:
+            take = self.head_chars - len(self.head)
+            self.head += text[:take]
+            text = text[take:]
+        if not text:
+            return
+        
+        self.tail.append(text)
+        self.tail_size += len(text)
+        # Drop whole chunks once the rest still covers the tail
+        while self.tail_size - len(self.tail[0]) >= self.tail_chars:
+            self.tail_size -= len(self.tail[0])
+            self.dropped += len(self.tail.popleft())
+    
+    def getvalue(self) -> str:
+        """
+        Return the kept text, marking where output was left out.
+        
+        Returns:
+            Head and tail of everything written
+        """
+        tail = "".join(self.tail)
+        dropped = self.dropped + max(0, len(tail) - self.tail_chars)
+        if not dropped:
+            return self.head + tail
+        
+        tail = tail[-self.tail_chars:]
+        # Resume at a line boundary if one is close
+        newline = tail.find("\n", 0, 200)
+        if newline >= 0:
+            dropped += newline + 1
+            tail = tail[newline + 1:]
+        return f"{self.head}\n... [{dropped} characters omitted] ...\n{tail}"
+
+
+class _ShellStream:
+    """Decodes one output stream of a shell command and watches for the sentinel."""
+    
+    def __init__(self, name: str, on_output: Optional[Callable[[str, str], None]]):
+        self.name = name
+        self.on_output = on_output
+        self.buffer = OutputBuffer()
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.pending = b""
+        self.line = ""
+        self.finished = False
+    
+    def feed(self, data: bytes, sentinel: bytes) -> Optional[str]:
+        """
+        Consume raw output.
+        
+        Returns:
+            The rest of the sentinel line once the sentinel has been seen, else None
+        """
+        self.pending += data
+        index = self.pending.find(sentinel)
+        if index >= 0:
+            end = self.pending.find(b"\n", index)
+            if end < 0:
+                # Wait for the rest of the sentinel line
+                return None
+            rest = self.pending[index + len(sentinel):end].decode('ascii', errors='replace').strip()
+            self._emit(self.pending[:index])
+            self.pending = b""
+            self.finish()
+            return rest
+        
+        # Hold back what could be the start of a sentinel split across reads
+        keep = len(sentinel)
+        self._emit(self.pending[:-keep])
+        self.pending = self.pending[-keep:]
+        return None
+    
+    def _emit(self, data: bytes):
+        """Pass decoded text to the buffer and complete lines to the callback."""
+        text = self.decoder.decode(data)
+        if not text:
+            return
+        self.buffer.write(text)
+        if self.on_output:
+            *lines, self.line = (self.line + text).split("\n")
+            for line in lines:
+                self.on_output(self.name, line)
+    
+    def finish(self):
+        """Flush whatever is left; called once the stream is complete."""
+        if self.finished:
+            return
+        self.finished = True
+        self._emit(self.pending)
+        self.pending = b""
+        tail = self.decoder.decode(b"", final=True)
+        if tail:
+            self.buffer.write(tail)
+            self.line += tail
+        if self.on_output and self.line:
+            self.on_output(self.name, self.line)
+        self.line = ""
+
+
+class ShellSession:
+    """
+    A long-lived shell that runs one command at a time.
+    
+    Environment variables, functions and activated virtualenvs carry over
+    from one command to the next. Each command is written to the shell's
+    stdin followed by a line printing a random sentinel and the exit status
+    to stdout (and the sentinel alone to stderr), so the end of its output
+    can be found without closing the pipes. Commands read stdin from
+    /dev/null so they cannot swallow the framing.
+    """
+    
+    def __init__(self, shell: Optional[str] = None):
+        """
+        Create a session; the shell starts on the first command.
+        
+        Args:
+            shell: Shell executable (default: bash if available, else sh)
+        """
+        self.shell = shell or ('/bin/bash' if os.path.exists('/bin/bash') else '/bin/sh')
+        self.process: Optional[subprocess.Popen] = None
+        self.output: queue.Queue = queue.Queue()
+        self.sentinel = b""
+        self.lock = threading.Lock()
+    
+    def _start(self, cwd: str):
+        """Start a fresh shell with its own output queue and reader threads."""
+        self.sentinel = f"__qwen_code_assistant_{uuid.uuid4().hex}__".encode('ascii')
+        self.process = subprocess.Popen(
+            [self.shell],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=cwd,
+            start_new_session=True
+        )
+        self.output = queue.Queue()
+        for name, pipe in (('stdout', self.process.stdout), ('stderr', self.process.stderr)):
+            threading.Thread(
+                target=self._pump, args=(name, pipe.fileno(), self.output), daemon=True
+            ).start()
+    
+    @staticmethod
+    def _pump(name: str, fd: int, output: queue.Queue):
+        """Forward raw output from one pipe to the queue; None marks EOF."""
+        while True:
+            try:
+                data = os.read(fd, 65536)
+            except OSError:
+                data = b""
+            if not data:
+                output.put((name, None))
+                return
+            output.put((name, data))
+    
+    def close(self):
+        """Terminate the shell and everything it started."""
+        process, self.process = self.process, None
+        if process is None or process.poll() is not None:
+            return
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            process.kill()
+        process.wait()
+        for pipe in (process.stdin, process.stdout, process.stderr):
+            pipe.close()
+    
+    def run(
+        self,
+        command: str,
+        cwd: str,
+        timeout: float,
+        on_output: Optional[Callable[[str, str], None]] = None
+    ) -> tuple:
+        """
+        Run a command in the shell.
+        
+        Args:
+            command: Shell command
+            cwd: Directory the command starts in
+            timeout: Seconds before the shell is killed
+            on_output: Optional callback invoked with (stream, line) as output arrives
+            
+        Returns:
+            (stdout, stderr, exit code, note); the exit code is None and the
+            note explains why if the command did not finish normally
+        """
+        with self.lock:
+            if self.process is None or self.process.poll() is not None:
+                self._start(cwd)
+            sentinel = self.sentinel.decode('ascii')
+            script = (
+                f"cd -- {shlex.quote(cwd)} && eval {shlex.quote(command)} < /dev/null\n"
+                f"printf '%s %s\\n' {sentinel} \"$?\"\n"
+                f"printf '%s\\n' {sentinel} >&2\n"
+            )
+            try:
+                self.process.stdin.write(script.encode('utf-8'))
+                self.process.stdin.flush()
+            except OSError:
+                self.close()
+                return "", "", None, "Error: The shell exited unexpectedly"
+            
+            streams = {name: _ShellStream(name, on_output) for name in ('stdout', 'stderr')}
+            deadline = time.monotonic() + timeout
+            status = None
+            note = None
+            while not all(stream.finished for stream in streams.values()):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    note = (
+                        f"Error: Command timed out after {timeout:g} seconds "
+                        "(the shell was restarted, so its environment was reset)"
+                    )
+                    self.close()
+                    break
+                try:
+                    name, data = self.output.get(timeout=remaining)
+                except queue.Empty:
+                    continue
+                
+                if data is None:
+                    # The command ended the shell itself, e.g. with 'exit'
+                    streams[name].finish()
+                    continue
+                found = streams[name].feed(data, self.sentinel)
+                if found is not None and name == 'stdout':
+                    status = int(found) if found.lstrip('-').isdigit() else None
+            
+            if note is None and status is None:
+                returncode = self.process.wait() if self.process else None
+                self.close()
+                note = f"Note: The shell exited with code {returncode} and will be restarted"
+                status = returncode
+            
+            for stream in streams.values():
+                stream.finish()
+            return streams['stdout'].buffer.getvalue(), streams['stderr'].buffer.getvalue(), status, note
+
+
+class ModelRouter:
+    """
+    Chooses the model and request options for each iteration of the chat loop.
+    
+    When a separate tool model is configured, iterations that pick the next
+    tool (the 'tool' phase) go to that smaller, faster model. Its response
+    is only kept when every call names a known tool with its required
+    arguments; a plain answer or a broken call is discarded and the
+    iteration is repeated on the answer model (the 'answer' phase), which
+    also writes every final response. Tool-phase responses are streamed and
+    a plain answer is cut off early, so the tool model never writes more
+    than its first sentences of it.
+    """
+    
+    PHASES = ('tool', 'answer')
+    
+    # Text a tool-phase response may start with before its first tool call
+    TOOL_PREAMBLE_CHARS = 200
+    
+    def __init__(
+        self,
+        answer_model: str,
+        tool_model: Optional[str] = None,
+        options: Optional[Dict[str, Dict]] = None,
+        max_tool_iterations: int = 8
+    ):
+        """
+        Create a router.
+        
+        Args:
+            answer_model: Model for final answers and escalated iterations
+            tool_model: Model for tool-selection iterations (default: answer_model,
+                which disables routing)
+            options: Per-phase Ollama options, e.g. {'tool': {'num_predict': 256}};
+                a 'keep_alive' entry overrides the assistant's keep_alive
+            max_tool_iterations: Tool-model iterations per turn before every
+                further iteration goes to the answer model
+        """
+        self.models = {'tool': tool_model or answer_model, 'answer': answer_model}
+        # Tool selection wants the most likely call, not variety
+        self.options: Dict[str, Dict] = {'tool': {'temperature': 0.2}, 'answer': {}}
+        for phase, values in (options or {}).items():
+            if phase not in self.PHASES:
+                raise ValueError(f"Unknown phase '{phase}' (expected one of {', '.join(self.PHASES)})")
+            self.options[phase].update(values)
+        self.max_tool_iterations = max_tool_iterations
+    
+    @property
+    def enabled(self) -> bool:
+        """Whether tool-selection iterations go to a different model."""
+        return self.models['tool'] != self.models['answer']
+    
+    def phases(self, tool_iterations: int) -> tuple:
+        """
+        Phases to try, in order, for the next iteration.
+        
+        Args:
+            tool_iterations: Iterations of the current turn accepted from the tool model
+            
+        Returns:
+            ('tool', 'answer') while the tool model may be used, else ('answer',)
+        """
+        if self.enabled and tool_iterations < self.max_tool_iterations:
+            return self.PHASES
+        return ('answer',)
+    
+    def request(self, phase: str, num_ctx: int, keep_alive) -> Dict:
+        """
+        Model, options and keep_alive for a request in a phase.
+        
+        Args:
+            phase: 'tool' or 'answer'
+            num_ctx: Context size used unless the phase sets its own
+            keep_alive: keep_alive used unless the phase sets its own
+            
+        Returns:
+            Keyword arguments for chat()
+        """
+        options = {'num_ctx': num_ctx, **self.options[phase]}
+        return {
+            'model': self.models[phase],
+            'options': options,
+            'keep_alive': options.pop('keep_alive', keep_alive),
+        }
+    
+    @classmethod
+    def abandon(cls, phase: str, turn: Dict) -> bool:
+        """
+        Decide whether to stop a response while it is still streaming.
+        
+        A tool-phase response that writes more than a short preamble without
+        calling a tool would be discarded by review() anyway; generating the
+        rest of it would only delay the answer model.
+        
+        Args:
+            phase: Phase the response is produced in
+            turn: Accumulator from QwenCodeAssistant._new_turn(), so far
+            
+        Returns:
+            True if the request should be aborted
+        """
+        return (
+            phase == 'tool' and not turn['tool_calls']
+            and sum(len(text) for text in turn['content']) > cls.TOOL_PREAMBLE_CHARS
+        )
+    
+    @staticmethod
+    def review(phase: str, turn: Dict, tools: List[Dict]) -> Optional[str]:
+        """
+        Decide whether a response is kept.
+        
+        Args:
+            phase: Phase the response was produced in
+            turn: Accumulator from QwenCodeAssistant._new_turn()
+            tools: Tool definitions offered to the model
+            
+        Returns:
+            Why the iteration should go to the answer model, or None to keep it
+        """
+        if phase == 'answer':
+            return None
+        if not turn['tool_calls']:
+            return 'no tool call'
+        required = {
+            tool['function']['name']: tool['function']['parameters'].get('required', [])
+            for tool in tools
+        }
+        for tool_call in turn['tool_calls']:
+            name = tool_call['function']['name']
+            arguments = tool_call['function']['arguments']
+            if name not in required:
+                return 'unknown tool'
+            if not isinstance(arguments, dict):
+                return 'malformed arguments'
+            if any(parameter not in arguments for parameter in required[name]):
+                return 'missing arguments'
+        return None
 
 
 class QwenCodeAssistant:
     """Main coding assistant class with tool-calling capabilities."""
     
-    def __init__(self, model: str = "qwen3-coder-next:q4_K_M"):
+    def __init__(
+        self,
+        model: str = "qwen3-coder-next:q4_K_M",
+        max_tool_workers: int = 4,
+        max_context_tokens: int = 32768,
+        host: Optional[str] = None,
+        verify: bool = True,
+        keep_alive: str = KEEP_ALIVE,
+        embedding_backend=None,
+        router: Optional[ModelRouter] = None,
+        watch: bool = True,
+        session_log: bool = True,
+        log_compression: Optional[str] = None,
+        prefetch: bool = True
+    ):
+        """
+        Initialize the coding assistant.
+        
+        Args:
+            model: The Ollama model to use (default: qwen3-coder-next:q4_K_M)
+            max_tool_workers: Threads used to run independent tool calls (default: 4)
+            max_context_tokens: Context window requested from Ollama (default: 32768)
+            host: Ollama URL (default: OLLAMA_HOST or http://localhost:11434)
+            verify: Check that Ollama runs and has the model (default: True)
+            keep_alive: How long Ollama keeps the model loaded between requests
+            embedding_backend: Embeddings for semantic_search (default: OllamaEmbeddings
+                with EMBEDDING_MODEL; HashEmbeddings needs no model)
+            router: Model routing between tool and answer phases (default: model for both)
+            watch: Keep caches and indexes fresh with a FileWatcher on the working
+                directory instead of re-scanning it (default: True)
+            session_log: Append the conversation to a SessionLog, for /resume (default: True)
+            log_compression: Compression of the session log: None, 'gzip' or 'zstd'
+            prefetch: Read the files the model will likely ask for next in the
+                background while it generates (default: True)
+        """
+        from ollama import Client
+        
+        self.model = model
+        self.host = host
+        self.keep_alive = keep_alive
+        self.router = router or ModelRouter(model)
+        self.client = Client(host=host)
+        self.embedding_backend = embedding_backend or OllamaEmbeddings(self.client)
+        self.conversation_history: List[Dict] = []
+        self.context = ContextWindow(max_tokens=max_context_tokens)
+        self.tracer = Tracer()
+        self.results = BlobStore()
+        self.shell = ShellSession()
+        self.command_timeout = COMMAND_TIMEOUT
+        self.on_command_output: Optional[Callable[[str, str], None]] = None
+        self.working_directory = os.getcwd()
+        self.log_compression = log_compression
+        self.session_log: Optional[SessionLog] = self._new_session_log() if session_log else None
+        self._search_indexes: Dict[str, SearchIndex] = {}
+        self._symbol_indexes: Dict[str, SymbolIndex] = {}
+        self._embedding_indexes: Dict[tuple, EmbeddingIndex] = {}
+        self.result_cache = ToolResultCache()
+        self.prefetcher: Optional[Prefetcher] = Prefetcher() if prefetch else None
+        self._line_index: "OrderedDict[str, tuple]" = OrderedDict()
+        self._line_index_lock = threading.Lock()
+        self.tool_executor = ThreadPoolExecutor(
+            max_workers=max_tool_workers,
+            thread_name_prefix="tool"
+        )
+        # Separate pool so tools running on tool_executor can fan out
+        self.read_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="read")
+        self.watcher: Optional[FileWatcher] = None
+        if watch:
+            self._start_watcher()
+        
+        # Verify Ollama is running
+        if verify:
+            self._verify_ollama()
+        
+    def _verify_ollama(self):
+        """Verify that Ollama is running and the routed models are available."""
+        for model in sorted(set(self.router.models.values())):
+            error = check_ollama(model, self.host)
+            if error:
+                console.print(error)
+                exit(1)
+    
+    def warm_up(self) -> threading.Thread:
+        """
+        Load the models in the background so the first question does not wait for them.
+        
+        Each request uses the same context size as real requests of its
+        phase (a different num_ctx would make Ollama load the model again)
+        and asks Ollama to keep the model loaded for keep_alive.
+        
+        Returns:
+            The thread doing the requests; their spans are recorded as kind 'warmup'
+        """
+        def load():
+            loaded = set()
+            for phase in reversed(self.router.PHASES):
+                request = self.router.request(phase, self.context.max_tokens, self.keep_alive)
+                if request['model'] in loaded:
+                    continue
+                loaded.add(request['model'])
+                try:
+                    with self.tracer.span('warmup', request['model'], phase=phase) as span:
+                        response = self.client.chat(
+                            model=request['model'],
+                            messages=[],
+                            keep_alive=request['keep_alive'],
+                            options={'num_ctx': request['options']['num_ctx']}
+                        )
+                        span['load_duration'] = response.get('load_duration')
+                except Exception:
+                    # A failed warm-up only means the first question loads the model
+                    pass
+        
+        thread = threading.Thread(target=load, name="warm-up", daemon=True)
+        thread.start()
+        return thread
+    
+    def read_file(
+        self,
+        filepath: str,
+        start_line: Optional[int] = None,
+        end_line: Optional[int] = None,
+        max_bytes: Optional[int] = None
+    ) -> str:
+        """
+        Read a file (or a range of its lines) from the filesystem.
+        
+        Large files are memory-mapped and located through a cached index of
+        line offsets, so reading a range costs O(range) rather than O(file).
+        Whenever part of the file is left out, the result starts with a
+        header giving the total number of lines and what was omitted.
+        
+        Args:
+            filepath: Path to the file to read
+            start_line: First line to return, 1-based (default: 1)
+            end_line: Last line to return, inclusive (default: end of file)
+            max_bytes: Maximum bytes of content to return, positive (default: READ_MAX_BYTES)
+            
+        Returns:
+            File contents or error message
+        """
+        try:
+            if max_bytes is None:
+                max_bytes = READ_MAX_BYTES
+            elif max_bytes <= 0:
+                return ToolError(f"Error: max_bytes must be positive, got {max_bytes}")
+            if start_line is not None and start_line < 1:
+                return ToolError(f"Error: start_line must be at least 1, got {start_line}")
+            full_path = os.path.normpath(os.path.join(self.working_directory, filepath))
+            key = ('read_file', full_path, start_line, end_line, max_bytes)
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                return cached
+            
+            stamps = self.result_cache.stamp([full_path])
+            stamp = stamps[full_path]
+            prefetched = self.prefetcher.take(full_path, stamp) if self.prefetcher else None
+            if prefetched is not None:
+                content = self._file_content(
+                    full_path, stamp, prefetched, filepath, start_line, end_line, max_bytes
+                )
+            else:
+                with open(full_path, 'rb') as f:
+                    if os.fstat(f.fileno()).st_size < MMAP_THRESHOLD:
+                        content = self._file_content(
+                            full_path, stamp, f.read(), filepath, start_line, end_line, max_bytes
+                        )
+                    else:
+                        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                            content = self._file_content(
+                                full_path, stamp, data, filepath, start_line, end_line, max_bytes
+                            )
+            
+            self.result_cache.put(key, content, stamps)
+            return content
+        except FileNotFoundError:
+            return ToolError(f"Error: File not found: {filepath}")
+        except PermissionError:
+            return ToolError(f"Error: Permission denied: {filepath}")
+        except Exception as e:
+            return ToolError(f"Error reading file {filepath}: {str(e)}")
+    
+    def read_files(self, paths: List[str], max_total_bytes: Optional[int] = None) -> str:
+        """
+        Read several files (or glob patterns) concurrently in one call.
+        
+        The byte budget is shared fairly: small files are returned whole and
+        the remainder is split evenly among the larger ones, which are
+        truncated at line boundaries with read_file's header. Sizes are
+        UTF-8 bytes of each file's section, headings and headers included.
+        
+        Args:
+            paths: File paths and/or glob patterns (e.g. src/**/*.py)
+            max_total_bytes: Total bytes of the file sections to return
+                (default: READ_FILES_MAX_BYTES)
+            
+        Returns:
+            The contents of every file, each under its own heading
+        """
+        try:
+            if max_total_bytes is None:
+                budget = READ_FILES_MAX_BYTES
+            elif max_total_bytes <= 0:
+                return ToolError(f"Error: max_total_bytes must be positive, got {max_total_bytes}")
+            else:
+                budget = max_total_bytes
+            
+            filepaths: List[str] = []
+            for path in paths:
+                if glob.has_magic(path):
+                    pattern = os.path.join(glob.escape(self.working_directory), path)
+                    matches = [
+                        os.path.relpath(match, self.working_directory)
+                        for match in glob.glob(pattern, recursive=True)
+                        if os.path.isfile(match)
+                    ]
+                    filepaths.extend(sorted(
+                        match for match in matches
+                        if not SKIP_DIRS.intersection(match.split(os.sep))
+                    ))
+                else:
+                    filepaths.append(path)
+            filepaths = list(dict.fromkeys(os.path.normpath(path) for path in filepaths))
+            
+            if not filepaths:
+                return f"No files matched: {', '.join(paths)}"
+            
+            skipped = filepaths[READ_FILES_MAX_COUNT:]
+            filepaths = filepaths[:READ_FILES_MAX_COUNT]
+            
+            # First pass: everything up to the whole budget, concurrently
+            contents = dict(zip(filepaths, self.read_executor.map(
+                lambda path: self.read_file(path, max_bytes=budget), filepaths
+            )))
+            
+            def section(path: str, content: str) -> str:
+                return f"===== {path} =====\n{content}"
+            
+            def section_bytes(path: str, content: str) -> int:
+                return len(section(path, content).encode('utf-8'))
+            
+            # Share the budget, smallest files first
+            limits: Dict[str, int] = {}
+            remaining = budget
+            sizes = {path: section_bytes(path, contents[path]) for path in filepaths}
+            by_size = sorted(filepaths, key=lambda path: sizes[path])
+            for position, path in enumerate(by_size):
+                share = remaining // (len(by_size) - position)
+                if sizes[path] > share:
+                    limits[path] = share
+                    sizes[path] = share
+                remaining -= sizes[path]
+            
+            def fit(path: str) -> str:
+                # read_file caps the content only, so leave room for the
+                # heading and its header, shrinking until the section fits
+                share = limits[path]
+                max_bytes = share - section_bytes(path, '')
+                while True:
+                    content = self.read_file(path, max_bytes=max(max_bytes, 1))
+                    overshoot = section_bytes(path, content) - share
+                    if overshoot <= 0 or max_bytes <= 1 or isinstance(content, ToolError):
+                        return content
+                    max_bytes -= overshoot
+            
+            # Second pass for the files that have to be cut down; the line
+            # offsets of each file are cached, so this reads only what is kept
+            if limits:
+                truncated = list(limits)
+                contents.update(zip(truncated, self.read_executor.map(fit, truncated)))
+            
+            sections = [section(path, contents[path]) for path in filepaths]
+            summary = f"[Read {len(filepaths)} file(s)"
+            if limits:
+                summary += f"; {len(limits)} truncated to fit the {budget} byte budget"
+            if skipped:
+                summary += (
+                    f"; {len(skipped)} more matching file(s) not read "
+                    f"(limit {READ_FILES_MAX_COUNT} per call): {', '.join(skipped[:10])}"
+                )
+            sections.append(summary + "]")
+            return "\n\n".join(sections)
+        
+        except Exception as e:
+            return ToolError(f"Error reading files: {str(e)}")
+    
+    def _file_content(
+        self,
+        full_path: str,
+        stamp: Optional[tuple],
+        data,
+        filepath: str,
+        start_line: Optional[int],
+        end_line: Optional[int],
+        max_bytes: int
+    ) -> str:
+        """
+        Turn the bytes of a file into read_file's result.
+        
+        Args:
+            full_path: Absolute path of the file
+            stamp: Stamp of the file when it was opened
+            data: File contents (bytes or mmap)
+            filepath: Path as given by the caller
+            start_line: First line, 1-based
+            end_line: Last line, inclusive
+            max_bytes: Maximum bytes of content to return
+            
+        Returns:
+            The whole file, a header with the selected lines, or a note on binary files
+        """
+        if b'\0' in data[:8192]:
+            return f"Binary file: {filepath} ({len(data)} bytes); contents not shown"
+        if start_line is None and end_line is None and len(data) <= max_bytes:
+            return data[:].decode('utf-8', errors='replace')
+        return self._read_lines(full_path, stamp, data, filepath, start_line, end_line, max_bytes)
+    
+    def _line_starts(self, full_path: str, stamp: Optional[tuple], data) -> array:
+        """
+        Get the byte offset of every line start, cached per file version.
+        
+        Args:
+            full_path: Absolute path of the file
+            stamp: Stamp of the file when it was opened
+            data: File contents (bytes or mmap)
+            
+        Returns:
+            Offsets of the first byte of each line
+        """
+        with self._line_index_lock:
+            cached = self._line_index.get(full_path)
+            if cached is not None and cached[0] == stamp:
+                self._line_index.move_to_end(full_path)
+                return cached[1]
+        
+        starts = array('Q', [0] if len(data) else [])
+        position = data.find(b'\n')
+        while position != -1 and position + 1 < len(data):
+            starts.append(position + 1)
+            position = data.find(b'\n', position + 1)
+        
+        with self._line_index_lock:
+            self._line_index[full_path] = (stamp, starts)
+            if len(self._line_index) > 32:
+                self._line_index.popitem(last=False)
+        return starts
+    
+    def _read_lines(
+        self,
+        full_path: str,
+        stamp: Optional[tuple],
+        data,
+        filepath: str,
+        start_line: Optional[int],
+        end_line: Optional[int],
+        max_bytes: int
+    ) -> str:
+        """
+        Extract a range of lines, capped at max_bytes, with a header.
+        
+        Args:
+            full_path: Absolute path of the file
+            stamp: Stamp of the file when it was opened
+            data: File contents (bytes or mmap)
+            filepath: Path as given by the caller, for the header
+            start_line: First line, 1-based
+            end_line: Last line, inclusive
+            max_bytes: Maximum bytes of content to return
+            
+        Returns:
+            Header followed by the selected lines, or an error if start_line
+            is beyond the end of the file
+        """
+        starts = self._line_starts(full_path, stamp, data)
+        total = len(starts)
+        if start_line is not None and start_line > max(total, 1):
+            return ToolError(f"Error: start_line {start_line} beyond end of file ({total} lines)")
+        if total == 0:
+            return f"[{filepath}: empty file]"
+        
+        first = start_line or 1
+        last = min(max(end_line or total, first), total)
+        
+        begin = starts[first - 1]
+        end = starts[last] if last < total else len(data)
+        
+        # Cut at the last complete line that fits into max_bytes
+        line_cut = False
+        if end - begin > max_bytes:
+            fitting = bisect.bisect_right(starts, begin + max_bytes) - 1
+            if fitting >= first:
+                last = fitting
+                end = starts[last]
+            else:
+                # A single line longer than max_bytes
+                last = first
+                end = begin + max_bytes
+                line_cut = True
+        
+        content = data[begin:end].decode('utf-8', errors='replace')
+        omitted = total - (last - first + 1)
+        header = f"[{filepath}: lines {first}-{last} of {total}"
+        if omitted:
+            header += f"; {omitted} lines not shown. Use start_line/end_line to read other parts"
+        if line_cut:
+            header += f"; line {first} cut after {max_bytes} bytes"
+        return f"{header}]\n{content}"
+    
+    def write_file(self, filepath: str, content: str) -> str:
+        """
+        Write content to a file.
+        
+        Args:
+            filepath: Path to the file to write
+            content: Content to write to the file
+            
+        Returns:
+            Success message or error
+        """
+        try:
+            full_path = os.path.join(self.working_directory, filepath)
+            directory = os.path.dirname(full_path)
+            
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            
+            with open(full_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            self._file_changed(full_path)
+            
+            return f"✓ Successfully wrote to {filepath} ({len(content)} bytes)"
+        except PermissionError:
+            return ToolError(f"Error: Permission denied: {filepath}")
+        except Exception as e:
+            return ToolError(f"Error writing file {filepath}: {str(e)}")
+    
+    def edit_file(
+        self,
+        filepath: str,
+        edits: Optional[List[Dict]] = None,
+        diff: Optional[str] = None
+    ) -> str:
+        """
+        Apply targeted edits to a file instead of rewriting it.
+        
+        Each edit is located exactly, then ignoring indentation, then by fuzzy
+        similarity. Either every edit applies or the file is left untouched.
+        The result is written atomically (temporary file + rename).
+        
+        Args:
+            filepath: Path to the file to edit
+            edits: List of {'search': ..., 'replace': ...} blocks, applied in order
+            diff: Unified diff to apply (alternative to edits)
+            
+        Returns:
+            Success message or a description of the conflict
+        """
+        try:
+            full_path = os.path.normpath(os.path.join(self.working_directory, filepath))
+            
+            changes = [
+                (edit.get('search', ''), edit.get('replace', ''), None)
+                for edit in edits or []
+            ]
+            try:
+                if diff:
+                    changes += parse_unified_diff(diff)
+            except EditConflict as e:
+                return ToolError(f"Error: Could not edit {filepath}: {e}")
+            if not changes:
+                return ToolError("Error: edit_file needs 'edits' or 'diff'")
+            
+            if os.path.exists(full_path):
+                with open(full_path, 'r', encoding='utf-8', newline='') as f:
+                    original = f.read()
+            elif all(not search.strip() for search, _, _ in changes):
+                original = ''
+            else:
+                return ToolError(f"Error: File not found: {filepath}")
+            
+            newline = '\r\n' if '\r\n' in original else '\n'
+            content = original.replace('\r\n', '\n')
+            notes = []
+            
+            for number, (search, replace, hint) in enumerate(changes, 1):
+                try:
+                    content, line, kind = apply_edit(
+                        content,
+                        search.replace('\r\n', '\n'),
+                        replace.replace('\r\n', '\n'),
+                        hint
+                    )
+                except EditConflict as e:
+                    return ToolError(
+                        f"Error: Edit {number} of {len(changes)} could not be applied to "
+                        f"{filepath}: {e}. No changes were written; read the file again "
+                        "and retry with search text copied exactly from it."
+                    )
+                if kind != 'exact':
+                    notes.append(f"edit {number} matched at line {line} ({kind})")
+            
+            if newline != '\n':
+                content = content.replace('\n', newline)
+            if content == original:
+                return f"No changes: the edits leave {filepath} unchanged"
+            
+            directory = os.path.dirname(full_path)
+            os.makedirs(directory, exist_ok=True)
+            handle, temp_path = tempfile.mkstemp(dir=directory, prefix='.edit-', suffix='.tmp')
+            try:
+                with os.fdopen(handle, 'w', encoding='utf-8', newline='') as f:
+                    f.write(content)
+                if os.path.exists(full_path):
+                    os.chmod(temp_path, os.stat(full_path).st_mode & 0o7777)
+                os.replace(temp_path, full_path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+            self._file_changed(full_path)
+            
+            delta = difflib.ndiff(original.splitlines(), content.splitlines())
+            added = removed = 0
+            for line in delta:
+                added += line.startswith('+ ')
+                removed += line.startswith('- ')
+            
+            message = f"✓ Applied {len(changes)} edit(s) to {filepath} (+{added} -{removed} lines)"
+            if notes:
+                message += "\nNote: " + "; ".join(notes)
+            return message
+        except PermissionError:
+            return ToolError(f"Error: Permission denied: {filepath}")
+        except UnicodeDecodeError:
+            return ToolError(f"Error: {filepath} is not a UTF-8 text file")
+        except Exception as e:
+            return ToolError(f"Error editing file {filepath}: {str(e)}")
+    
+    def _file_changed(self, full_path: str):
+        """
+        Drop cached data about a file the assistant modified.
+        
+        Args:
+            full_path: Absolute path of the file
+        """
+        full_path = os.path.normpath(full_path)
+        self.search_index.invalidate(full_path)
+        self.symbol_index.invalidate(full_path)
+        self.result_cache.invalidate(full_path)
+        if self.prefetcher is not None:
+            self.prefetcher.invalidate(full_path)
+    
+    def execute_command(self, command: str, timeout: Optional[float] = None) -> str:
+        """
+        Execute a shell command safely.
+        
+        Commands run one after another in a persistent shell, so environment
+        changes such as an activated virtualenv carry over; each starts in
+        the working directory. Long output keeps only its head and tail.
+        
+        Args:
+            command: The shell command to execute
+            timeout: Seconds to wait (default: command_timeout, capped at COMMAND_MAX_TIMEOUT)
+            
+        Returns:
+            Command output or error message
+        """
+        # Safety check - prevent dangerous commands
+        if self._command_blocked(command):
+            return ToolError("Error: Command blocked for safety reasons")
+        
+        timeout = min(float(timeout or self.command_timeout), COMMAND_MAX_TIMEOUT)
+        try:
+            stdout, stderr, returncode, note = self.shell.run(
+                command, self.working_directory, timeout, self.on_command_output
+            )
+        except Exception as e:
+            return ToolError(f"Error executing command: {str(e)}")
+        finally:
+            self._sync_tree()
+        
+        output = self._format_command_output(stdout, stderr, returncode or 0)
+        if note is None:
+            return output
+        if note.startswith("Error"):
+            return ToolError(f"{note}\nPartial output:\n{output}" if stdout or stderr else note)
+        return note if not (stdout or stderr) else f"{output}\n{note}"
+    
+    @staticmethod
+    def _command_blocked(command: str) -> bool:
+        """
+        Check a command against the list of dangerous patterns.
+        
+        Args:
+            command: The shell command
+            
+        Returns:
+            True if the command must not run
+        """
+        dangerous_patterns = ['rm -rf /', 'mkfs', 'dd if=', ':(){:|:&};:']
+        return any(pattern in command.lower() for pattern in dangerous_patterns)
+    
+    @staticmethod
+    def _format_command_output(stdout: str, stderr: str, returncode: int) -> str:
+        """
+        Combine the output of a finished command into a tool result.
+        
+        Args:
+            stdout: Standard output
+            stderr: Standard error
+            returncode: Exit code
+            
+        Returns:
+            Formatted output
+        """
+        output = []
+        if stdout:
+            output.append(stdout)
+        if stderr:
+            output.append(f"STDERR: {stderr}")
+        if returncode != 0:
+            output.append(f"Exit code: {returncode}")
+        
+        return "\n".join(output) if output else "Command executed successfully (no output)"
+    
+    def _tree_changed(self):
+        """Drop cached data after something may have changed any file."""
+        self.search_index.invalidate()
+        self.symbol_index.invalidate()
+        self.result_cache.invalidate()
+    
+    def _sync_tree(self):
+        """Catch up with whatever a command changed, re-scanning only without a watcher."""
+        if self.watcher is None or not self.watcher.flush():
+            self._tree_changed()
+    
+    def _files_changed(self, paths: Optional[set]):
+        """
+        Apply a batch of changes published by the file watcher.
+        
+        Args:
+            paths: Absolute paths that changed, or None if anything may have changed
+        """
+        if paths is None:
+            self._tree_changed()
+            return
+        for path in paths:
+            self._file_changed(path)
+    
+    def _start_watcher(self):
+        """Watch the working directory, replacing the watcher of the previous one."""
+        if self.watcher is not None:
+            self.watcher.stop()
+            for indexes in (self._search_indexes, self._symbol_indexes):
+                if self.watcher.root in indexes:
+                    indexes[self.watcher.root].watched = False
+        self.watcher = FileWatcher(self.working_directory)
+        self.watcher.subscribe(self._files_changed)
+        self.search_index.watched = True
+        self.symbol_index.watched = True
+        self.watcher.start()
+    
+    def list_files(
+        self,
+        directory: str = ".",
+        offset: int = 0,
+        limit: Optional[int] = None,
+        max_depth: Optional[int] = None,
+        extensions: Optional[List[str]] = None,
+        summary: bool = False
+    ) -> str:
+        """
+        List files in a directory.
+        
+        The walk honors .gitignore and .ignore files and stops once the
+        requested page is full.
+        
+        Args:
+            directory: Directory to list (default: current directory)
+            offset: Number of entries to skip, for paging (default: 0)
+            limit: Maximum entries to return (default: LIST_FILES_LIMIT)
+            max_depth: Deepest level to list, 1 for the directory itself;
+                in summary mode, how deep directories are broken out (default: 2)
+            extensions: Only include files with these extensions
+            summary: Return file counts and sizes per directory instead of file names
+            
+        Returns:
+            List of files or error message
+        """
+        try:
+            target_dir = os.path.normpath(os.path.join(self.working_directory, directory))
+            
+            if not os.path.exists(target_dir):
+                return ToolError(f"Error: Directory not found: {directory}")
+            
+            offset = max(0, offset or 0)
+            limit = min(max(1, limit or LIST_FILES_LIMIT), LIST_FILES_MAX_LIMIT)
+            key = (
+                'list_files', self.working_directory, target_dir, offset, limit,
+                max_depth, tuple(extensions or ()), summary
+            )
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                return cached
+            
+            walker = TreeWalker(
+                target_dir,
+                self.working_directory,
+                max_depth=None if summary else max_depth,
+                extensions=extensions
+            )
+            if summary:
+                result = self._summarize_tree(walker, directory, offset, limit, max_depth or 2)
+            else:
+                result = self._list_page(walker, directory, offset, limit)
+            
+            # Adding or removing entries changes a directory's mtime
+            self.result_cache.put(key, result, walker.stamps)
+            return result
+        
+        except Exception as e:
+            return ToolError(f"Error listing files: {str(e)}")
+    
+    def _list_page(self, walker: TreeWalker, directory: str, offset: int, limit: int) -> str:
+        """
+        Walk just far enough to fill one page of file names.
+        
+        Args:
+            walker: Prepared tree walker
+            directory: Directory as given by the caller
+            offset: Entries to skip
+            limit: Entries to return
+            
+        Returns:
+            The page, with a note on how to get the next one
+        """
+        files = []
+        more = False
+        for index, (entry, _) in enumerate(walker.walk()):
+            if index < offset:
+                continue
+            if len(files) == limit:
+                more = True
+                break
+            files.append(os.path.relpath(entry.path, self.working_directory))
+        
+        if not files:
+            return f"No more files in {directory} (offset {offset})" if offset else f"No files found in {directory}"
+        if more:
+            files.append(f"... more files not shown (use offset={offset + limit} for the next page)")
+        return "\n".join(files)
+    
+    def _summarize_tree(self, walker: TreeWalker, directory: str, offset: int, limit: int, depth: int) -> str:
+        """
+        Count files and bytes per directory.
+        
+        Args:
+            walker: Prepared tree walker
+            directory: Directory as given by the caller
+            offset: Rows to skip
+            limit: Rows to return
+            depth: Directories down to this level get their own row
+            
+        Returns:
+            One row per directory with totals for everything below it
+        """
+        totals: Dict[str, list] = {}
+        for entry, level in walker.walk():
+            try:
+                size = entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+            parts = os.path.relpath(entry.path, walker.top).split(os.sep)[:-1]
+            extension = os.path.splitext(entry.name)[1].lower() or entry.name
+            for k in range(min(len(parts), depth - 1) + 1):
+                row = totals.setdefault('/'.join(parts[:k]), [0, 0, {}])
+                row[0] += 1
+                row[1] += size
+                row[2][extension] = row[2].get(extension, 0) + 1
+        
+        if not totals:
+            return f"No files found in {directory}"
+        
+        base = os.path.relpath(walker.top, self.working_directory)
+        rows = []
+        for name in sorted(totals)[offset:offset + limit]:
+            count, size, extensions = totals[name]
+            common = sorted(extensions.items(), key=lambda item: -item[1])[:3]
+            path = os.path.normpath(os.path.join(base, name)) + os.sep
+            rows.append(
+                f"{path}  {count} files, {format_size(size)}  "
+                f"({', '.join(f'{ext} {n}' for ext, n in common)})"
+            )
+        if len(totals) > offset + limit:
+            rows.append(f"... more directories not shown (use offset={offset + limit} for the next page)")
+        return "\n".join(rows)
+    
+    def search_code(
+        self,
+        query: str,
+        file_pattern: str = "*.py",
+        regex: bool = False,
+        queries: Optional[List[str]] = None
+    ) -> str:
+        """
+        Search for a pattern in code files.
+        
+        Candidate files come from the working directory's trigram index and
+        are then checked line by line.
+        
+        Args:
+            query: Search term (case-insensitive)
+            file_pattern: File pattern to search (e.g., *.py, *.js)
+            regex: Treat the query as a regular expression
+            queries: Additional patterns; lines matching any pattern are reported
+            
+        Returns:
+            Search results or error message
+        """
+        try:
+            patterns = [query] + list(queries or [])
+            
+            if regex:
+                try:
+                    compiled = [re.compile(p, re.IGNORECASE) for p in patterns]
+                except re.error as e:
+                    return ToolError(f"Error: Invalid regular expression: {e}")
+                
+                def matches(text: str) -> bool:
+                    return any(c.search(text) for c in compiled)
+            else:
+                lowered = [p.lower() for p in patterns]
+                
+                def matches(text: str) -> bool:
+                    text = text.lower()
+                    return any(p in text for p in lowered)
+            
+            # Results stay valid as long as the index generation does not change
+            index = self.search_index
+            key = (
+                'search_code', index.root, index.update(),
+                tuple(patterns), file_pattern, regex
+            )
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                return cached
+            
+            match_path = '/' in file_pattern or os.sep in file_pattern
+            results = []
+            # The index generation covers the tree; stamps catch edits to the matched files
+            stamps: Dict[str, Optional[tuple]] = {}
+            
+            for filepath in index.candidates(patterns, regex):
+                name = filepath.replace(os.sep, '/') if match_path else os.path.basename(filepath)
+                if not fnmatch.fnmatch(name, file_pattern):
+                    continue
+                
+                full_path = os.path.join(self.working_directory, filepath)
+                stamp = file_stamp(full_path)
+                try:
+                    with open(full_path, 'r', encoding='utf-8') as f:
+                        content = f.read()
+                except Exception:
+                    continue
+                
+                if not regex and not matches(content):
+                    continue
+                
+                matched_lines = []
+                for i, line in enumerate(content.split('\n'), 1):
+                    if matches(line):
+                        matched_lines.append(f"  Line {i}: {line.strip()}")
+                        if len(matched_lines) >= 3:  # Limit to 3 matches per file
+                            break
+                
+                if matched_lines:
+                    stamps[full_path] = stamp
+                    results.append(f"\n{filepath}:\n" + "\n".join(matched_lines))
+                    if len(results) > 10:
+                        break
+            
+            if not results:
+                result = f"No matches found for '{query}' in {file_pattern} files"
+            else:
+                # Limit to first 10 files
+                if len(results) > 10:
+                    results = results[:10]
+                    results.append(f"\n... and more matches")
+                result = "\n".join(results)
+            
+            self.result_cache.put(key, result, stamps)
+            return result
+        
+        except Exception as e:
+            return ToolError(f"Error searching code: {str(e)}")
+    
+    @property
+    def search_index(self) -> SearchIndex:
+        """The search index of the current working directory."""
+        index = self._search_indexes.get(self.working_directory)
+        if index is None:
+            index = SearchIndex(self.working_directory)
+            self._search_indexes[self.working_directory] = index
+        return index
+    
+    @property
+    def symbol_index(self) -> SymbolIndex:
+        """The symbol index of the current working directory."""
+        index = self._symbol_indexes.get(self.working_directory)
+        if index is None:
+            index = SymbolIndex(self.working_directory)
+            self._symbol_indexes[self.working_directory] = index
+        return index
+    
+    @property
+    def embedding_index(self) -> EmbeddingIndex:
+        """The embedding index of the current working directory."""
+        key = (self.working_directory, self.embedding_backend.name)
+        index = self._embedding_indexes.get(key)
+        if index is None:
+            index = EmbeddingIndex(self.symbol_index, self.embedding_backend)
+            self._embedding_indexes[key] = index
+        return index
+    
+    def semantic_search(self, query: str, limit: Optional[int] = None, file_pattern: Optional[str] = None) -> str:
+        """
+        Find the functions and classes whose code is closest in meaning to a query.
+        
+        The first call on a tree embeds for at most SEMANTIC_INDEX_SECONDS and
+        answers from what it has; the rest is embedded in the background.
+        
+        Args:
+            query: Natural-language description of the code
+            limit: Number of results (default: SEMANTIC_SEARCH_LIMIT)
+            file_pattern: Only search files matching this pattern (e.g. *.py)
+            
+        Returns:
+            Ranked locations with a short preview, or an error message
+        """
+        if not numpy_available():
+            return ToolError("Error: semantic_search needs NumPy (pip install numpy)")
+        
+        try:
+            limit = min(max(1, limit or SEMANTIC_SEARCH_LIMIT), SEMANTIC_SEARCH_MAX_LIMIT)
+            index = self.embedding_index
+            try:
+                generation = index.update(SEMANTIC_INDEX_SECONDS)
+            except Exception as e:
+                return ToolError(
+                    f"Error: Could not embed the code: {e}\n"
+                    f"Is the embedding model installed? Try: ollama pull {getattr(self.embedding_backend, 'model', EMBEDDING_MODEL)}"
+                )
+            
+            key = ('semantic_search', index.root, index.backend.name, generation, query, limit, file_pattern)
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                return cached
+            
+            results = []
+            stamps: Dict[str, Optional[tuple]] = {}
+            for score, relpath, start, end, title in index.search(query, limit, file_pattern):
+                full_path = os.path.join(index.root, relpath)
+                stamps[full_path] = file_stamp(full_path)
+                try:
+                    with open(full_path, 'r', encoding='utf-8') as f:
+                        preview = f.read().split('\n')[start - 1:min(end, start + 2)]
+                except (OSError, UnicodeDecodeError):
+                    preview = []
+                results.append(
+                    f"{relpath}:{start}-{end}  {title or 'lines'}  (similarity {score:.2f})\n"
+                    + "\n".join(f"    {line.rstrip()}" for line in preview)
+                )
+            result = "\n".join(results) if results else f"No code found for '{query}'"
+            
+            if index.pending:
+                index.update_in_background()
+                return (
+                    f"{result}\n[Still embedding: {index.pending} file(s) not indexed yet, so "
+                    f"results may be incomplete. Ask again shortly for complete results]"
+                )
+            self.result_cache.put(key, result, stamps)
+            return result
+        
+        except Exception as e:
+            return ToolError(f"Error in semantic search: {str(e)}")
+    
+    def find_definition(self, name: str, kind: Optional[str] = None) -> str:
+        """
+        Find where a symbol is defined.
+        
+        Args:
+            name: Symbol name, optionally qualified (e.g. Parser.parse)
+            kind: Only report this kind (class, function, method, variable, type, ...)
+            
+        Returns:
+            Locations with their definition lines, or a message if none were found
+        """
+        try:
+            index = self.symbol_index
+            key = ('find_definition', index.root, index.update(), name, kind)
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                return cached
+            
+            matches = [
+                (relpath, definition) for relpath, definition in index.definitions(name)
+                if kind is None or definition[1] == kind
+            ]
+            if not matches:
+                result = f"No definition found for '{name}'. Try search_code for a text search."
+            else:
+                lines = []
+                for relpath, (_, symbol_kind, line, _, qualname, source) in matches[:FIND_DEFINITION_LIMIT]:
+                    lines.append(f"{relpath}:{line}  {symbol_kind}  {qualname}\n    {source}")
+                if len(matches) > FIND_DEFINITION_LIMIT:
+                    lines.append(f"... and {len(matches) - FIND_DEFINITION_LIMIT} more definitions")
+                result = "\n".join(lines)
+            
+            stamps = self.result_cache.stamp(sorted({
+                os.path.join(index.root, relpath) for relpath, _ in matches[:FIND_DEFINITION_LIMIT]
+            }))
+            self.result_cache.put(key, result, stamps)
+            return result
+        
+        except Exception as e:
+            return ToolError(f"Error finding definition: {str(e)}")
+    
+    def find_references(self, name: str, file_pattern: Optional[str] = None) -> str:
+        """
+        Find the lines that use an identifier (whole-word, case-sensitive).
+        
+        Args:
+            name: Identifier; for a qualified name, its last part is looked up
+            file_pattern: Only report files matching this pattern (e.g. *.py)
+            
+        Returns:
+            Reference lines grouped by file, or a message if none were found
+        """
+        try:
+            index = self.symbol_index
+            key = ('find_references', index.root, index.update(), name, file_pattern)
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                return cached
+            
+            matches = index.references(name)
+            if file_pattern:
+                match_path = '/' in file_pattern or os.sep in file_pattern
+                matches = [
+                    (relpath, lines) for relpath, lines in matches
+                    if fnmatch.fnmatch(
+                        relpath.replace(os.sep, '/') if match_path else os.path.basename(relpath),
+                        file_pattern
+                    )
+                ]
+            
+            total = sum(len(lines) for _, lines in matches)
+            stamps: Dict[str, Optional[tuple]] = {}
+            if not total:
+                result = f"No references found for '{name}'"
+            else:
+                results = [f"{total} references in {len(matches)} files"]
+                shown = 0
+                for relpath, lines in matches:
+                    if shown >= FIND_REFERENCES_LIMIT:
+                        break
+                    full_path = os.path.join(index.root, relpath)
+                    stamps[full_path] = file_stamp(full_path)
+                    try:
+                        with open(full_path, 'r', encoding='utf-8') as f:
+                            source = f.read().split('\n')
+                    except (OSError, UnicodeDecodeError):
+                        continue
+                    lines = lines[:FIND_REFERENCES_LIMIT - shown]
+                    shown += len(lines)
+                    results.append(f"\n{relpath}:")
+                    results.extend(
+                        f"  Line {line}: {source[line - 1].strip()}" for line in lines if line <= len(source)
+                    )
+                if shown < total:
+                    results.append(f"\n... and {total - shown} more references")
+                result = "\n".join(results)
+            
+            self.result_cache.put(key, result, stamps)
+            return result
+        
+        except Exception as e:
+            return ToolError(f"Error finding references: {str(e)}")
+    
+    def file_outline(self, filepath: str) -> str:
+        """
+        List the classes, functions and other definitions of a file.
+        
+        Args:
+            filepath: Path to the file
+            
+        Returns:
+            One line per definition, nested by container, or an error message
+        """
+        try:
+            full_path = os.path.normpath(os.path.join(self.working_directory, filepath))
+            if not os.path.isfile(full_path):
+                return ToolError(f"Error: File not found: {filepath}")
+            if os.path.splitext(full_path)[1].lower() not in SYMBOL_PARSERS:
+                return ToolError(f"Error: No symbol parser for {os.path.splitext(full_path)[1] or 'extensionless'} files")
+            
+            index = self.symbol_index
+            relpath = os.path.relpath(full_path, index.root)
+            definitions = None if relpath.startswith(os.pardir) else index.outline(relpath)
+            if definitions is None:
+                # Ignored or outside the working directory: parse it directly
+                parsed = parse_symbols_file(full_path)
+                if parsed is None:
+                    return ToolError(f"Error: Could not parse {filepath}")
+                definitions = sorted(parsed[0], key=lambda definition: definition[2])
+            
+            if not definitions:
+                return f"No definitions found in {filepath}"
+            lines = [f"{filepath} ({len(definitions)} definitions)"]
+            for name, kind, line, end_line, qualname, source in definitions:
+                span = f"{line}-{end_line}" if end_line and end_line != line else str(line)
+                depth = qualname.count('.') if name != qualname else 0
+                lines.append(f"  {span:>9}  {'  ' * depth}{kind} {qualname}: {source}")
+            return "\n".join(lines)
+        
+        except Exception as e:
+            return ToolError(f"Error outlining file: {str(e)}")
+    
+    def get_available_tools(self) -> List[Dict]:
+        """
+        Define tools available to the assistant.
+        
+        Returns:
+            List of tool definitions in Ollama format
+        """
+        tools = [
+            {
+                'type': 'function',
+                'function': {
+                    'name': 'read_file',
+                    'description': 'Read the contents of a file from the filesystem. Large files are truncated; read them in parts with start_line/end_line',
+                    'parameters': {
+                        'type': 'object',
+                        'properties': {
+                            'filepath': {
+                                'type': 'string',
+                                'description': 'Path to the file to read (relative to working directory)'
+                            },
+                            'start_line': {
+                                'type': 'integer',
+                                'description': 'First line to read, 1-based (default: 1)'
+                            },
+                            'end_line': {
+                                'type': 'integer',
+                                'description': 'Last line to read, inclusive (default: end of file)'
+                            },
+                            'max_bytes': {
+                                'type': 'integer',
+                                'description': 'Maximum bytes to return (default: 65536)'
+                            }
+                        },
+                        'required': ['filepath']
+                    }
+                }
+            },
+            {
+                'type': 'function',
+                'function': {
+                    'name': 'read_files',
+                    'description': 'Read several files at once. Prefer this over repeated read_file calls when you need more than one file',
+                    'parameters': {
+                        'type': 'object',
+                        'properties': {
+                            'paths': {
+                                'type': 'array',
+                                'items': {'type': 'string'},
+                                'description': 'File paths and/or glob patterns such as src/**/*.py (relative to working directory)'
+                            },
+                            'max_total_bytes': {
+                                'type': 'integer',
+                                'description': 'Total bytes to return across all files (default: 131072)'
+                            }
+                        },
+                        'required': ['paths']
+                    }
+                }
+            },
+            {
+                'type': 'function',
+                'function': {
+                    'name': 'write_file',
+                    'description': 'Write content to a file. Creates directories if needed.',
+                    'parameters': {
+                        'type': 'object',
+                        'properties': {
+                            'filepath': {
+                                'type': 'string',
+                                'description': 'Path to the file to write (relative to working directory)'
+                            },
+                            'content': {
+                                'type': 'string',
+                                'description': 'Content to write to the file'
+                            }
+                        },
+                        'required': ['filepath', 'content']
+                    }
+                }
+            },
+            {
+                'type': 'function',
+                'function': {
+                    'name': 'edit_file',
+                    'description': (
+                        'Edit part of an existing file without rewriting it. Prefer this over write_file '
+                        'for changes to existing files. Give search/replace blocks (search text copied '
+                        'from the file, with enough lines to be unique) or a unified diff.'
+                    ),
+                    'parameters': {
+                        'type': 'object',
+                        'properties': {
+                            'filepath': {
+                                'type': 'string',
+                                'description': 'Path to the file to edit (relative to working directory)'
+                            },
+                            'edits': {
+                                'type': 'array',
+                                'description': 'Search/replace blocks, applied in order',
+                                'items': {
+                                    'type': 'object',
+                                    'properties': {
+                                        'search': {
+                                            'type': 'string',
+                                            'description': 'Existing text to replace'
+                                        },
+                                        'replace': {
+                                            'type': 'string',
+                                            'description': 'New text'
+                                        }
+                                    },
+                                    'required': ['search', 'replace']
+                                }
+                            },
+                            'diff': {
+                                'type': 'string',
+                                'description': 'Unified diff of this file only, to apply instead of edits'
+                            }
+                        },
+                        'required': ['filepath']
+                    }
+                }
+            },
+            {
+                'type': 'function',
+                'function': {
+                    'name': 'execute_command',
+                    'description': 'Execute a shell command. Use for running tests, installing packages, git operations, etc. Commands share one shell, so environment changes (e.g. an activated virtualenv) persist; each starts in the working directory.',
+                    'parameters': {
+                        'type': 'object',
+                        'properties': {
+                            'command': {
+                                'type': 'string',
+                                'description': 'The shell command to execute'
+                            },
+                            'timeout': {
+                                'type': 'integer',
+                                'description': f'Seconds to wait before killing the command (default: {COMMAND_TIMEOUT}, max: {COMMAND_MAX_TIMEOUT})'
+                            }
+                        },
+                        'required': ['command']
+                    }
+                }
+            },
+            {
+                'type': 'function',
+                'function': {
+                    'name': 'list_files',
+                    'description': 'List files in a directory (recursively, honoring .gitignore and skipping build/cache folders), one page at a time, or summarize it per directory',
+                    'parameters': {
+                        'type': 'object',
+                        'properties': {
+                            'directory': {
+                                'type': 'string',
+                                'description': 'Directory to list files from (default: current directory)'
+                            },
+                            'offset': {
+                                'type': 'integer',
+                                'description': 'Number of entries to skip, to get the next page (default: 0)'
+                            },
+                            'limit': {
+                                'type': 'integer',
+                                'description': f'Maximum entries to return (default: {LIST_FILES_LIMIT}, max: {LIST_FILES_MAX_LIMIT})'
+                            },
+                            'max_depth': {
+                                'type': 'integer',
+                                'description': 'Deepest level to list, 1 for just this directory (default: unlimited); with summary, how deep to break out directories (default: 2)'
+                            },
+                            'extensions': {
+                                'type': 'array',
+                                'items': {'type': 'string'},
+                                'description': 'Only list files with these extensions, e.g. [".py", ".toml"]'
+                            },
+                            'summary': {
+                                'type': 'boolean',
+                                'description': 'Return file counts and total sizes per directory instead of file names'
+                            }
+                        }
+                    }
+                }
+            },
+            {
+                'type': 'function',
+                'function': {
+                    'name': 'search_code',
+                    'description': 'Search for a pattern in code files (case-insensitive, indexed)',
+                    'parameters': {
+                        'type': 'object',
+                        'properties': {
+                            'query': {
+                                'type': 'string',
+                                'description': 'Search term or pattern to find'
+                            },
+                            'file_pattern': {
+                                'type': 'string',
+                                'description': 'File pattern to search (e.g., *.py, *.js, *.java). Default: *.py'
+                            },
+                            'regex': {
+                                'type': 'boolean',
+                                'description': 'Treat query (and queries) as regular expressions. Default: false'
+                            },
+                            'queries': {
+                                'type': 'array',
+                                'items': {'type': 'string'},
+                                'description': 'Additional patterns to search for at the same time; lines matching any pattern are reported'
+                            }
+                        },
+                        'required': ['query']
+                    }
+                }
+            },
+            {
+                'type': 'function',
+                'function': {
+                    'name': 'find_definition',
+                    'description': 'Find where a class, function, method or variable is defined (parsed, not a text search)',
+                    'parameters': {
+                        'type': 'object',
+                        'properties': {
+                            'name': {
+                                'type': 'string',
+                                'description': 'Symbol name, optionally qualified, e.g. parse or Parser.parse'
+                            },
+                            'kind': {
+                                'type': 'string',
+                                'description': 'Only report this kind: class, function, method, variable, type, module or macro'
+                            }
+                        },
+                        'required': ['name']
+                    }
+                }
+            },
+            {
+                'type': 'function',
+                'function': {
+                    'name': 'find_references',
+                    'description': 'Find the lines that use an identifier (whole word, case-sensitive)',
+                    'parameters': {
+                        'type': 'object',
+                        'properties': {
+                            'name': {
+                                'type': 'string',
+                                'description': 'Identifier to look up'
+                            },
+                            'file_pattern': {
+                                'type': 'string',
+                                'description': 'Only report files matching this pattern (e.g., *.py)'
+                            }
+                        },
+                        'required': ['name']
+                    }
+                }
+            },
+            {
+                'type': 'function',
+                'function': {
+                    'name': 'file_outline',
+                    'description': 'List the classes, functions and methods of a file with their line numbers',
+                    'parameters': {
+                        'type': 'object',
+                        'properties': {
+                            'filepath': {
+                                'type': 'string',
+                                'description': 'Path to the file'
+                            }
+                        },
+                        'required': ['filepath']
+                    }
+                }
+            },
+            {
+                'type': 'function',
+                'function': {
+                    'name': 'fetch_result',
+                    'description': 'Read more of a long tool result that was shortened in the conversation, by line range or by pattern',
+                    'parameters': {
+                        'type': 'object',
+                        'properties': {
+                            'handle': {
+                                'type': 'string',
+                                'description': 'Handle given in the shortened result, e.g. result-3'
+                            },
+                            'start_line': {
+                                'type': 'integer',
+                                'description': 'First line to return, 1-based (default: 1)'
+                            },
+                            'max_lines': {
+                                'type': 'integer',
+                                'description': f'Number of lines to return (default: {FETCH_RESULT_LINES})'
+                            },
+                            'pattern': {
+                                'type': 'string',
+                                'description': 'Only return lines matching this regular expression (case-insensitive)'
+                            }
+                        },
+                        'required': ['handle']
+                    }
+                }
+            }
+        ]
+        if numpy_available():
+            tools.append({
+                'type': 'function',
+                'function': {
+                    'name': 'semantic_search',
+                    'description': 'Find code by meaning ("where do we handle X") using embeddings of functions and classes. Slow the first time on a large tree',
+                    'parameters': {
+                        'type': 'object',
+                        'properties': {
+                            'query': {
+                                'type': 'string',
+                                'description': 'Description of the code to find'
+                            },
+                            'limit': {
+                                'type': 'integer',
+                                'description': f'Number of results (default: {SEMANTIC_SEARCH_LIMIT}, max: {SEMANTIC_SEARCH_MAX_LIMIT})'
+                            },
+                            'file_pattern': {
+                                'type': 'string',
+                                'description': 'Only search files matching this pattern (e.g., *.py)'
+                            }
+                        },
+                        'required': ['query']
+                    }
+                }
+            })
+        return tools
+    
+    def execute_tool(self, tool_name: str, arguments: Dict) -> str:
+        """
+        Execute a tool and return the result.
+        
+        Args:
+            tool_name: Name of the tool to execute
+            arguments: Arguments to pass to the tool
+            
+        Returns:
+            Tool execution result
+        """
+        with self.tracer.span('tool', tool_name) as span:
+            result = self._run_tool(tool_name, arguments)
+            span['ok'] = not isinstance(result, ToolError)
+            span['result_bytes'] = len(result)
+        if self.prefetcher is not None:
+            self.prefetcher.schedule(self.working_directory, tool_name, arguments, result)
+        return result
+    
+    def _run_tool(self, tool_name: str, arguments: Dict) -> str:
+        """
+        Dispatch a tool call to its implementation.
+        
+        Args:
+            tool_name: Name of the tool to execute
+            arguments: Arguments to pass to the tool
+            
+        Returns:
+            Tool execution result, a ToolError if the tool failed
+        """
+        if tool_name == 'read_file':
+            return self.read_file(
+                arguments['filepath'],
+                start_line=optional_int(arguments.get('start_line')),
+                end_line=optional_int(arguments.get('end_line')),
+                max_bytes=optional_int(arguments.get('max_bytes'))
+            )
+        elif tool_name == 'read_files':
+            paths = arguments['paths']
+            return self.read_files(
+                [paths] if isinstance(paths, str) else list(paths),
+                max_total_bytes=optional_int(arguments.get('max_total_bytes'))
+            )
+        elif tool_name == 'write_file':
+            return self.write_file(arguments['filepath'], arguments['content'])
+        elif tool_name == 'edit_file':
+            return self.edit_file(
+                arguments['filepath'],
+                edits=arguments.get('edits'),
+                diff=arguments.get('diff')
+            )
+        elif tool_name == 'execute_command':
+            return self.execute_command(arguments['command'], optional_int(arguments.get('timeout')))
+        elif tool_name == 'list_files':
+            extensions = arguments.get('extensions')
+            return self.list_files(
+                arguments.get('directory', '.'),
+                offset=optional_int(arguments.get('offset')) or 0,
+                limit=optional_int(arguments.get('limit')),
+                max_depth=optional_int(arguments.get('max_depth')),
+                extensions=[extensions] if isinstance(extensions, str) else extensions,
+                summary=arguments.get('summary') in (True, 'true', 'True')
+            )
+        elif tool_name == 'search_code':
+            query = arguments['query']
+            file_pattern = arguments.get('file_pattern', '*.py')
+            return self.search_code(
+                query,
+                file_pattern,
+                regex=bool(arguments.get('regex', False)),
+                queries=arguments.get('queries')
+            )
+        elif tool_name == 'find_definition':
+            return self.find_definition(arguments['name'], arguments.get('kind') or None)
+        elif tool_name == 'find_references':
+            return self.find_references(arguments['name'], arguments.get('file_pattern') or None)
+        elif tool_name == 'file_outline':
+            return self.file_outline(arguments['filepath'])
+        elif tool_name == 'fetch_result':
+            return self.fetch_result(
+                arguments['handle'],
+                start_line=optional_int(arguments.get('start_line')),
+                max_lines=optional_int(arguments.get('max_lines')),
+                pattern=arguments.get('pattern') or None
+            )
+        elif tool_name == 'semantic_search':
+            return self.semantic_search(
+                arguments['query'],
+                limit=optional_int(arguments.get('limit')),
+                file_pattern=arguments.get('file_pattern') or None
+            )
+        else:
+            return ToolError(f"Error: Unknown tool '{tool_name}'")
+    
+    def _tool_target(self, tool_name: str, arguments: Dict) -> str:
+        """
+        Resolve the filesystem path a tool call touches.
+        
+        Args:
+            tool_name: Name of the tool
+            arguments: Arguments of the call
+            
+        Returns:
+            Absolute, normalized path (a directory for listing/searching tools)
+        """
+        if tool_name in ('read_file', 'file_outline') or tool_name in FILE_WRITE_TOOLS:
+            target = arguments.get('filepath', '')
+        elif tool_name == 'list_files':
+            target = arguments.get('directory', '.')
+        else:
+            target = '.'
+        return os.path.normpath(os.path.join(self.working_directory, target))
+    
+    def _tool_calls_conflict(self, first: tuple, second: tuple) -> bool:
+        """
+        Decide whether two tool calls must run in their original order.
+        
+        Read-only calls never conflict with each other. A write conflicts with
+        any call touching the same file or a directory containing it. Commands
+        and unknown tools may do anything, so they conflict with everything.
+        
+        Args:
+            first: (tool_name, arguments) of the earlier call
+            second: (tool_name, arguments) of the later call
+            
+        Returns:
+            True if the later call has to wait for the earlier one
+        """
+        names = (first[0], second[0])
+        if any(name not in READ_ONLY_TOOLS | FILE_WRITE_TOOLS for name in names):
+            return True
+        if all(name in READ_ONLY_TOOLS for name in names):
+            return False
+        
+        a = self._tool_target(*first)
+        b = self._tool_target(*second)
+        return a == b or a.startswith(b + os.sep) or b.startswith(a + os.sep)
+    
+    def execute_tool_calls(self, calls: List[tuple]) -> List[str]:
+        """
+        Execute the tool calls of one model turn, concurrently where safe.
+        
+        Each call waits only for the earlier calls it conflicts with, so
+        independent reads run in parallel while writes and commands keep
+        their order relative to anything they could affect.
+        
+        Args:
+            calls: List of (tool_name, arguments) in the order the model issued them
+            
+        Returns:
+            Tool results in the same order as the calls
+        """
+        if len(calls) <= 1:
+            return [self.execute_tool(name, arguments) for name, arguments in calls]
+        
+        def run(call: tuple, dependencies: List[Future]) -> str:
+            for dependency in dependencies:
+                dependency.exception()  # wait; failures are reported by that call
+            return self.execute_tool(*call)
+        
+        # Dependencies are always submitted earlier, so they are never stuck
+        # behind the calls waiting for them in the executor queue.
+        futures: List[Future] = []
+        for index, call in enumerate(calls):
+            dependencies = [
+                futures[earlier] for earlier in range(index)
+                if self._tool_calls_conflict(calls[earlier], call)
+            ]
+            futures.append(self.tool_executor.submit(run, call, dependencies))
+        
+        results = []
+        for (name, _), future in zip(calls, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(ToolError(f"Error executing tool {name}: {str(e)}"))
+        return results
+    
+    def chat(
+        self,
+        user_message: str,
+        max_iterations: int = 10,
+        stream: bool = False,
+        on_token: Optional[Callable[[str], None]] = None
+    ) -> str:
+        """
+        Send a message to the assistant and get a response.
+        Handles tool calling automatically.
+        
+        Args:
+            user_message: The user's message/request
+            max_iterations: Maximum number of tool-calling iterations (default: 10)
+            stream: Stream the model output token-by-token (default: False)
+            on_token: Optional callback invoked with each piece of assistant text
+            
+        Returns:
+            The assistant's final response
+        """
+        response = '(No response)'
+        for event in self.chat_stream(user_message, max_iterations, stream=stream):
+            if event['type'] == 'token' and on_token:
+                on_token(event['content'])
+            elif event['type'] == 'tool_call':
+                # Show tool usage to user
+                console.print(
+                    f"[yellow]🔧 Using tool:[/yellow] {event['name']}",
+                    style="bold"
+                )
+            elif event['type'] == 'done':
+                response = event['content']
+        return response
+    
+    def chat_stream(
+        self,
+        user_message: str,
+        max_iterations: int = 10,
+        stream: bool = True
+    ) -> Iterator[Dict]:
+        """
+        Send a message to the assistant and yield events as the response is produced.
+        Handles tool calling automatically.
+        
+        Every event is a dict with a 'type' key:
+            token       - {'content'}: a piece of assistant text
+            first_token - {'seconds'}: time from the request to the first token
+            tool_call   - {'name', 'arguments'}: a tool is about to run
+            tool_result - {'name', 'content'}: a tool finished
+            context_pruned - {'tokens'}: old history was elided to fit the budget
+            done        - {'content'}: the final response (always the last event)
+        
+        Args:
+            user_message: The user's message/request
+            max_iterations: Maximum number of tool-calling iterations (default: 10)
+            stream: Request a streamed response from Ollama (default: True)
+            
+        Yields:
+            Event dictionaries
+        """
+        self.tracer.turn += 1
+        
+        # Add user message to conversation
+        self._append_message({
+            'role': 'user',
+            'content': user_message
+        })
+        
+        started = time.perf_counter()
+        first_token_seen = False
+        tool_iterations = 0
+        
+        # Iteration loop for tool calling
+        for iteration in range(max_iterations):
+            try:
+                # Keep the prompt within the context window
+                freed = self.context.fit(self.conversation_history)
+                if freed:
+                    yield {'type': 'context_pruned', 'tokens': freed}
+                
+                # Get response from model, escalating rejected tool-phase responses
+                for phase in self.router.phases(tool_iterations):
+                    turn = self._new_turn()
+                    # The tool phase always streams so that a plain answer can be cut off
+                    response = self._model_response(stream or phase == 'tool', phase)
+                    for chunk in response:
+                        text = self._read_chunk(chunk, turn)
+                        # Tool-phase text is held back until the response is kept
+                        if text and phase == 'answer':
+                            for event in self._token_events(text, started, first_token_seen):
+                                yield event
+                            first_token_seen = True
+                        if self.router.abandon(phase, turn):
+                            # Closing the stream stops the generation
+                            response.close()
+                            break
+                    reason = self.router.review(phase, turn, self.get_available_tools())
+                    if reason is None:
+                        break
+                    self._record_escalation(phase, iteration, reason)
+                
+                if phase == 'tool':
+                    tool_iterations += 1
+                    text = ''.join(turn['content'])
+                    if text:
+                        for event in self._token_events(text, started, first_token_seen):
+                            yield event
+                        first_token_seen = True
+                
+                # Add assistant response to history
+                assistant_message, calls = self._finish_response(turn)
+                
+                # Check if the model wants to use tools
+                if not calls:
+                    # No tool calls - return the final response
+                    yield {
+                        'type': 'done',
+                        'content': assistant_message['content'] or '(No response)'
+                    }
+                    return
+                
+                # Process tool calls
+                for function_name, arguments in calls:
+                    yield {'type': 'tool_call', 'name': function_name, 'arguments': arguments}
+                
+                # Execute the tools, keeping results in the original call order
+                results = self.execute_tool_calls(calls)
+                yield from self._add_tool_results(calls, results)
+                
+            except KeyboardInterrupt:
+                raise
+            except Exception as e:
+                error_msg = f"Error during chat: {str(e)}"
+                console.print(f"[red]{error_msg}[/red]")
+                yield {'type': 'done', 'content': error_msg}
+                return
+        
+        yield {'type': 'done', 'content': MAX_ITERATIONS_MESSAGE}
+    
+    @staticmethod
+    def _token_events(text: str, started: float, first_token_seen: bool) -> List[Dict]:
+        """
+        Events for a piece of assistant text.
+        
+        Args:
+            text: The text
+            started: perf_counter() value when the user's message was received
+            first_token_seen: Whether a first_token event was already sent
+            
+        Returns:
+            A token event, preceded by a first_token event for the first text
+        """
+        events = []
+        if not first_token_seen:
+            events.append({'type': 'first_token', 'seconds': time.perf_counter() - started})
+        events.append({'type': 'token', 'content': text})
+        return events
+    
+    def _record_escalation(self, phase: str, iteration: int, reason: str):
+        """
+        Record that a response was discarded and its iteration re-run on the answer model.
+        
+        Args:
+            phase: Phase of the discarded response
+            iteration: Iteration of the turn
+            reason: Why the response was discarded (see ModelRouter.review)
+        """
+        self.tracer.record(
+            'route',
+            self.router.models[phase],
+            phase=phase,
+            iteration=iteration,
+            reason=reason,
+            escalated_to=self.router.models['answer']
+        )
+    
+    @staticmethod
+    def _new_turn() -> Dict:
+        """Empty accumulator for one model response."""
+        return {'content': [], 'tool_calls': [], 'usage': {}}
+    
+    @staticmethod
+    def _read_chunk(chunk, turn: Dict) -> str:
+        """
+        Fold one response chunk into the response being collected.
+        
+        Args:
+            chunk: Streamed (or complete) response from Ollama
+            turn: Accumulator from _new_turn()
+            
+        Returns:
+            The text contained in the chunk
+        """
+        if chunk.get('done'):
+            turn['usage'] = {
+                field: chunk.get(field) for field in USAGE_FIELDS
+                if chunk.get(field) is not None
+            }
+        message = chunk['message']
+        text = message.get('content') or ''
+        if text:
+            turn['content'].append(text)
+        # Ollama sends each tool call whole, possibly spread over chunks
+        if message.get('tool_calls'):
+            turn['tool_calls'].extend(message['tool_calls'])
+        return text
+    
+    def _finish_response(self, turn: Dict) -> tuple:
+        """
+        Add a collected model response to the conversation.
+        
+        Args:
+            turn: Accumulator from _new_turn()
+            
+        Returns:
+            (assistant message, list of (tool_name, arguments) calls)
+        """
+        assistant_message = {
+            'role': 'assistant',
+            'content': ''.join(turn['content'])
+        }
+        if turn['tool_calls']:
+            assistant_message['tool_calls'] = turn['tool_calls']
+        
+        # The history is still the prompt the response was generated from
+        self.context.record_usage(
+            turn['usage'], assistant_message, self.conversation_history, self.get_available_tools()
+        )
+        self._append_message(assistant_message, tokens=turn['usage'].get('eval_count'))
+        
+        calls = [
+            (tool_call['function']['name'], tool_call['function']['arguments'])
+            for tool_call in turn['tool_calls']
+        ]
+        return assistant_message, calls
+    
+    def _add_tool_results(self, calls: List[tuple], results: List[str]) -> Iterator[Dict]:
         """
-        Initialize the coding assistant.
+        Add tool results to the conversation in call order.
         
         Args:
-            model: The Ollama model to use (default: qwen3-coder-next:q4_K_M)
+            calls: List of (tool_name, arguments)
+            results: Result of each call
+            
+        Yields:
+            A tool_result event per call
         """
-        self.model = model
-        self.conversation_history: List[Dict] = []
-        self.working_directory = os.getcwd()
-        
-        # Verify Ollama is running
-        self._verify_ollama()
-        
-    def _verify_ollama(self):
-        """Verify that Ollama is running and the model is available."""
-        try:
-            import requests
-            response = requests.get("http://localhost:11434/api/tags")
-            if response.status_code != 200:
-                console.print("[red]❌ Ollama service is not running![/red]")
-                console.print("Please start Ollama: [yellow]ollama serve[/yellow]")
-                exit(1)
-        except Exception as e:
-            console.print(f"[red]❌ Cannot connect to Ollama: {e}[/red]")
-            console.print("Please make sure Ollama is installed and running.")
-            exit(1)
+        for (function_name, _), result in zip(calls, results):
+            self._append_message({
+                'role': 'tool',
+                'content': self._store_large_result(function_name, result),
+                'tool_name': function_name
+            })
+            yield {'type': 'tool_result', 'name': function_name, 'content': result}
     
-    def read_file(self, filepath: str) -> str:
+    def _store_large_result(self, tool_name: str, result: str) -> str:
         """
-        Read a file from the filesystem.
+        Keep a large tool result out of the conversation.
         
         Args:
-            filepath: Path to the file to read
+            tool_name: Tool that produced the result
+            result: Full result
             
         Returns:
-            File contents or error message
+            The result itself if it is small, else its head and tail with a
+            fetch_result handle
         """
-        try:
-            full_path = os.path.join(self.working_directory, filepath)
-            with open(full_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            return content
-        except FileNotFoundError:
-            return f"Error: File not found: {filepath}"
-        except PermissionError:
-            return f"Error: Permission denied: {filepath}"
-        except Exception as e:
-            return f"Error reading file {filepath}: {str(e)}"
+        if tool_name == 'fetch_result' or len(result) <= TOOL_RESULT_INLINE_CHARS:
+            return result
+        
+        handle = self.results.put(result)
+        if self.session_log is not None:
+            self.session_log.append_blob(handle, result)
+        head = result[:TOOL_RESULT_PREVIEW_HEAD]
+        tail = result[-TOOL_RESULT_PREVIEW_TAIL:]
+        # Cut at line boundaries where one is close
+        if head.rfind('\n') > len(head) // 2:
+            head = head[:head.rfind('\n')]
+        if 0 <= tail.find('\n') < len(tail) // 2:
+            tail = tail[tail.find('\n') + 1:]
+        omitted = len(result) - len(head) - len(tail)
+        return (
+            f"{head}\n... [{omitted} characters omitted] ...\n{tail}\n\n"
+            f"[Full result stored as {handle}: {result.count(chr(10)) + 1} lines, {len(result)} characters. "
+            f"Read it with fetch_result(handle='{handle}', start_line=N) "
+            f"or search it with fetch_result(handle='{handle}', pattern='...').]"
+        )
     
-    def write_file(self, filepath: str, content: str) -> str:
+    def fetch_result(
+        self,
+        handle: str,
+        start_line: Optional[int] = None,
+        max_lines: Optional[int] = None,
+        pattern: Optional[str] = None
+    ) -> str:
         """
-        Write content to a file.
+        Read part of a stored tool result.
         
         Args:
-            filepath: Path to the file to write
-            content: Content to write to the file
+            handle: Handle from a shortened tool result
+            start_line: First line to return, 1-based (default: 1)
+            max_lines: Lines to return (default: FETCH_RESULT_LINES)
+            pattern: Return only lines matching this regular expression
+                (case-insensitive; an invalid one is matched literally)
             
         Returns:
-            Success message or error
+            The requested lines with their position in the result
         """
-        try:
-            full_path = os.path.join(self.working_directory, filepath)
-            directory = os.path.dirname(full_path)
-            
-            if directory and not os.path.exists(directory):
-                os.makedirs(directory, exist_ok=True)
-            
-            with open(full_path, 'w', encoding='utf-8') as f:
-                f.write(content)
-            
-            return f"✓ Successfully wrote to {filepath} ({len(content)} bytes)"
-        except PermissionError:
-            return f"Error: Permission denied: {filepath}"
-        except Exception as e:
-            return f"Error writing file {filepath}: {str(e)}"
+        text = self.results.get(handle)
+        if text is None:
+            return ToolError(f"Error: Unknown result handle: {handle}")
+        lines = text.split('\n')
+        
+        if pattern:
+            try:
+                regex = re.compile(pattern, re.IGNORECASE)
+            except re.error:
+                regex = re.compile(re.escape(pattern), re.IGNORECASE)
+            output = []
+            size = 0
+            first = max(1, start_line or 1)
+            for number in range(first, len(lines) + 1):
+                if regex.search(lines[number - 1]):
+                    entry = f"  Line {number}: {lines[number - 1]}"
+                    size += len(entry) + 1
+                    if size > FETCH_RESULT_MAX_CHARS or len(output) >= (max_lines or FETCH_RESULT_LINES):
+                        output.append(f"... more matches (use start_line={number})")
+                        break
+                    output.append(entry)
+            if not output:
+                return f"No lines matching '{pattern}' in {handle} ({len(lines)} lines)"
+            return f"[{handle}: lines matching '{pattern}']\n" + "\n".join(output)
+        
+        start = max(1, start_line or 1)
+        if start > len(lines):
+            return ToolError(f"Error: {handle} has only {len(lines)} lines")
+        end = min(len(lines), start + max(1, max_lines or FETCH_RESULT_LINES) - 1)
+        output = []
+        size = 0
+        for number in range(start, end + 1):
+            size += len(lines[number - 1]) + 1
+            if size > FETCH_RESULT_MAX_CHARS and output:
+                end = number - 1
+                break
+            output.append(lines[number - 1][:FETCH_RESULT_MAX_CHARS])
+        
+        footer = f"\n[Use start_line={end + 1} for more]" if end < len(lines) else ""
+        return f"[{handle}: lines {start}-{end} of {len(lines)}]\n" + "\n".join(output) + footer
     
-    def execute_command(self, command: str) -> str:
+    def _chat_arguments(self, stream: bool, phase: str = 'answer') -> Dict:
         """
-        Execute a shell command safely.
+        Arguments for an Ollama chat request with the current conversation.
         
         Args:
-            command: The shell command to execute
+            stream: Whether to request a streamed response
+            phase: Routing phase ('tool' or 'answer') choosing model and options
             
         Returns:
-            Command output or error message
+            Keyword arguments for chat()
         """
-        # Safety check - prevent dangerous commands
-        dangerous_patterns = ['rm -rf /', 'mkfs', 'dd if=', ':(){:|:&};:']
-        if any(pattern in command.lower() for pattern in dangerous_patterns):
-            return "Error: Command blocked for safety reasons"
+        return {
+            'messages': self.conversation_history,
+            'tools': self.get_available_tools(),
+            'stream': stream,
+            **self.router.request(phase, self.context.max_tokens, self.keep_alive),
+        }
+    
+    def _model_response(self, stream: bool, phase: str = 'answer') -> Iterator:
+        """
+        Call the model with the current conversation.
         
-        try:
-            result = subprocess.run(
-                command,
-                shell=True,
-                capture_output=True,
-                text=True,
-                timeout=30,
-                cwd=self.working_directory
-            )
-            
-            output = []
-            if result.stdout:
-                output.append(result.stdout)
-            if result.stderr:
-                output.append(f"STDERR: {result.stderr}")
-            if result.returncode != 0:
-                output.append(f"Exit code: {result.returncode}")
+        Args:
+            stream: Whether to request a streamed response
+            phase: Routing phase ('tool' or 'answer') choosing model and options
             
-            return "\n".join(output) if output else "Command executed successfully (no output)"
+        Yields:
+            Response chunks (a single full response when not streaming)
+        """
+        arguments = self._chat_arguments(stream, phase)
+        with self.tracer.span(
+            'model', arguments['model'], phase=phase, messages=len(self.conversation_history)
+        ) as span:
+            started = time.perf_counter()
+            response = self.client.chat(**arguments)
+            for chunk in response if stream else [response]:
+                self._trace_chunk(span, chunk, started)
+                yield chunk
+    
+    @staticmethod
+    def _trace_chunk(span: Dict, chunk, started: float):
+        """
+        Record first-token time and Ollama's timing fields on a model span.
         
-        except subprocess.TimeoutExpired:
-            return "Error: Command timed out after 30 seconds"
-        except Exception as e:
-            return f"Error executing command: {str(e)}"
+        Args:
+            span: Span record of the model call
+            chunk: Response chunk
+            started: perf_counter() value when the request was sent
+        """
+        if 'first_token' not in span:
+            message = chunk['message']
+            if message.get('content') or message.get('tool_calls'):
+                span['first_token'] = time.perf_counter() - started
+        if chunk.get('done'):
+            for field in USAGE_FIELDS:
+                if chunk.get(field) is not None:
+                    span[field] = chunk.get(field)
     
-    def list_files(self, directory: str = ".") -> str:
+    def _append_message(self, message: Dict, tokens: Optional[int] = None):
         """
-        List files in a directory.
+        Add a message to the conversation and to the session log.
         
         Args:
-            directory: Directory to list (default: current directory)
-            
+            message: The message
+            tokens: Its size in tokens, if known
+        """
+        self.context.append(self.conversation_history, message, tokens=tokens)
+        if self.session_log is not None:
+            self.session_log.append(message)
+    
+    def _new_session_log(self) -> Optional[SessionLog]:
+        """
+        Start the log of a new session, whose id the tracer then uses too.
+        
         Returns:
-            List of files or error message
+            The log, or None if the compression is not available
         """
+        session_id = uuid.uuid4().hex[:12]
         try:
-            target_dir = os.path.join(self.working_directory, directory)
-            
-            if not os.path.exists(target_dir):
-                return f"Error: Directory not found: {directory}"
-            
-            files = []
-            dirs_to_skip = {
-                'node_modules', '.git', '__pycache__', 'venv', '.venv',
-                '.idea', '.vscode', 'dist', 'build', '.egg-info'
-            }
-            
-            for root, dirs, filenames in os.walk(target_dir):
-                # Remove directories we want to skip
-                dirs[:] = [d for d in dirs if d not in dirs_to_skip]
-                
-                for filename in filenames:
-                    if filename.startswith('.'):
-                        continue
-                    filepath = os.path.relpath(
-                        os.path.join(root, filename),
-                        self.working_directory
-                    )
-                    files.append(filepath)
-            
-            if not files:
-                return f"No files found in {directory}"
-            
-            # Limit output to first 100 files
-            if len(files) > 100:
-                files = files[:100]
-                files.append(f"... and {len(files) - 100} more files")
-            
-            return "\n".join(sorted(files))
-        
-        except Exception as e:
-            return f"Error listing files: {str(e)}"
+            log = SessionLog.create(
+                session_id,
+                self.log_compression,
+                model=self.model,
+                working_directory=self.working_directory
+            )
+        except ValueError as e:
+            console.print(f"[yellow]⚠️  Session log disabled: {e}[/yellow]")
+            return None
+        self.tracer.session_id = session_id
+        return log
+    
+    def reset_conversation(self):
+        """Clear conversation history and start a new session log."""
+        self.conversation_history = []
+        self.context.reset()
+        self.results.clear()
+        if self.session_log is not None:
+            self.session_log.close()
+            self.session_log = self._new_session_log()
+        console.print("[green]✓ Conversation history cleared[/green]")
     
-    def search_code(self, query: str, file_pattern: str = "*.py") -> str:
+    def resume_session(self, session_id: str) -> bool:
         """
-        Search for a pattern in code files.
+        Replace the conversation with a logged session and continue its log.
+        
+        Messages are read back in one pass over the log; large tool results
+        stay in the log until fetch_result reads them. The history is then
+        pruned to the context budget as usual.
         
         Args:
-            query: Search term
-            file_pattern: File pattern to search (e.g., *.py, *.js)
+            session_id: Id of the session, or an unambiguous prefix
             
         Returns:
-            Search results or error message
+            True if the session was resumed
         """
+        path = SessionLog.find(session_id)
+        if path is None:
+            console.print(f"[red]✗ No single session matches: {session_id}[/red]")
+            return False
         try:
-            import glob
-            results = []
-            pattern = f"**/{file_pattern}"
-            
-            for filepath in glob.glob(pattern, recursive=True):
-                # Skip common directories
-                if any(skip in filepath for skip in [
-                    'node_modules', '.git', '__pycache__', 'venv', '.venv'
-                ]):
-                    continue
-                
-                try:
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                        if query.lower() in content.lower():
-                            lines = content.split('\n')
-                            matches = []
-                            for i, line in enumerate(lines, 1):
-                                if query.lower() in line.lower():
-                                    matches.append(f"  Line {i}: {line.strip()}")
-                                    if len(matches) >= 3:  # Limit to 3 matches per file
-                                        break
-                            
-                            if matches:
-                                results.append(f"\n{filepath}:\n" + "\n".join(matches))
-                except Exception:
-                    continue
-            
-            if not results:
-                return f"No matches found for '{query}' in {file_pattern} files"
-            
-            # Limit to first 10 files
-            if len(results) > 10:
-                results = results[:10]
-                results.append(f"\n... and more matches")
-            
-            return "\n".join(results)
+            log = SessionLog.open(path)
+            header, messages, blobs, end = log.load()
+        except (OSError, ValueError) as e:
+            console.print(f"[red]✗ Cannot read session log: {e}[/red]")
+            return False
+        log.truncate(end)
         
-        except Exception as e:
-            return f"Error searching code: {str(e)}"
+        if self.session_log is not None:
+            self.session_log.close()
+        self.session_log = log
+        self.tracer.session_id = header.get('id') or os.path.basename(path).split('.')[0]
+        self.conversation_history = []
+        self.context.reset()
+        self.results.clear()
+        for message in messages:
+            self.context.append(self.conversation_history, message)
+        for handle, (offset, length) in blobs.items():
+            self.results.add_lazy(handle, partial(log.read_blob, offset, length))
+        self.context.fit(self.conversation_history)
+        
+        directory = header.get('working_directory')
+        if directory and directory != self.working_directory:
+            self.set_working_directory(directory)
+        console.print(
+            f"[green]✓ Resumed session {self.tracer.session_id}: {len(messages)} messages, "
+            f"{len(blobs)} stored results[/green]"
+        )
+        return True
     
-    def get_available_tools(self) -> List[Dict]:
+    def set_working_directory(self, directory: str):
         """
-        Define tools available to the assistant.
+        Change the working directory.
+        
+        Args:
+            directory: New working directory path
+        """
+        if os.path.exists(directory) and os.path.isdir(directory):
+            # The matching search index is loaded (or built) on first use
+            self.working_directory = os.path.abspath(directory)
+            if self.watcher is not None:
+                self._start_watcher()
+            if self.session_log is not None:
+                self.session_log.append_directory(self.working_directory)
+            console.print(f"[green]✓ Working directory changed to: {self.working_directory}[/green]")
+        else:
+            console.print(f"[red]✗ Directory not found: {directory}[/red]")
+
+
+class AsyncQwenCodeAssistant(QwenCodeAssistant):
+    """
+    Asyncio variant of the assistant, for serving many sessions per process.
+    
+    Model calls go through an ollama.AsyncClient (one pooled HTTP connection
+    that can be shared between sessions), while the file tools run on the
+    tool thread pool and commands (in the session's own shell) on a thread
+    of their own, so they never block the event loop.
+    """
+    
+    def __init__(
+        self,
+        model: str = "qwen3-coder-next:q4_K_M",
+        client: Optional["AsyncClient"] = None,
+        request_slots: Optional[asyncio.Semaphore] = None,
+        working_directory: Optional[str] = None,
+        **kwargs
+    ):
+        """
+        Initialize the async assistant.
         
+        Args:
+            model: The Ollama model to use (default: qwen3-coder-next:q4_K_M)
+            client: Ollama client to use (default: a new AsyncClient)
+            request_slots: Semaphore bounding concurrent model requests, shared between sessions
+            working_directory: Working directory of this session (default: current directory)
+            kwargs: Passed on to QwenCodeAssistant
+        """
+        from ollama import AsyncClient
+        
+        super().__init__(model, **kwargs)
+        self.client = client or AsyncClient(host=kwargs.get('host'))
+        self.request_slots = request_slots
+        # Commands can run for minutes; they must not occupy the tool pool,
+        # which SessionManager shares between all sessions
+        self.command_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="command")
+        if working_directory:
+            self.working_directory = os.path.abspath(working_directory)
+            if self.watcher is not None:
+                self._start_watcher()
+            if self.session_log is not None and self.session_log.header:
+                self.session_log.header['working_directory'] = self.working_directory
+    
+    def _verify_ollama(self):
+        """Skipped here; use SessionManager.verify() from within the event loop."""
+    
+    async def chat_async(self, user_message: str, max_iterations: int = 10) -> str:
+        """
+        Send a message to the assistant and get a response.
+        
+        Args:
+            user_message: The user's message/request
+            max_iterations: Maximum number of tool-calling iterations (default: 10)
+            
         Returns:
-            List of tool definitions in Ollama format
+            The assistant's final response
         """
-        return [
-            {
-                'type': 'function',
-                'function': {
-                    'name': 'read_file',
-                    'description': 'Read the contents of a file from the filesystem',
-                    'parameters': {
-                        'type': 'object',
-                        'properties': {
-                            'filepath': {
-                                'type': 'string',
-                                'description': 'Path to the file to read (relative to working directory)'
-                            }
-                        },
-                        'required': ['filepath']
-                    }
-                }
-            },
-            {
-                'type': 'function',
-                'function': {
-                    'name': 'write_file',
-                    'description': 'Write content to a file. Creates directories if needed.',
-                    'parameters': {
-                        'type': 'object',
-                        'properties': {
-                            'filepath': {
-                                'type': 'string',
-                                'description': 'Path to the file to write (relative to working directory)'
-                            },
-                            'content': {
-                                'type': 'string',
-                                'description': 'Content to write to the file'
-                            }
-                        },
-                        'required': ['filepath', 'content']
-                    }
-                }
-            },
-            {
-                'type': 'function',
-                'function': {
-                    'name': 'execute_command',
-                    'description': 'Execute a shell command. Use for running tests, installing packages, git operations, etc.',
-                    'parameters': {
-                        'type': 'object',
-                        'properties': {
-                            'command': {
-                                'type': 'string',
-                                'description': 'The shell command to execute'
-                            }
-                        },
-                        'required': ['command']
-                    }
-                }
-            },
-            {
-                'type': 'function',
-                'function': {
-                    'name': 'list_files',
-                    'description': 'List files in a directory (recursively, excluding common build/cache folders)',
-                    'parameters': {
-                        'type': 'object',
-                        'properties': {
-                            'directory': {
-                                'type': 'string',
-                                'description': 'Directory to list files from (default: current directory)'
-                            }
-                        }
-                    }
-                }
-            },
-            {
-                'type': 'function',
-                'function': {
-                    'name': 'search_code',
-                    'description': 'Search for a pattern in code files',
-                    'parameters': {
-                        'type': 'object',
-                        'properties': {
-                            'query': {
-                                'type': 'string',
-                                'description': 'Search term or pattern to find'
-                            },
-                            'file_pattern': {
-                                'type': 'string',
-                                'description': 'File pattern to search (e.g., *.py, *.js, *.java). Default: *.py'
-                            }
-                        },
-                        'required': ['query']
+        response = '(No response)'
+        async for event in self.chat_stream_async(user_message, max_iterations):
+            if event['type'] == 'done':
+                response = event['content']
+        return response
+    
+    async def chat_stream_async(
+        self,
+        user_message: str,
+        max_iterations: int = 10,
+        stream: bool = True
+    ) -> AsyncIterator[Dict]:
+        """
+        Send a message and yield events as the response is produced.
+        Events are the same as those of chat_stream().
+        
+        Args:
+            user_message: The user's message/request
+            max_iterations: Maximum number of tool-calling iterations (default: 10)
+            stream: Request a streamed response from Ollama (default: True)
+            
+        Yields:
+            Event dictionaries
+        """
+        self.tracer.turn += 1
+        self._append_message({
+            'role': 'user',
+            'content': user_message
+        })
+        
+        started = time.perf_counter()
+        first_token_seen = False
+        tool_iterations = 0
+        
+        for iteration in range(max_iterations):
+            try:
+                freed = self.context.fit(self.conversation_history)
+                if freed:
+                    yield {'type': 'context_pruned', 'tokens': freed}
+                
+                for phase in self.router.phases(tool_iterations):
+                    turn = self._new_turn()
+                    response = self._model_response_async(stream or phase == 'tool', phase)
+                    async for chunk in response:
+                        text = self._read_chunk(chunk, turn)
+                        if text and phase == 'answer':
+                            for event in self._token_events(text, started, first_token_seen):
+                                yield event
+                            first_token_seen = True
+                        if self.router.abandon(phase, turn):
+                            await response.aclose()
+                            break
+                    reason = self.router.review(phase, turn, self.get_available_tools())
+                    if reason is None:
+                        break
+                    self._record_escalation(phase, iteration, reason)
+                
+                if phase == 'tool':
+                    tool_iterations += 1
+                    text = ''.join(turn['content'])
+                    if text:
+                        for event in self._token_events(text, started, first_token_seen):
+                            yield event
+                        first_token_seen = True
+                
+                assistant_message, calls = self._finish_response(turn)
+                if not calls:
+                    yield {
+                        'type': 'done',
+                        'content': assistant_message['content'] or '(No response)'
                     }
-                }
-            }
-        ]
+                    return
+                
+                for function_name, arguments in calls:
+                    yield {'type': 'tool_call', 'name': function_name, 'arguments': arguments}
+                
+                results = await self.execute_tool_calls_async(calls)
+                for event in self._add_tool_results(calls, results):
+                    yield event
+                
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                yield {'type': 'done', 'content': f"Error during chat: {str(e)}"}
+                return
+        
+        yield {'type': 'done', 'content': MAX_ITERATIONS_MESSAGE}
     
-    def execute_tool(self, tool_name: str, arguments: Dict) -> str:
+    async def _model_response_async(self, stream: bool, phase: str = 'answer') -> AsyncIterator:
         """
-        Execute a tool and return the result.
+        Call the model, waiting for a free request slot first.
+        
+        The response is read by a separate task into a queue, so the slot is
+        released as soon as the model is done, however slowly the caller
+        consumes the chunks. The queue holds at most one model turn.
+        Closing the generator early cancels the request.
+        
+        Args:
+            stream: Whether to request a streamed response
+            phase: Routing phase ('tool' or 'answer') choosing model and options
+            
+        Yields:
+            Response chunks (a single full response when not streaming)
+        """
+        chunks: asyncio.Queue = asyncio.Queue()
+        done = object()
+        
+        async def read_response():
+            try:
+                if self.request_slots is not None:
+                    await self.request_slots.acquire()
+                try:
+                    arguments = self._chat_arguments(stream, phase)
+                    with self.tracer.span(
+                        'model', arguments['model'], phase=phase,
+                        messages=len(self.conversation_history)
+                    ) as span:
+                        started = time.perf_counter()
+                        response = await self.client.chat(**arguments)
+                        if stream:
+                            async for chunk in response:
+                                self._trace_chunk(span, chunk, started)
+                                chunks.put_nowait(chunk)
+                        else:
+                            self._trace_chunk(span, response, started)
+                            chunks.put_nowait(response)
+                finally:
+                    if self.request_slots is not None:
+                        self.request_slots.release()
+            except Exception as e:
+                chunks.put_nowait(e)
+            finally:
+                chunks.put_nowait(done)
+        
+        reader = asyncio.ensure_future(read_response())
+        try:
+            while True:
+                chunk = await chunks.get()
+                if chunk is done:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            reader.cancel()
+    
+    async def execute_command_async(self, command: str, timeout: Optional[float] = None) -> str:
+        """
+        Execute a shell command without blocking the event loop.
+        
+        The session's persistent shell is driven from the session's command
+        thread, so long commands leave the shared tool pool to the file tools.
+        
+        Args:
+            command: The shell command to execute
+            timeout: Seconds to wait (default: command_timeout)
+            
+        Returns:
+            Command output or error message
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.command_executor, self.execute_command, command, timeout)
+    
+    async def execute_tool_async(self, tool_name: str, arguments: Dict) -> str:
+        """
+        Execute a tool without blocking the event loop.
         
         Args:
             tool_name: Name of the tool to execute
@@ -356,110 +6560,913 @@ class QwenCodeAssistant:
         Returns:
             Tool execution result
         """
-        if tool_name == 'read_file':
-            return self.read_file(arguments['filepath'])
-        elif tool_name == 'write_file':
-            return self.write_file(arguments['filepath'], arguments['content'])
-        elif tool_name == 'execute_command':
-            return self.execute_command(arguments['command'])
-        elif tool_name == 'list_files':
-            directory = arguments.get('directory', '.')
-            return self.list_files(directory)
-        elif tool_name == 'search_code':
-            query = arguments['query']
-            file_pattern = arguments.get('file_pattern', '*.py')
-            return self.search_code(query, file_pattern)
-        else:
-            return f"Error: Unknown tool '{tool_name}'"
+        if tool_name == 'execute_command':
+            with self.tracer.span('tool', tool_name) as span:
+                result = await self.execute_command_async(
+                    arguments['command'], optional_int(arguments.get('timeout'))
+                )
+                span['ok'] = not isinstance(result, ToolError)
+                span['result_bytes'] = len(result)
+            return result
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.tool_executor, self.execute_tool, tool_name, arguments)
     
-    def chat(self, user_message: str, max_iterations: int = 10) -> str:
+    async def execute_tool_calls_async(self, calls: List[tuple]) -> List[str]:
         """
-        Send a message to the assistant and get a response.
-        Handles tool calling automatically.
+        Execute the tool calls of one model turn, concurrently where safe.
+        Uses the same ordering rules as execute_tool_calls().
         
         Args:
-            user_message: The user's message/request
+            calls: List of (tool_name, arguments) in the order the model issued them
+            
+        Returns:
+            Tool results in the same order as the calls
+        """
+        async def run(call: tuple, dependencies: List[asyncio.Future]) -> str:
+            if dependencies:
+                await asyncio.wait(dependencies)
+            return await self.execute_tool_async(*call)
+        
+        tasks: List[asyncio.Future] = []
+        for index, call in enumerate(calls):
+            dependencies = [
+                tasks[earlier] for earlier in range(index)
+                if self._tool_calls_conflict(calls[earlier], call)
+            ]
+            tasks.append(asyncio.ensure_future(run(call, dependencies)))
+        
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        return [
+            ToolError(f"Error executing tool {name}: {str(result)}") if isinstance(result, Exception) else result
+            for (name, _), result in zip(calls, results)
+        ]
+
+
+class SessionManager:
+    """
+    Runs many independent assistant sessions concurrently in one process.
+    
+    Sessions share one AsyncClient (a pooled HTTP connection to Ollama), the
+    tool thread pools and the search indexes. A semaphore bounds the requests
+    in flight against the Ollama endpoint, so bursts queue here instead of
+    piling up on the server; messages to the same session are serialized.
+    """
+    
+    def __init__(
+        self,
+        model: str = "qwen3-coder-next:q4_K_M",
+        host: Optional[str] = None,
+        max_concurrent_requests: int = 2,
+        max_sessions: int = 64,
+        max_tool_workers: int = 8,
+        router: Optional[ModelRouter] = None
+    ):
+        """
+        Create a session manager.
+        
+        Args:
+            model: The Ollama model every session uses
+            host: Ollama URL (default: OLLAMA_HOST or http://localhost:11434)
+            max_concurrent_requests: Model requests allowed in flight at once
+            max_sessions: Maximum number of open sessions
+            max_tool_workers: Threads shared by all sessions for file tools
+            router: Model routing shared by every session (default: model for both phases)
+        """
+        from ollama import AsyncClient
+        
+        self.model = model
+        self.host = host
+        self.router = router or ModelRouter(model)
+        self.client = AsyncClient(host=host)
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_sessions = max_sessions
+        self.sessions: Dict[str, AsyncQwenCodeAssistant] = {}
+        self.locks: Dict[str, asyncio.Lock] = {}
+        self.tool_executor = ThreadPoolExecutor(max_workers=max_tool_workers, thread_name_prefix="tool")
+        self.read_executor = ThreadPoolExecutor(max_workers=max_tool_workers, thread_name_prefix="read")
+        self.search_indexes: Dict[str, SearchIndex] = {}
+        self.symbol_indexes: Dict[str, SymbolIndex] = {}
+        self.embedding_indexes: Dict[tuple, EmbeddingIndex] = {}
+        self._request_slots: Optional[asyncio.Semaphore] = None
+    
+    @property
+    def request_slots(self) -> asyncio.Semaphore:
+        """Semaphore limiting model requests (created inside the running loop)."""
+        if self._request_slots is None:
+            self._request_slots = asyncio.Semaphore(self.max_concurrent_requests)
+        return self._request_slots
+    
+    async def verify(self):
+        """
+        Check that Ollama is reachable and has the routed models.
+        
+        Raises:
+            ConnectionError: If the server cannot be reached or lacks a model
+        """
+        try:
+            response = await self.client.list()
+        except Exception as e:
+            raise ConnectionError(f"Cannot connect to Ollama: {e}") from e
+        names = [entry['model'] for entry in response['models']]
+        for model in sorted(set(self.router.models.values())):
+            if not model_available(model, names):
+                raise ConnectionError(f"Model {model} is not installed (run: ollama pull {model})")
+    
+    def create_session(self, working_directory: Optional[str] = None) -> str:
+        """
+        Open a new session.
+        
+        Args:
+            working_directory: Working directory of the session (default: current directory)
+            
+        Returns:
+            The new session id
+            
+        Raises:
+            ValueError: If the directory does not exist
+            RuntimeError: If the session limit is reached
+        """
+        if working_directory and not os.path.isdir(working_directory):
+            raise ValueError(f"Directory not found: {working_directory}")
+        if len(self.sessions) >= self.max_sessions:
+            raise RuntimeError(f"Too many sessions (limit {self.max_sessions})")
+        
+        session = AsyncQwenCodeAssistant(
+            self.model,
+            client=self.client,
+            request_slots=self.request_slots,
+            working_directory=working_directory,
+            # For the session's own sync client, which embeddings go through
+            host=self.host,
+            router=self.router,
+            # Short-lived sessions share the indexes and re-scan instead
+            watch=False,
+            session_log=False
+        )
+        session.tool_executor = self.tool_executor
+        session.read_executor = self.read_executor
+        session._search_indexes = self.search_indexes
+        session._symbol_indexes = self.symbol_indexes
+        session._embedding_indexes = self.embedding_indexes
+        
+        session_id = session.tracer.session_id
+        self.sessions[session_id] = session
+        self.locks[session_id] = asyncio.Lock()
+        return session_id
+    
+    def close_session(self, session_id: str):
+        """
+        Close a session and drop its history.
+        
+        Args:
+            session_id: Session to close
+            
+        Raises:
+            KeyError: If there is no such session
+        """
+        session = self.sessions.pop(session_id)
+        session.shell.close()
+        session.command_executor.shutdown(wait=False)
+        session.results.clear()
+        del self.locks[session_id]
+    
+    async def chat_stream(
+        self,
+        session_id: str,
+        message: str,
+        max_iterations: int = 10
+    ) -> AsyncIterator[Dict]:
+        """
+        Send a message to a session and yield its events.
+        
+        Args:
+            session_id: Target session
+            message: The user's message
             max_iterations: Maximum number of tool-calling iterations (default: 10)
             
+        Yields:
+            Event dictionaries (see QwenCodeAssistant.chat_stream)
+            
+        Raises:
+            KeyError: If there is no such session
+        """
+        session = self.sessions[session_id]
+        async with self.locks[session_id]:
+            async for event in session.chat_stream_async(message, max_iterations):
+                yield event
+    
+    async def chat(self, session_id: str, message: str) -> str:
+        """
+        Send a message to a session and get the final response.
+        
+        Args:
+            session_id: Target session
+            message: The user's message
+            
         Returns:
             The assistant's final response
         """
-        # Add user message to conversation
-        self.conversation_history.append({
-            'role': 'user',
-            'content': user_message
-        })
+        response = '(No response)'
+        async for event in self.chat_stream(session_id, message):
+            if event['type'] == 'done':
+                response = event['content']
+        return response
+
+
+async def _send_json(writer: asyncio.StreamWriter, status: int, payload: Dict):
+    """Write a complete JSON HTTP response."""
+    body = json.dumps(payload).encode('utf-8')
+    reason = {
+        200: 'OK', 201: 'Created', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+        413: 'Payload Too Large', 503: 'Service Unavailable'
+    }
+    writer.write(
+        f"HTTP/1.1 {status} {reason.get(status, 'Error')}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: close\r\n\r\n".encode('latin-1') + body
+    )
+    await writer.drain()
+
+
+def _host_allowed(value: Optional[str], allowed: set, is_url: bool = False) -> bool:
+    """
+    Check a Host or Origin header against the names the server answers to.
+    
+    Browsers always send them, so this keeps web pages from reaching the
+    API through DNS rebinding or cross-site requests.
+    
+    Args:
+        value: Header value, None if absent (non-browser clients may omit it)
+        allowed: Lower-case host names and addresses
+        is_url: The value is an Origin URL rather than host[:port]
         
-        # Iteration loop for tool calling
-        for iteration in range(max_iterations):
+    Returns:
+        True if the request may be served
+    """
+    if value is None:
+        return True
+    try:
+        hostname = urllib.parse.urlsplit(value if is_url else '//' + value).hostname
+    except ValueError:
+        return False
+    return hostname in allowed
+
+
+async def _handle_request(
+    manager: SessionManager,
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    allowed_hosts: set
+):
+    """
+    Serve one HTTP request of the session API.
+    
+    Requests whose Host or Origin is not in allowed_hosts get a 403, and
+    bodies over SERVER_MAX_BODY_BYTES a 413.
+    
+    Routes:
+        GET    /sessions                   - list session ids
+        POST   /sessions                   - {"working_directory"} -> {"session_id"}
+        POST   /sessions/<id>/messages     - {"message", "stream"} -> response or NDJSON events
+        DELETE /sessions/<id>              - close a session
+    """
+    try:
+        request_line = (await reader.readline()).decode('latin-1').split()
+        if len(request_line) < 2:
+            return
+        method, path = request_line[0], request_line[1].rstrip('/')
+        
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        
+        if not (
+            _host_allowed(headers.get('host'), allowed_hosts)
+            and _host_allowed(headers.get('origin'), allowed_hosts, is_url=True)
+        ):
+            await _send_json(writer, 403, {'error': "Host or Origin not allowed"})
+            return
+        try:
+            length = int(headers.get('content-length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            await _send_json(writer, 400, {'error': "Invalid Content-Length"})
+            return
+        if length > SERVER_MAX_BODY_BYTES:
+            await _send_json(writer, 413, {'error': f"Request body over {SERVER_MAX_BODY_BYTES} bytes"})
+            return
+        body = await reader.readexactly(length)
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            await _send_json(writer, 400, {'error': "Expected a JSON object"})
+            return
+        
+        parts = path.strip('/').split('/')
+        if parts[0] != 'sessions':
+            await _send_json(writer, 404, {'error': f"Unknown path: {path}"})
+        elif len(parts) == 1 and method == 'GET':
+            await _send_json(writer, 200, {'sessions': list(manager.sessions)})
+        elif len(parts) == 1 and method == 'POST':
             try:
-                # Get response from model
-                response = chat(
-                    model=self.model,
-                    messages=self.conversation_history,
-                    tools=self.get_available_tools()
+                session_id = manager.create_session(payload.get('working_directory'))
+            except ValueError as e:
+                await _send_json(writer, 400, {'error': str(e)})
+            except RuntimeError as e:
+                await _send_json(writer, 503, {'error': str(e)})
+            else:
+                await _send_json(writer, 201, {'session_id': session_id})
+        elif parts[1] not in manager.sessions:
+            await _send_json(writer, 404, {'error': f"Unknown session: {parts[1]}"})
+        elif len(parts) == 2 and method == 'DELETE':
+            manager.close_session(parts[1])
+            await _send_json(writer, 200, {'closed': parts[1]})
+        elif len(parts) == 3 and parts[2] == 'stats' and method == 'GET':
+            await _send_json(writer, 200, manager.sessions[parts[1]].tracer.stats())
+        elif len(parts) == 3 and parts[2] == 'messages' and method == 'POST':
+            if not isinstance(payload.get('message'), str):
+                await _send_json(writer, 400, {'error': "Expected a 'message' string"})
+            elif payload.get('stream'):
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\n"
+                    b"Content-Type: application/x-ndjson\r\n"
+                    b"Connection: close\r\n\r\n"
                 )
-                
-                # Add assistant response to history
-                self.conversation_history.append(response['message'])
-                
-                # Check if the model wants to use tools
-                if not response['message'].get('tool_calls'):
-                    # No tool calls - return the final response
-                    return response['message'].get('content', '(No response)')
-                
-                # Process tool calls
-                for tool_call in response['message']['tool_calls']:
-                    function_name = tool_call['function']['name']
-                    arguments = tool_call['function']['arguments']
-                    
-                    # Show tool usage to user
-                    console.print(
-                        f"[yellow]🔧 Using tool:[/yellow] {function_name}",
-                        style="bold"
-                    )
-                    
-                    # Execute the tool
-                    result = self.execute_tool(function_name, arguments)
-                    
-                    # Add tool result to conversation
-                    self.conversation_history.append({
-                        'role': 'tool',
-                        'content': result
-                    })
-                
-            except KeyboardInterrupt:
-                raise
-            except Exception as e:
-                error_msg = f"Error during chat: {str(e)}"
-                console.print(f"[red]{error_msg}[/red]")
-                return error_msg
+                async for event in manager.chat_stream(parts[1], payload['message']):
+                    writer.write(json.dumps(event, default=str).encode('utf-8') + b"\n")
+                    # A slow client stalls its own session; the model slot is
+                    # released when the model finishes (_model_response_async)
+                    await writer.drain()
+            else:
+                response = await manager.chat(parts[1], payload['message'])
+                await _send_json(writer, 200, {'response': response})
+        else:
+            await _send_json(writer, 404, {'error': f"Unknown route: {method} {path}"})
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    except Exception as e:
+        try:
+            await _send_json(writer, 400, {'error': str(e)})
+        except ConnectionError:
+            pass
+    finally:
+        writer.close()
+
+
+async def serve(manager: SessionManager, host: str = "127.0.0.1", port: int = 8765):
+    """
+    Serve the session API over HTTP until cancelled.
+    
+    The API runs commands and writes files on this machine on behalf of
+    its clients, so only bind it to interfaces you trust. Requests must be
+    addressed to localhost or to host itself.
+    
+    Args:
+        manager: Session manager to expose
+        host: Interface to listen on (default: 127.0.0.1)
+        port: Port to listen on (default: 8765)
+    """
+    await manager.verify()
+    allowed_hosts = {'localhost', '127.0.0.1', '::1'}
+    if host not in ('', '0.0.0.0', '::'):
+        allowed_hosts.add(host.lower())
+    server = await asyncio.start_server(
+        lambda reader, writer: _handle_request(manager, reader, writer, allowed_hosts),
+        host,
+        port
+    )
+    console.print(f"[green]✓ Serving sessions on http://{host}:{port}[/green]")
+    async with server:
+        await server.serve_forever()
+
+
+def stream_response(assistant: QwenCodeAssistant, user_input: str) -> Optional[float]:
+    """
+    Render the assistant's answer incrementally as it streams in.
+    
+    Args:
+        assistant: The assistant to query
+        user_input: The user's message
         
-        return "⚠️ Max iterations reached. The task may be too complex or the assistant may need more guidance."
+    Returns:
+        Seconds until the first token, if any arrived
+    """
+    from rich.live import Live
+    from rich.markdown import Markdown
     
-    def reset_conversation(self):
-        """Clear conversation history."""
-        self.conversation_history = []
-        console.print("[green]✓ Conversation history cleared[/green]")
+    status = console.status("[bold blue]Thinking...", spinner="dots")
+    status.start()
+    live: Optional["Live"] = None
+    text = ""
+    first_token = None
     
-    def set_working_directory(self, directory: str):
+    try:
+        for event in assistant.chat_stream(user_input):
+            if event['type'] == 'first_token':
+                first_token = event['seconds']
+            elif event['type'] == 'token':
+                if live is None:
+                    status.stop()
+                    console.print("\n[bold blue]Assistant:[/bold blue]")
+                    live = Live(console=console.get(), refresh_per_second=8, vertical_overflow="visible")
+                    live.start()
+                text += event['content']
+                live.update(Markdown(text))
+            elif event['type'] == 'tool_call':
+                # Text before a tool call is interim narration; start a fresh block
+                if live is not None:
+                    live.stop()
+                    live = None
+                    text = ""
+                console.print(
+                    f"[yellow]🔧 Using tool:[/yellow] {event['name']}",
+                    style="bold"
+                )
+                status.start()
+            elif event['type'] == 'context_pruned':
+                console.print(f"[dim]Trimmed ~{event['tokens']} tokens of old context[/dim]")
+            elif event['type'] == 'done':
+                if live is None:
+                    status.stop()
+                    console.print("\n[bold blue]Assistant:[/bold blue]")
+                    console.print(Markdown(event['content']))
+    finally:
+        status.stop()
+        if live is not None:
+            live.stop()
+    
+    if first_token is not None:
+        console.print(f"[dim]First token after {first_token:.2f}s[/dim]")
+    return first_token
+
+
+def echo_command_output(stream: str, line: str):
+    """
+    Show a line of command output while the command is still running.
+    
+    Args:
+        stream: 'stdout' or 'stderr'
+        line: Output line
+    """
+    console.print(line, style="dim red" if stream == 'stderr' else "dim", markup=False, highlight=False)
+
+
+def print_stats(stats: Dict):
+    """
+    Print a session's model and tool timings.
+    
+    Args:
+        stats: Output of Tracer.stats()
+    """
+    model = stats['model']
+    
+    def rate(value: Optional[float], unit: str, digits: int = 1) -> str:
+        return f"{value:.{digits}f} {unit}" if value else "-"
+    
+    console.print(
+        f"[cyan]Session {stats['session']}:[/cyan] {stats['turns']} turns, "
+        f"{model['count']} model calls, {model['total']:.1f}s in the model\n"
+        f"  Model call p50 {model['p50']:.2f}s  p95 {model['p95']:.2f}s  "
+        f"first token {rate(model['first_token'], 's', 2)}\n"
+        f"  Prefill {rate(model['prefill_tokens_per_second'], 'tok/s')} "
+        f"({model['prompt_tokens']} tokens)  "
+        f"Decode {rate(model['decode_tokens_per_second'], 'tok/s')} "
+        f"({model['output_tokens']} tokens)  Load {model['load_seconds']:.2f}s"
+    )
+    routing = stats['routing']
+    if 'tool' in routing or 'escalations' in routing:
+        for phase in ('tool', 'answer'):
+            if phase in routing:
+                console.print(
+                    f"  {phase.capitalize()} phase: {routing[phase]['calls']} calls to "
+                    f"{', '.join(routing[phase]['models'])}, {routing[phase]['seconds']:.1f}s"
+                )
+        escalations = routing.get('escalations', {})
+        if escalations:
+            reasons = ', '.join(f"{reason} ({count})" for reason, count in escalations.items())
+            console.print(f"  Escalated to the answer model: {reasons}")
+    if not stats['tools']:
+        return
+    
+    from rich.table import Table
+    
+    table = Table(title="Tool calls", title_justify="left")
+    table.add_column("Tool")
+    for column in ("Calls", "Errors", "p50", "p95", "Max", "Total"):
+        table.add_column(column, justify="right")
+    for name, tool in stats['tools'].items():
+        table.add_row(
+            name, str(tool['count']), str(tool['errors']),
+            *(f"{tool[key] * 1000:.1f} ms" for key in ('p50', 'p95', 'max', 'total'))
+        )
+    console.print(table)
+
+
+def print_sessions(sessions: List[Dict], current: Optional[str] = None):
+    """
+    Print logged sessions as a table.
+    
+    Args:
+        sessions: Output of SessionLog.sessions()
+        current: Id of the running session, which is marked
+    """
+    if not sessions:
+        console.print("[dim]No logged sessions yet[/dim]")
+        return
+    
+    from rich.table import Table
+    
+    table = Table(title="Sessions (resume with /resume <id>)", title_justify="left")
+    for column in ("Id", "Last active", "Size", "Directory", "First message"):
+        table.add_column(column, justify="right" if column == "Size" else "left")
+    for session in sessions:
+        marker = " *" if session['id'] == current else ""
+        prompt = ' '.join(session['prompt'].split())
+        table.add_row(
+            session['id'] + marker,
+            time.strftime('%Y-%m-%d %H:%M', time.localtime(session['modified'])),
+            format_size(session['size']),
+            session['header'].get('working_directory', ''),
+            prompt[:60] + ('…' if len(prompt) > 60 else '')
+        )
+    console.print(table)
+
+
+def print_startup_profile(profile: Dict[str, Optional[float]]):
+    """
+    Print the timings collected with --startup-profile.
+    
+    Args:
+        profile: Phase name to seconds (None if the phase has not finished)
+    """
+    lines = [
+        f"  {name:<32} {'-' if seconds is None else f'{seconds:.3f}s':>9}"
+        for name, seconds in profile.items()
+    ]
+    console.print("[cyan]Startup profile:[/cyan]\n" + "\n".join(lines), highlight=False)
+
+
+def positive_int(value: str) -> int:
+    """
+    Parse a command-line count that must be at least 1.
+    
+    Args:
+        value: Option value
+        
+    Returns:
+        The count
+        
+    Raises:
+        argparse.ArgumentTypeError: If the value is not a positive integer
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{value}'")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Parse command-line options.
+    
+    Args:
+        argv: Arguments to parse (default: sys.argv)
+        
+    Returns:
+        Parsed options
+    """
+    parser = argparse.ArgumentParser(description="Local coding assistant powered by Ollama")
+    parser.add_argument('--model', default="qwen3-coder-next:q4_K_M", help="Ollama model to use")
+    parser.add_argument('--serve', action='store_true', help="Serve concurrent sessions over HTTP instead of chatting")
+    parser.add_argument('--host', default="127.0.0.1", help="Interface to serve on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8765, help="Port to serve on (default: 8765)")
+    parser.add_argument(
+        '--max-concurrent-requests', type=positive_int, default=2,
+        help="Model requests in flight at once when serving (default: 2)"
+    )
+    parser.add_argument(
+        '--keep-alive', default=KEEP_ALIVE,
+        help=f"How long Ollama keeps the model loaded between requests (default: {KEEP_ALIVE})"
+    )
+    parser.add_argument(
+        '--startup-profile', action='store_true',
+        help="Report import, health check, warm-up and first-token timings"
+    )
+    parser.add_argument(
+        '--log-compression', choices=('none', 'gzip', 'zstd'), default='none',
+        help="Compression of the session logs used by /resume (zstd needs the zstandard package)"
+    )
+    parser.add_argument('--no-session-log', action='store_true', help="Do not log sessions to disk")
+    parser.add_argument(
+        '--tool-model',
+        help="Smaller model that picks tool calls; --model then writes the answers"
+    )
+    for phase in ModelRouter.PHASES:
+        parser.add_argument(
+            f'--{phase}-options', type=json.loads, default={}, metavar='JSON',
+            help=f"Ollama options for {phase} requests, e.g. '{{\"num_predict\": 512}}'"
+        )
+    parser.add_argument(
+        '--batch', metavar='TASKS',
+        help="Run the prompts of a JSONL file without interaction instead of chatting"
+    )
+    parser.add_argument(
+        '--output', metavar='FILE',
+        help="JSONL file for --batch results; an existing file is resumed (default: TASKS.results.jsonl)"
+    )
+    parser.add_argument(
+        '--workers', type=positive_int, default=4, help="Tasks run at once in --batch mode (default: 4)"
+    )
+    return parser.parse_args(argv)
+
+
+def load_batch_tasks(path: str) -> List[Dict]:
+    """
+    Read the tasks of a batch run.
+    
+    Each line is a JSON object with a 'prompt' and optionally an 'id'
+    (default: the line number), a 'working_directory' (relative to the
+    tasks file's directory) and 'max_iterations'. Blank lines are skipped.
+    
+    Args:
+        path: JSONL file of tasks
+        
+    Returns:
+        Tasks in file order, each with a string 'id' and an absolute
+        'working_directory' if it has one
+        
+    Raises:
+        ValueError: If a line is not a valid task or an id is repeated
+    """
+    tasks = []
+    seen = set()
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, 'r', encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                task = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{number}: {e}") from e
+            if not isinstance(task, dict) or not isinstance(task.get('prompt'), str):
+                raise ValueError(f"{path}:{number}: expected an object with a 'prompt' string")
+            task_id = task.get('id', number)
+            if isinstance(task_id, bool) or not isinstance(task_id, (str, int)):
+                raise ValueError(f"{path}:{number}: 'id' must be a string or an integer")
+            max_iterations = task.get('max_iterations', 1)
+            if isinstance(max_iterations, bool) or not isinstance(max_iterations, int) or max_iterations < 1:
+                raise ValueError(f"{path}:{number}: 'max_iterations' must be a positive integer")
+            if 'working_directory' in task:
+                if not isinstance(task['working_directory'], str):
+                    raise ValueError(f"{path}:{number}: 'working_directory' must be a string")
+                # Relative to the tasks file, not to wherever the batch is started from
+                task['working_directory'] = os.path.join(
+                    base, os.path.expanduser(task['working_directory'])
+                )
+            task['id'] = str(task_id)
+            if task['id'] in seen:
+                raise ValueError(f"{path}:{number}: duplicate task id '{task['id']}'")
+            seen.add(task['id'])
+            tasks.append(task)
+    return tasks
+
+
+class BatchOutput:
+    """
+    Append-only JSONL output of a batch run.
+    
+    Every record is flushed as it is written; result records are also
+    fsynced, so after a crash the file holds every finished task. A line
+    cut short by the crash is dropped when the file is opened again.
+    """
+    
+    def __init__(self, path: str):
         """
-        Change the working directory.
+        Open (or continue) an output file.
         
         Args:
-            directory: New working directory path
+            path: JSONL file to append to
         """
-        if os.path.exists(directory) and os.path.isdir(directory):
-            self.working_directory = os.path.abspath(directory)
-            console.print(f"[green]✓ Working directory changed to: {self.working_directory}[/green]")
-        else:
-            console.print(f"[red]✗ Directory not found: {directory}[/red]")
+        self.path = path
+        self.completed = set()
+        if os.path.exists(path):
+            with open(path, 'rb+') as f:
+                data = f.read()
+                f.truncate(data.rfind(b'\n') + 1)
+            for line in data.splitlines():
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get('type') == 'result' and record.get('status') == 'ok':
+                    self.completed.add(record['id'])
+        self.file = open(path, 'a', encoding='utf-8')
+    
+    def write(self, record: Dict, sync: bool = False):
+        """
+        Append a record.
+        
+        Args:
+            record: JSON-serializable record
+            sync: Also fsync the file
+        """
+        self.file.write(json.dumps(record, default=str) + "\n")
+        self.file.flush()
+        if sync:
+            os.fsync(self.file.fileno())
+    
+    def close(self):
+        """Close the file."""
+        self.file.close()
+
+
+async def run_batch_task(manager: SessionManager, task: Dict, output: BatchOutput) -> Dict:
+    """
+    Run one task in a session of its own and record what happened.
+    
+    Tool calls and results are written as they happen ('tool_call' and
+    'tool_result' records); the final 'result' record has the response,
+    status ('ok', 'error' or 'max_iterations'), timings and session stats.
+    
+    Args:
+        manager: Session manager running the batch
+        task: Task from load_batch_tasks()
+        output: Output file
+        
+    Returns:
+        The result record
+    """
+    started = time.perf_counter()
+    record = {'type': 'result', 'id': task['id'], 'status': 'ok'}
+    try:
+        session_id = manager.create_session(task.get('working_directory'))
+    except (ValueError, RuntimeError) as e:
+        record.update(status='error', error=str(e), seconds=0.0)
+        output.write(record, sync=True)
+        return record
+    
+    session = manager.sessions[session_id]
+    record['working_directory'] = session.working_directory
+    try:
+        async for event in manager.chat_stream(session_id, task['prompt'], task.get('max_iterations', 10)):
+            elapsed = time.perf_counter() - started
+            if event['type'] == 'tool_call':
+                output.write({
+                    'type': 'tool_call', 'id': task['id'], 'elapsed': elapsed,
+                    'name': event['name'], 'arguments': event['arguments']
+                })
+            elif event['type'] == 'tool_result':
+                output.write({
+                    'type': 'tool_result', 'id': task['id'], 'elapsed': elapsed,
+                    'name': event['name'], 'chars': len(event['content'])
+                })
+            elif event['type'] == 'first_token':
+                record['first_token'] = event['seconds']
+            elif event['type'] == 'done':
+                record['response'] = event['content']
+        response = record.get('response', '')
+        if response.startswith("Error during chat:"):
+            record.update(status='error', error=response)
+        elif response == MAX_ITERATIONS_MESSAGE:
+            record['status'] = 'max_iterations'
+    except Exception as e:
+        record.update(status='error', error=str(e))
+    finally:
+        record['seconds'] = time.perf_counter() - started
+        record['stats'] = session.tracer.stats()
+        manager.close_session(session_id)
+    
+    output.write(record, sync=True)
+    return record
+
+
+async def run_batch(
+    manager: SessionManager,
+    tasks: List[Dict],
+    output_path: str,
+    workers: int = 4
+) -> Dict[str, int]:
+    """
+    Run tasks concurrently, appending their records to a JSONL file.
+    
+    Tasks already recorded as 'ok' in the output file are skipped, so an
+    interrupted run continues where it stopped. At most workers tasks run
+    at once; the manager's request slots bound the model requests among them.
+    
+    Args:
+        manager: Session manager (its max_sessions must be at least workers)
+        tasks: Tasks from load_batch_tasks()
+        output_path: JSONL file to append to
+        workers: Tasks run concurrently (default: 4)
+        
+    Returns:
+        Number of tasks per status, plus 'skipped'
+        
+    Raises:
+        ValueError: If workers is less than 1
+    """
+    if workers < 1:
+        raise ValueError(f"workers must be at least 1, got {workers}")
+    await manager.verify()
+    output = BatchOutput(output_path)
+    pending = iter([task for task in tasks if task['id'] not in output.completed])
+    counts = {'skipped': sum(1 for task in tasks if task['id'] in output.completed)}
+    
+    async def worker():
+        # The workers share one iterator, so each task is taken once
+        for task in pending:
+            record = await run_batch_task(manager, task, output)
+            counts[record['status']] = counts.get(record['status'], 0) + 1
+            mark = "[green]✓[/green]" if record['status'] == 'ok' else "[red]✗[/red]"
+            console.print(f"{mark} {task['id']} [dim]({record['status']}, {record['seconds']:.1f}s)[/dim]")
+    
+    try:
+        await asyncio.gather(*(worker() for _ in range(workers)))
+    finally:
+        output.close()
+    return counts
 
 
 def main():
     """Main interactive loop."""
+    args = parse_args()
+    try:
+        router = ModelRouter(
+            args.model,
+            args.tool_model,
+            options={'tool': args.tool_options, 'answer': args.answer_options}
+        )
+    except (ValueError, TypeError) as e:
+        console.print(f"[red]❌ Invalid routing options: {e}[/red]")
+        return
+    
+    if args.batch:
+        try:
+            tasks = load_batch_tasks(args.batch)
+        except (OSError, ValueError) as e:
+            console.print(f"[red]❌ Cannot read tasks: {e}[/red]")
+            return
+        output_path = args.output or os.path.splitext(args.batch)[0] + '.results.jsonl'
+        manager = SessionManager(
+            args.model,
+            max_concurrent_requests=args.max_concurrent_requests,
+            max_sessions=args.workers,
+            router=router
+        )
+        try:
+            counts = asyncio.run(run_batch(manager, tasks, output_path, args.workers))
+        except KeyboardInterrupt:
+            console.print(f"\n[yellow]Interrupted; run again to resume from {output_path}[/yellow]")
+            return
+        except ConnectionError as e:
+            console.print(f"[red]❌ {e}[/red]")
+            return
+        summary = ', '.join(f"{count} {status}" for status, count in counts.items() if count)
+        console.print(f"[cyan]{len(tasks)} tasks: {summary or 'nothing to do'} → {output_path}[/cyan]")
+        return
+    
+    if args.serve:
+        manager = SessionManager(
+            args.model,
+            max_concurrent_requests=args.max_concurrent_requests,
+            router=router
+        )
+        try:
+            asyncio.run(serve(manager, args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+        except ConnectionError as e:
+            console.print(f"[red]❌ {e}[/red]")
+        return
+    
+    profile: Dict[str, Optional[float]] = {'module imports': MODULE_LOADED - MODULE_LOADING_STARTED}
+    
+    def health_check() -> Optional[str]:
+        started = time.perf_counter()
+        error = None
+        for model in sorted(set(router.models.values())):
+            error = error or check_ollama(model)
+        profile['health check'] = time.perf_counter() - started
+        return error
+    
+    # The health check runs while the welcome is shown and ollama is imported
+    startup = ThreadPoolExecutor(max_workers=1, thread_name_prefix="startup")
+    health = startup.submit(health_check)
     
     # Welcome message
+    from rich.panel import Panel
     console.print(Panel.fit(
         "[bold cyan]Qwen Local Code Assistant[/bold cyan]\n"
         "Powered by Qwen3-Coder-Next & Ollama\n\n"
@@ -468,6 +7475,10 @@ def main():
         "  [yellow]/reset[/yellow]  - Clear conversation history\n"
         "  [yellow]/cd <dir>[/yellow] - Change working directory\n"
         "  [yellow]/pwd[/yellow] - Show current directory\n"
+        "  [yellow]/cache[/yellow] - Show tool result cache statistics\n"
+        "  [yellow]/stats[/yellow] - Show model and tool timings\n"
+        "  [yellow]/sessions[/yellow] - List logged sessions\n"
+        "  [yellow]/resume <id>[/yellow] - Continue a logged session\n"
         "  [yellow]/help[/yellow] - Show help message\n"
         "  [yellow]/exit[/yellow] or [yellow]/quit[/yellow] - Exit the assistant",
         title="🤖 Welcome",
@@ -476,12 +7487,32 @@ def main():
     
     # Initialize assistant
     try:
-        assistant = QwenCodeAssistant()
+        started = time.perf_counter()
+        assistant = QwenCodeAssistant(
+            args.model,
+            verify=False,
+            keep_alive=args.keep_alive,
+            router=router,
+            session_log=not args.no_session_log,
+            log_compression=None if args.log_compression == 'none' else args.log_compression
+        )
+        profile['assistant setup'] = time.perf_counter() - started
     except Exception as e:
         console.print(f"[red]Failed to initialize assistant: {e}[/red]")
         return
     
+    error = health.result()
+    startup.shutdown()
+    if error:
+        console.print(error)
+        return
+    
+    # Load the model while the user types the first question
+    assistant.warm_up()
+    
+    assistant.on_command_output = echo_command_output
     console.print(f"\n[dim]Working directory: {assistant.working_directory}[/dim]\n")
+    profile['ready for input'] = time.perf_counter() - MODULE_LOADING_STARTED
     
     # Main loop
     while True:
@@ -495,6 +7526,8 @@ def main():
             
             # Handle commands
             if user_input in ['/exit', '/quit']:
+                if assistant.session_log is not None:
+                    assistant.session_log.close()
                 console.print("\n[yellow]👋 Goodbye! Happy coding![/yellow]")
                 break
             
@@ -506,6 +7539,49 @@ def main():
                 console.print(f"[cyan]Current directory:[/cyan] {assistant.working_directory}")
                 continue
             
+            elif user_input == '/cache':
+                stats = assistant.result_cache.stats()
+                console.print(
+                    f"[cyan]Tool result cache:[/cyan] {stats['entries']} entries, "
+                    f"{stats['bytes'] / 1024:.1f} KB\n"
+                    f"  Hits: {stats['hits']}  Misses: {stats['misses']}  "
+                    f"Hit rate: {stats['hit_rate']:.0%}\n"
+                    f"  Evictions: {stats['evictions']}  Invalidations: {stats['invalidations']}"
+                )
+                stored = assistant.results.stats()
+                console.print(
+                    f"[cyan]Stored tool results:[/cyan] {stored['results']} "
+                    f"({stored['spilled']} on disk, {stored['memory_chars'] / 1024:.1f} KB in memory)"
+                )
+                if assistant.prefetcher is not None:
+                    prefetch = assistant.prefetcher.stats()
+                    console.print(
+                        f"[cyan]Prefetched files:[/cyan] {prefetch['entries']} waiting, "
+                        f"{prefetch['bytes'] / 1024:.1f} KB\n"
+                        f"  Read ahead: {prefetch['prefetched']} of {prefetch['predicted']} predicted  "
+                        f"Hits: {prefetch['hits']}  Misses: {prefetch['misses']}  "
+                        f"Hit rate: {prefetch['hit_rate']:.0%}  Wasted: {prefetch['wasted']}"
+                    )
+                if assistant.watcher is not None:
+                    watcher = assistant.watcher.stats()
+                    console.print(
+                        f"[cyan]File watcher:[/cyan] {watcher['mode']}, {watcher['watches']} directories, "
+                        f"{watcher['batches']} change batches"
+                    )
+                continue
+            
+            elif user_input == '/stats':
+                print_stats(assistant.tracer.stats())
+                continue
+            
+            elif user_input == '/sessions':
+                print_sessions(SessionLog.sessions(), assistant.tracer.session_id)
+                continue
+            
+            elif user_input.startswith('/resume '):
+                assistant.resume_session(user_input[8:].strip())
+                continue
+            
             elif user_input.startswith('/cd '):
                 new_dir = user_input[4:].strip()
                 assistant.set_working_directory(new_dir)
@@ -517,6 +7593,10 @@ def main():
                     "  [yellow]/reset[/yellow]     - Clear conversation history\n"
                     "  [yellow]/cd <dir>[/yellow]  - Change working directory\n"
                     "  [yellow]/pwd[/yellow]       - Show current directory\n"
+                    "  [yellow]/cache[/yellow]     - Show tool result cache statistics\n"
+                    "  [yellow]/stats[/yellow]     - Show model and tool timings\n"
+                    "  [yellow]/sessions[/yellow]  - List logged sessions\n"
+                    "  [yellow]/resume <id>[/yellow] - Continue a logged session\n"
                     "  [yellow]/help[/yellow]      - Show this help message\n"
                     "  [yellow]/exit[/yellow]      - Exit the assistant\n\n"
                     "[bold]What I can do:[/bold]\n\n"
@@ -537,13 +7617,17 @@ def main():
                 ))
                 continue
             
-            # Regular chat message - get response from assistant
-            with console.status("[bold blue]Thinking...", spinner="dots"):
-                response = assistant.chat(user_input)
+            # Regular chat message - stream the response from assistant
+            first_token = stream_response(assistant, user_input)
             
-            # Display response
-            console.print("\n[bold blue]Assistant:[/bold blue]")
-            console.print(Markdown(response))
+            if args.startup_profile and 'first token' not in profile:
+                warm_up = [span for span in list(assistant.tracer.spans) if span['kind'] == 'warmup']
+                profile['model warm-up'] = warm_up[0]['duration'] if warm_up else None
+                profile['model load (Ollama)'] = (
+                    (warm_up[0].get('load_duration') or 0) / 1e9 if warm_up else None
+                )
+                profile['first token'] = first_token
+                print_startup_profile(profile)
             
         except KeyboardInterrupt:
             console.print("\n[yellow]⚠️  Interrupted. Type /exit to quit or continue chatting.[/yellow]")
@@ -0,0 +1,558 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the Qwen Local Code Assistant
+
+Drives the assistant's tool loop against a local fake Ollama server that
+replays recorded tool-calling transcripts, and measures the file tools on
+synthetic repositories. Results are written as JSON so that runs before
+and after a change can be diffed.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --sizes 1000,10000 --output results.json
+    python benchmark.py --transcript session.json --token-latency 0.05
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import statistics
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional
+from rich.console import Console
+
+from assistant import HashEmbeddings, QwenCodeAssistant
+
+console = Console(stderr=True)
+
+MODEL = "qwen3-coder-next:q4_K_M"
+
+# Explores a synthetic repository the way a typical session does
+DEFAULT_TRANSCRIPT = {
+    'name': 'explore-and-answer',
+    'turns': [
+        {
+            'prompt': 'Where is handler_7 defined and what calls it?',
+            'responses': [
+                {'content': '', 'tool_calls': [
+                    {'name': 'list_files', 'arguments': {'directory': 'pkg0'}}
+                ]},
+                {'content': '', 'tool_calls': [
+                    {'name': 'search_code', 'arguments': {'query': 'def handler_7('}},
+                    {'name': 'search_code', 'arguments': {'query': 'handler_7(', 'file_pattern': '*.py'}}
+                ]},
+                {'content': '', 'tool_calls': [
+                    {'name': 'read_file', 'arguments': {'filepath': 'pkg0/sub0/module_7.py'}},
+                    {'name': 'read_files', 'arguments': {'paths': ['pkg0/sub0/module_1*.py']}}
+                ]},
+                {'content': (
+                    "`handler_7` is defined in `pkg0/sub0/module_7.py`. It validates its "
+                    "input, delegates to `helper_7` and is called from the module's "
+                    "`main` function.\n\n- Definition: `pkg0/sub0/module_7.py`\n"
+                    "- Callers: `main()` in the same module"
+                )}
+            ]
+        },
+        {
+            'prompt': 'Rename helper_7 to compute_7 in that module.',
+            'responses': [
+                {'content': '', 'tool_calls': [
+                    {'name': 'read_file', 'arguments': {'filepath': 'pkg0/sub0/module_7.py', 'start_line': 1, 'end_line': 20}}
+                ]},
+                {'content': '', 'tool_calls': [
+                    {'name': 'edit_file', 'arguments': {
+                        'filepath': 'pkg0/sub0/module_7.py',
+                        'edits': [{'search': 'def helper_7(', 'replace': 'def compute_7('}]
+                    }},
+                    {'name': 'execute_command', 'arguments': {'command': 'python -m py_compile pkg0/sub0/module_7.py'}}
+                ]},
+                {'content': "Renamed `helper_7` to `compute_7`; the module still compiles."}
+            ]
+        }
+    ]
+}
+
+
+def transcript_from_history(history: List[Dict], name: str = 'recorded') -> Dict:
+    """
+    Turn a real conversation into a replayable transcript.
+
+    Args:
+        history: conversation_history of a QwenCodeAssistant session
+        name: Name of the transcript
+
+    Returns:
+        Transcript dictionary (see DEFAULT_TRANSCRIPT)
+    """
+    turns: List[Dict] = []
+    for message in history:
+        if message.get('role') == 'user':
+            turns.append({'prompt': message.get('content', ''), 'responses': []})
+        elif message.get('role') == 'assistant' and turns:
+            turns[-1]['responses'].append({
+                'content': message.get('content') or '',
+                'tool_calls': [
+                    {'name': call['function']['name'], 'arguments': dict(call['function']['arguments'])}
+                    for call in message.get('tool_calls') or []
+                ]
+            })
+    return {'name': name, 'turns': turns}
+
+
+class FakeOllama:
+    """
+    Minimal stand-in for the Ollama HTTP API (/api/tags, /api/chat and /api/embed).
+
+    Chat requests are answered from a transcript: the number of user
+    messages selects the turn and the number of assistant messages since
+    the last user message selects the response. Streaming honours the
+    configured first-token and per-chunk latencies. Embeddings come from
+    the deterministic HashEmbeddings backend.
+    """
+
+    def __init__(
+        self,
+        transcript: Dict,
+        first_token_latency: float = 0.05,
+        token_latency: float = 0.005,
+        chunk_chars: int = 16
+    ):
+        """
+        Create the server (not started yet).
+
+        Args:
+            transcript: Transcript to replay
+            first_token_latency: Seconds before the first chunk (prefill)
+            token_latency: Seconds between chunks (decode)
+            chunk_chars: Characters of content per streamed chunk
+        """
+        self.transcript = transcript
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.chunk_chars = chunk_chars
+        self.embeddings = HashEmbeddings()
+        self.requests = 0
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self._send_json({'models': [{'name': MODEL, 'model': MODEL}]})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                request = json.loads(self.rfile.read(length) or b'{}')
+                fake.requests += 1
+                if self.path == '/api/embed':
+                    inputs = request.get('input') or []
+                    inputs = [inputs] if isinstance(inputs, str) else inputs
+                    self._send_json({'model': request.get('model'), 'embeddings': fake.embeddings.embed(inputs)})
+                    return
+                if self.path != '/api/chat':
+                    self.send_error(404)
+                    return
+                fake.answer(self, request)
+
+            def _send_json(self, payload: Dict):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.handler = Handler
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        """Base URL of the running server."""
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeOllama":
+        """Start serving in a background thread."""
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server."""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _response_for(self, messages: List[Dict]) -> Dict:
+        """Pick the transcript response matching the conversation so far."""
+        turn = sum(1 for m in messages if m.get('role') == 'user') - 1
+        last_user = max((i for i, m in enumerate(messages) if m.get('role') == 'user'), default=0)
+        step = sum(1 for m in messages[last_user:] if m.get('role') == 'assistant')
+        turns = self.transcript['turns']
+        if 0 <= turn < len(turns) and step < len(turns[turn]['responses']):
+            return turns[turn]['responses'][step]
+        return {'content': 'Done.'}
+
+    def answer(self, handler: BaseHTTPRequestHandler, request: Dict):
+        """Write the replayed response for a chat request."""
+        messages = request.get('messages') or []
+        response = self._response_for(messages)
+        content = response.get('content', '')
+        tool_calls = [
+            {'function': {'name': call['name'], 'arguments': call.get('arguments', {})}}
+            for call in response.get('tool_calls') or []
+        ]
+        chunks = [content[i:i + self.chunk_chars] for i in range(0, len(content), self.chunk_chars)]
+
+        prompt_chars = sum(len(str(m.get('content') or '')) for m in messages)
+        started = time.perf_counter()
+        time.sleep(self.first_token_latency)
+        prefill = time.perf_counter() - started
+
+        def usage() -> Dict:
+            total = time.perf_counter() - started
+            return {
+                'total_duration': int(total * 1e9),
+                'load_duration': 0,
+                'prompt_eval_count': prompt_chars // 4 + 1,
+                'prompt_eval_duration': int(prefill * 1e9),
+                'eval_count': len(content) // 4 + 10 * len(tool_calls) + 1,
+                'eval_duration': int((total - prefill) * 1e9),
+            }
+
+        base = {'model': request.get('model', MODEL), 'created_at': '2024-01-01T00:00:00Z'}
+
+        if not request.get('stream', True):
+            for _ in chunks:
+                time.sleep(self.token_latency)
+            message = {'role': 'assistant', 'content': content}
+            if tool_calls:
+                message['tool_calls'] = tool_calls
+            handler._send_json({**base, 'message': message, 'done': True, 'done_reason': 'stop', **usage()})
+            return
+
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'application/x-ndjson')
+        handler.send_header('Transfer-Encoding', 'chunked')
+        handler.end_headers()
+
+        def send(payload: Dict):
+            data = json.dumps(payload).encode('utf-8') + b"\n"
+            handler.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+            handler.wfile.flush()
+
+        for index, chunk in enumerate(chunks):
+            if index:
+                time.sleep(self.token_latency)
+            send({**base, 'message': {'role': 'assistant', 'content': chunk}, 'done': False})
+        if tool_calls:
+            time.sleep(self.token_latency)
+            send({**base, 'message': {'role': 'assistant', 'content': '', 'tool_calls': tool_calls}, 'done': False})
+        send({
+            **base,
+            'message': {'role': 'assistant', 'content': ''},
+            'done': True,
+            'done_reason': 'stop',
+            **usage()
+        })
+        handler.wfile.write(b"0\r\n\r\n")
+        handler.wfile.flush()
+
+
+class InstrumentedAssistant(QwenCodeAssistant):
+    """QwenCodeAssistant that records timings of every iteration and tool call."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.iterations: List[Dict] = []
+        self.tool_times: Dict[str, List[float]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def _close_iteration(self):
+        """Record the wall time of the last iteration."""
+        if self.iterations and 'wall_seconds' not in self.iterations[-1]:
+            last = self.iterations[-1]
+            last['wall_seconds'] = time.perf_counter() - last.pop('_started')
+
+    def _model_response(self, stream: bool, phase: str = 'answer') -> Iterator:
+        self._close_iteration()
+        record = {
+            '_started': time.perf_counter(),
+            'phase': phase,
+            'messages': len(self.conversation_history),
+            'history_bytes': len(json.dumps(self.conversation_history, default=str)),
+            'history_tokens': self.context.total(self.conversation_history),
+            'tool_calls': [],
+        }
+        self.iterations.append(record)
+        yield from super()._model_response(stream, phase)
+        record['model_seconds'] = time.perf_counter() - record['_started']
+
+    def execute_tool_calls(self, calls: List[tuple]) -> List[str]:
+        started = time.perf_counter()
+        results = super().execute_tool_calls(calls)
+        self.iterations[-1]['tool_seconds'] = time.perf_counter() - started
+        self.iterations[-1]['tool_calls'] = [name for name, _ in calls]
+        return results
+
+    def execute_tool(self, tool_name: str, arguments: Dict) -> str:
+        started = time.perf_counter()
+        result = super().execute_tool(tool_name, arguments)
+        with self._lock:
+            self.tool_times[tool_name].append(time.perf_counter() - started)
+        return result
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """
+    Summary statistics of a list of durations.
+
+    Args:
+        samples: Durations in seconds
+
+    Returns:
+        Count, mean, p50, p95 and max
+    """
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'mean': statistics.fmean(ordered),
+        'p50': ordered[len(ordered) // 2],
+        'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        'max': ordered[-1],
+    }
+
+
+def make_synthetic_repo(root: str, files: int, seed: int = 0):
+    """
+    Create a deterministic synthetic Python project.
+
+    Files are laid out as pkg<N>/sub<M>/module_<i>.py, 100 per directory.
+
+    Args:
+        root: Directory to create the files in
+        files: Number of files
+        seed: Random seed for the file contents
+    """
+    rng = random.Random(seed)
+    words = [f"value_{i}" for i in range(500)]
+    for i in range(files):
+        directory = os.path.join(root, f"pkg{i // 1000}", f"sub{i // 100 % 10}")
+        if i % 100 == 0:
+            os.makedirs(directory, exist_ok=True)
+        body = "\n".join(
+            f"    {rng.choice(words)} = {rng.choice(words)} + {rng.randint(0, 99)}"
+            for _ in range(20)
+        )
+        with open(os.path.join(directory, f"module_{i % 100}.py"), 'w', encoding='utf-8') as f:
+            f.write(
+                f'"""Synthetic module {i}."""\n\n\n'
+                f"def helper_{i % 100}(data):\n{body}\n    return data\n\n\n"
+                f"def handler_{i % 100}(request):\n"
+                f"    if not request:\n        raise ValueError('empty request')\n"
+                f"    return helper_{i % 100}(request)\n\n\n"
+                f"def main():\n    print(handler_{i % 100}({{'id': {i}}}))\n"
+            )
+
+
+@contextmanager
+def started_in(root: str, cls=QwenCodeAssistant, **kwargs) -> Iterator[QwenCodeAssistant]:
+    """
+    Run an assistant started in root, as the CLI is when launched there.
+
+    The working directory is set before the assistant's FileWatcher starts,
+    so the shipped default (a watched tree) is measured and the directory
+    the benchmark runs from is never watched. The watcher and the shell are
+    stopped afterwards.
+
+    Args:
+        root: Working directory
+        cls: Assistant class
+        kwargs: Passed on to the class
+
+    Yields:
+        The assistant
+    """
+    previous = os.getcwd()
+    os.chdir(root)
+    try:
+        assistant = cls(MODEL, **kwargs)
+    finally:
+        os.chdir(previous)
+    try:
+        yield assistant
+    finally:
+        if assistant.watcher is not None:
+            assistant.watcher.stop()
+        assistant.shell.close()
+
+
+def run_transcript(transcript: Dict, server: FakeOllama, files: int) -> Dict:
+    """
+    Replay a transcript through QwenCodeAssistant.chat_stream.
+
+    Args:
+        transcript: Transcript to replay
+        server: Running fake Ollama server
+        files: Size of the synthetic repository to run against
+
+    Returns:
+        Per-turn and per-iteration timings, tool timings and history growth
+    """
+    root = tempfile.mkdtemp(prefix='qwen-bench-')
+    try:
+        make_synthetic_repo(root, files)
+        server.transcript = transcript
+        with started_in(root, InstrumentedAssistant, host=server.url, session_log=False) as assistant:
+            turns = []
+            for turn in transcript['turns']:
+                started = time.perf_counter()
+                first_token = None
+                for event in assistant.chat_stream(turn['prompt']):
+                    if event['type'] == 'first_token':
+                        first_token = event['seconds']
+                assistant._close_iteration()
+                turns.append({
+                    'prompt': turn['prompt'],
+                    'wall_seconds': time.perf_counter() - started,
+                    'first_token_seconds': first_token,
+                })
+
+            return {
+                'name': transcript.get('name', 'transcript'),
+                'repo_files': files,
+                'turns': turns,
+                'iterations': assistant.iterations,
+                'tools': {name: summarize(times) for name, times in sorted(assistant.tool_times.items())},
+                'final_history_bytes': len(json.dumps(assistant.conversation_history, default=str)),
+                'final_history_tokens': assistant.context.total(assistant.conversation_history),
+            }
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def bench_file_tools(files: int, server: FakeOllama, repeats: int = 5) -> Dict:
+    """
+    Measure list_files and search_code throughput on a synthetic repository.
+
+    Args:
+        files: Number of files in the repository
+        server: Running fake Ollama server (needed to construct the assistant)
+        repeats: Repetitions of the warm measurements
+
+    Returns:
+        Cold, warm (result cache cleared) and cached timings with files/second
+    """
+    root = tempfile.mkdtemp(prefix='qwen-bench-')
+    try:
+        started = time.perf_counter()
+        make_synthetic_repo(root, files)
+        generate_seconds = time.perf_counter() - started
+
+        with started_in(root, host=server.url, session_log=False) as assistant:
+            def timed(function, *args, clear: bool = False, **kwargs) -> float:
+                if clear:
+                    assistant.result_cache.invalidate()
+                started = time.perf_counter()
+                function(*args, **kwargs)
+                return time.perf_counter() - started
+
+            results = {'files': files, 'generate_seconds': generate_seconds}
+            for name, function, kwargs in [
+                ('list_files', assistant.list_files, {}),
+                # The summary walks the whole tree; a plain listing stops after one page
+                ('list_files_summary', assistant.list_files, {'summary': True}),
+                ('search_code', assistant.search_code, {'query': 'def handler_42('}),
+                ('search_code_regex', assistant.search_code, {'query': r'raise \w+Error', 'regex': True}),
+            ]:
+                cold = timed(function, **kwargs)
+                warm = [timed(function, clear=True, **kwargs) for _ in range(repeats)]
+                cached = [timed(function, **kwargs) for _ in range(repeats)]
+                results[name] = {
+                    'cold_seconds': cold,
+                    'warm': summarize(warm),
+                    'cached': summarize(cached),
+                    'warm_files_per_second': files / statistics.fmean(warm) if min(warm) > 0 else None,
+                }
+            return results
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main(argv: Optional[List[str]] = None):
+    """Run the benchmarks and write the JSON report."""
+    parser = argparse.ArgumentParser(description="Benchmark the assistant's tool loop and file tools")
+    parser.add_argument('--transcript', action='append', help="Transcript JSON file to replay (repeatable)")
+    parser.add_argument('--transcript-files', type=int, default=1000, help="Synthetic repo size for transcripts")
+    parser.add_argument('--sizes', default='1000,10000,100000', help="Comma-separated synthetic repo sizes")
+    parser.add_argument('--repeats', type=int, default=5, help="Repetitions of warm measurements")
+    parser.add_argument('--first-token-latency', type=float, default=0.05, help="Fake prefill latency (s)")
+    parser.add_argument('--token-latency', type=float, default=0.005, help="Fake per-chunk latency (s)")
+    parser.add_argument('--output', help="Write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    # Never reuse (or pollute) the user's search indexes
+    cache_root = tempfile.mkdtemp(prefix='qwen-bench-cache-')
+    os.environ['XDG_CACHE_HOME'] = cache_root
+
+    transcripts = []
+    for path in args.transcript or []:
+        with open(path, 'r', encoding='utf-8') as f:
+            transcripts.append(json.load(f))
+    transcripts = transcripts or [DEFAULT_TRANSCRIPT]
+
+    server = FakeOllama(
+        DEFAULT_TRANSCRIPT,
+        first_token_latency=args.first_token_latency,
+        token_latency=args.token_latency
+    ).start()
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'arguments': vars(args),
+        },
+        'transcripts': [],
+        'file_tools': [],
+    }
+
+    try:
+        for transcript in transcripts:
+            console.print(f"[cyan]Replaying transcript {transcript.get('name', '?')}...[/cyan]")
+            report['transcripts'].append(run_transcript(transcript, server, args.transcript_files))
+
+        for size in [int(size) for size in args.sizes.split(',') if size.strip()]:
+            console.print(f"[cyan]Measuring file tools on {size} files...[/cyan]")
+            report['file_tools'].append(bench_file_tools(size, server, args.repeats))
+    finally:
+        server.stop()
+        shutil.rmtree(cache_root, ignore_errors=True)
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+        console.print(f"[green]✓ Results written to {args.output}[/green]")
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
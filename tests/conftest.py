@@ -0,0 +1,47 @@
+"""Shared fixtures for the assistant's tests."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path, monkeypatch):
+    """Keep indexes, session logs and traces out of the real cache directory."""
+    path = tmp_path / 'cache'
+    monkeypatch.setenv('XDG_CACHE_HOME', str(path))
+    return path
+
+
+@pytest.fixture
+def make_tree(tmp_path):
+    """Return a function that writes {relative path: content} under a fresh root."""
+    def make(files):
+        root = tmp_path / 'tree'
+        root.mkdir(exist_ok=True)
+        for relpath, content in files.items():
+            path = root / relpath
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content)
+        return str(root)
+    return make
+
+
+@pytest.fixture
+def assistant(make_tree):
+    """A QwenCodeAssistant on an empty tree that never talks to Ollama."""
+    from assistant import HashEmbeddings, QwenCodeAssistant
+
+    instance = QwenCodeAssistant(
+        verify=False,
+        watch=False,
+        session_log=False,
+        prefetch=False,
+        embedding_backend=HashEmbeddings()
+    )
+    instance.working_directory = make_tree({})
+    yield instance
+    instance.shell.close()
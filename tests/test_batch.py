@@ -0,0 +1,58 @@
+"""Tests for loading batch tasks and the batch command-line options."""
+
+import json
+import os
+
+import pytest
+
+from assistant import load_batch_tasks, parse_args
+
+
+def write_tasks(tmp_path, *tasks):
+    path = tmp_path / 'jobs' / 'tasks.jsonl'
+    path.parent.mkdir(exist_ok=True)
+    path.write_text(''.join(
+        (task if isinstance(task, str) else json.dumps(task)) + '\n' for task in tasks
+    ))
+    return str(path)
+
+
+def test_tasks_get_ids_and_directories_relative_to_the_file(tmp_path):
+    path = write_tasks(
+        tmp_path,
+        {'prompt': 'a', 'working_directory': 'app'},
+        '',
+        {'id': 7, 'prompt': 'b', 'working_directory': str(tmp_path), 'max_iterations': 3}
+    )
+    tasks = load_batch_tasks(path)
+    assert [task['id'] for task in tasks] == ['1', '7']
+    assert tasks[0]['working_directory'] == os.path.join(str(tmp_path), 'jobs', 'app')
+    assert tasks[1]['working_directory'] == str(tmp_path)
+
+
+@pytest.mark.parametrize('task, message', [
+    ({'prompt': 'a', 'max_iterations': 'ten'}, 'max_iterations'),
+    ({'prompt': 'a', 'max_iterations': 0}, 'max_iterations'),
+    ({'prompt': 'a', 'max_iterations': True}, 'max_iterations'),
+    ({'prompt': 'a', 'working_directory': 3}, 'working_directory'),
+    ({'prompt': 'a', 'id': ['x']}, "'id'"),
+    ({'id': 'x'}, 'prompt'),
+])
+def test_invalid_task_fields_are_reported_with_their_line(tmp_path, task, message):
+    path = write_tasks(tmp_path, {'prompt': 'ok'}, task)
+    with pytest.raises(ValueError, match=message) as error:
+        load_batch_tasks(path)
+    assert f"{path}:2:" in str(error.value)
+
+
+def test_duplicate_ids_are_rejected(tmp_path):
+    path = write_tasks(tmp_path, {'id': 'x', 'prompt': 'a'}, {'id': 'x', 'prompt': 'b'})
+    with pytest.raises(ValueError, match='duplicate'):
+        load_batch_tasks(path)
+
+
+@pytest.mark.parametrize('value', ['0', '-2', 'many'])
+def test_workers_must_be_positive(value):
+    with pytest.raises(SystemExit):
+        parse_args(['--batch', 'tasks.jsonl', '--workers', value])
+    assert parse_args(['--workers', '3']).workers == 3
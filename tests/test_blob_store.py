@@ -0,0 +1,113 @@
+"""Tests for large tool results: the blob store and fetch_result."""
+
+import os
+import re
+
+from assistant import TOOL_RESULT_INLINE_CHARS, BlobStore, ToolError
+
+
+def numbered(count):
+    return '\n'.join(f"line {number}" for number in range(1, count + 1))
+
+
+def test_oldest_results_spill_to_disk_and_come_back():
+    store = BlobStore(memory_limit=100)
+    first = store.put('a' * 60)
+    second = store.put('b' * 60)
+    stats = store.stats()
+    assert stats == {'results': 2, 'in_memory': 1, 'spilled': 1, 'lazy': 0, 'memory_chars': 60}
+    assert os.path.isfile(store.spilled[first])
+    assert store.get(first) == 'a' * 60
+    assert store.get(second) == 'b' * 60
+
+
+def test_a_single_oversized_result_stays_in_memory():
+    store = BlobStore(memory_limit=10)
+    handle = store.put('x' * 50)
+    assert store.stats()['spilled'] == 0
+    assert store.get(handle) == 'x' * 50
+
+
+def test_clear_removes_the_spill_directory():
+    store = BlobStore(memory_limit=10)
+    first = store.put('a' * 20)
+    store.put('b' * 20)
+    directory = store.spill_directory
+    assert os.path.isdir(directory)
+    store.clear()
+    assert not os.path.exists(directory)
+    assert store.get(first) is None
+
+
+def test_lazy_results_load_on_demand_and_advance_the_counter():
+    store = BlobStore()
+    loads = []
+    store.add_lazy('result-7', lambda: loads.append(1) or 'logged')
+    assert loads == []
+    assert store.get('result-7') == 'logged'
+    assert store.put('new') == 'result-8'
+
+
+def test_unknown_handle():
+    assert BlobStore().get('result-1') is None
+
+
+def test_small_results_stay_inline(assistant):
+    assert assistant._store_large_result('read_file', 'short') == 'short'
+    assert assistant.results.stats()['results'] == 0
+
+
+def test_large_result_is_previewed_and_fetched_back(assistant):
+    text = numbered(2000)
+    assert len(text) > TOOL_RESULT_INLINE_CHARS
+    preview = assistant._store_large_result('execute_command', text)
+    handle = re.search(r"stored as (result-\d+)", preview).group(1)
+    assert preview.startswith('line 1\n')
+    assert preview.rstrip().endswith(f"pattern='...').]")
+    assert 'characters omitted' in preview
+    assert '2000 lines' in preview
+    assert assistant.results.get(handle) == text
+    # fetch_result output is never stored again
+    assert assistant._store_large_result('fetch_result', text) == text
+
+
+def test_fetch_result_pages_by_line(assistant):
+    handle = assistant.results.put(numbered(10))
+    page = assistant.fetch_result(handle, start_line=3, max_lines=4)
+    assert page == f"[{handle}: lines 3-6 of 10]\nline 3\nline 4\nline 5\nline 6\n[Use start_line=7 for more]"
+    last = assistant.fetch_result(handle, start_line=9, max_lines=4)
+    assert last == f"[{handle}: lines 9-10 of 10]\nline 9\nline 10"
+
+
+def test_fetch_result_past_the_end(assistant):
+    handle = assistant.results.put(numbered(10))
+    result = assistant.fetch_result(handle, start_line=11)
+    assert isinstance(result, ToolError)
+    assert 'only 10 lines' in result
+
+
+def test_fetch_result_filters_by_pattern(assistant):
+    handle = assistant.results.put(numbered(30))
+    result = assistant.fetch_result(handle, pattern=r'line 2\d')
+    assert result.splitlines() == [f"[{handle}: lines matching 'line 2\\d']"] + [
+        f"  Line {number}: line {number}" for number in range(20, 30)
+    ]
+    limited = assistant.fetch_result(handle, pattern='LINE 2', start_line=21, max_lines=2)
+    assert limited.splitlines()[1:] == [
+        '  Line 21: line 21', '  Line 22: line 22', '... more matches (use start_line=23)'
+    ]
+    assert assistant.fetch_result(handle, pattern='line 9(').startswith('No lines matching')
+
+
+def test_fetch_result_reads_spilled_results(assistant):
+    assistant.results.memory_limit = 10
+    handle = assistant.results.put(numbered(5))
+    assistant.results.put(numbered(5))
+    assert handle in assistant.results.spilled
+    assert assistant.fetch_result(handle, start_line=5) == f"[{handle}: lines 5-5 of 5]\nline 5"
+
+
+def test_fetch_result_unknown_handle(assistant):
+    result = assistant.fetch_result('result-99')
+    assert isinstance(result, ToolError)
+    assert 'Unknown result handle' in result
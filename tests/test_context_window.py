@@ -0,0 +1,42 @@
+"""Tests for the conversation's token budget."""
+
+from assistant import ContextWindow
+
+
+def history(*sizes):
+    messages = [{'role': 'user', 'content': 'question'}]
+    for size in sizes:
+        messages.append({'role': 'tool', 'tool_name': 'read_file', 'content': 'x' * size})
+    messages.append({'role': 'user', 'content': 'next question'})
+    return messages
+
+
+def test_whole_prompt_count_corrects_a_low_estimate():
+    context = ContextWindow()
+    messages = history(4000)
+    before = context.total(messages)
+    # Dense text: 2 characters per token, far below the default estimate
+    context.record_usage({'prompt_eval_count': 2000 + 4 * len(messages)}, {'content': ''}, messages)
+    assert context.chars_per_token < 2.1
+    assert context.total(messages) > 1.8 * before
+
+
+def test_cached_prompt_counts_do_not_lower_the_estimate():
+    context = ContextWindow()
+    messages = history(4000)
+    before = context.total(messages)
+    # Most of the prompt came from Ollama's cache and was not counted
+    context.record_usage({'prompt_eval_count': 50}, {'content': ''}, messages)
+    assert context.chars_per_token == 4.0
+    assert context.total(messages) == before
+
+
+def test_elided_results_keep_their_fetch_result_handle():
+    stored = 'head\n... [9000 characters omitted] ...\ntail\n\n[Full result stored as result-3: 900 lines, 9600 characters. Read it with fetch_result(...)]'
+    messages = history(8000, 8000)
+    messages[1]['content'] = stored
+    context = ContextWindow(max_tokens=2000, reserve_tokens=0)
+    assert context.fit(messages) > 0
+    assert messages[1]['content'].startswith(ContextWindow.ELIDED_PREFIX)
+    assert "fetch_result(handle='result-3')" in messages[1]['content']
+    assert 'Run the tool again' in messages[2]['content']
@@ -0,0 +1,83 @@
+"""Tests for diff parsing and edit matching."""
+
+import pytest
+
+from assistant import EditConflict, _find_block, apply_edit, parse_unified_diff
+
+DIFF = """\
+--- a/app.py
++++ b/app.py
+@@ -1,3 +1,3 @@
+ def greet(name):
+-    return "Hello " + name
++    return f"Hello {name}"
+ 
+@@ -10,2 +10,3 @@ def main():
+     greet("world")
++    greet("again")
+\\ No newline at end of file
+"""
+
+
+def test_parse_unified_diff_turns_hunks_into_edits():
+    edits = parse_unified_diff(DIFF)
+    assert edits == [
+        (
+            'def greet(name):\n    return "Hello " + name\n',
+            'def greet(name):\n    return f"Hello {name}"\n',
+            1,
+        ),
+        ('    greet("world")', '    greet("world")\n    greet("again")', 10),
+    ]
+
+
+def test_parse_unified_diff_without_hunks():
+    with pytest.raises(EditConflict):
+        parse_unified_diff('--- a/x\n+++ b/x\n')
+
+
+def test_parse_unified_diff_rejects_a_second_file():
+    second = "--- a/other.py\n+++ b/other.py\n@@ -1 +1 @@\n-x = 1\n+x = 2\n"
+    with pytest.raises(EditConflict, match='more than one file'):
+        parse_unified_diff(DIFF + second)
+    # Even when a header without its '+++' line follows a complete hunk
+    with pytest.raises(EditConflict, match='more than one file'):
+        parse_unified_diff("@@ -1 +1 @@\n-a\n+b\n--- a/other.py\n")
+
+
+def test_parse_unified_diff_keeps_removed_lines_that_look_like_headers():
+    edits = parse_unified_diff("@@ -1,2 +1,1 @@\n--- separator\n keep\n")
+    assert edits == [('-- separator\nkeep', 'keep', 1)]
+
+
+def test_find_block_exact_and_hint_breaks_ties():
+    lines = ['a', 'x', 'b', 'x', 'c']
+    assert _find_block(lines, ['b'], None) == (2, 'exact')
+    assert _find_block(lines, ['x'], 4) == (3, 'exact')
+    with pytest.raises(EditConflict, match='matches 2 places'):
+        _find_block(lines, ['x'], None)
+
+
+def test_find_block_ignores_surrounding_whitespace():
+    lines = ['def f():', '    return 1']
+    assert _find_block(lines, ['def f():', '  return 1  '], None) == (0, 'whitespace')
+
+
+def test_find_block_fuzzy_match():
+    lines = ['def total(items):', '    return sum(item.price for item in items)', '']
+    start, kind = _find_block(lines, ['def total(items):', '    return sum(i.price for i in items)'], None)
+    assert start == 0
+    assert kind.startswith('fuzzy')
+
+
+def test_find_block_missing():
+    with pytest.raises(EditConflict, match='not found'):
+        _find_block(['a', 'b'], ['something else entirely'], None)
+
+
+def test_apply_edit_reindents_a_fuzzy_match():
+    content = 'class A:\n    def f(self):\n        return 1\n'
+    new, line, kind = apply_edit(content, 'def f(self):\n    return 1', 'def f(self):\n    return 2')
+    assert new == 'class A:\n    def f(self):\n        return 2\n'
+    assert line == 2
+    assert kind == 'whitespace'
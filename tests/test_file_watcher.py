@@ -0,0 +1,105 @@
+"""Tests for the file watcher."""
+
+import os
+import queue
+import sys
+
+import pytest
+
+from assistant import FileWatcher
+
+TIMEOUT = 5.0
+
+
+@pytest.fixture
+def watch(tmp_path):
+    """Start a watcher on tmp_path; returns (watcher, queue of published batches)."""
+    watchers = []
+
+    def start(**kwargs):
+        batches = queue.Queue()
+        watcher = FileWatcher(str(tmp_path), poll_interval=0.05, coalesce=0.02, **kwargs)
+        watcher.subscribe(batches.put)
+        watchers.append(watcher.start())
+        # The first batch says anything may have changed during start-up
+        assert batches.get(timeout=TIMEOUT) is None
+        return watcher, batches
+
+    yield start
+    for watcher in watchers:
+        watcher.stop()
+
+
+def touch(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+    stamp = os.stat(path).st_mtime_ns + 10**9
+    os.utime(path, ns=(stamp, stamp))
+
+
+def test_polling_reports_created_modified_and_deleted_files(tmp_path, watch):
+    path = str(tmp_path / 'a.py')
+    watcher, batches = watch(use_inotify=False)
+    assert watcher.mode == 'polling'
+
+    touch(path, 'x = 1\n')
+    assert batches.get(timeout=TIMEOUT) == {path}
+    touch(path, 'x = 2\n')
+    assert batches.get(timeout=TIMEOUT) == {path}
+    os.remove(path)
+    assert batches.get(timeout=TIMEOUT) == {path}
+    assert watcher.stats()['batches'] == 4
+
+
+def test_polling_batches_changes_in_nested_directories(tmp_path, watch):
+    watcher, batches = watch(use_inotify=False)
+    nested = tmp_path / 'pkg' / 'sub'
+    nested.mkdir(parents=True)
+    paths = {str(nested / 'a.py'), str(tmp_path / 'pkg' / 'b.py')}
+    for path in paths:
+        touch(path, '')
+    received = set()
+    while received != paths:
+        received |= batches.get(timeout=TIMEOUT)
+    assert received == paths
+
+
+def test_polling_skips_ignored_directories_symlinks_and_fifos(tmp_path, watch):
+    watcher, batches = watch(use_inotify=False)
+    (tmp_path / 'node_modules').mkdir()
+    touch(str(tmp_path / 'node_modules' / 'lib.js'), '')
+    target = str(tmp_path / 'target.py')
+    os.symlink(target, str(tmp_path / 'link.py'))
+    if hasattr(os, 'mkfifo'):
+        os.mkfifo(str(tmp_path / 'pipe'))
+    touch(target, '')
+    # Only the regular file outside node_modules is reported
+    assert batches.get(timeout=TIMEOUT) == {target}
+    watcher.stop()
+    assert batches.empty()
+
+
+def test_stopped_watcher_publishes_nothing(tmp_path, watch):
+    watcher, batches = watch(use_inotify=False)
+    watcher.stop()
+    touch(str(tmp_path / 'a.py'), '')
+    assert watcher.flush() is False
+    with pytest.raises(queue.Empty):
+        batches.get(timeout=0.2)
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify is Linux-only')
+def test_inotify_flush_publishes_pending_changes_at_once(tmp_path, watch):
+    watcher, batches = watch()
+    if watcher.mode != 'inotify':
+        pytest.skip('inotify is unavailable')
+    path = str(tmp_path / 'a.py')
+    touch(path, 'x = 1\n')
+    os.mkdir(str(tmp_path / 'pkg'))
+    nested = str(tmp_path / 'pkg' / 'b.py')
+    touch(nested, '')
+    assert watcher.flush() is True
+    received = set()
+    while nested not in received:
+        received |= batches.get(timeout=TIMEOUT)
+    assert path in received
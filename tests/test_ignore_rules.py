@@ -0,0 +1,107 @@
+"""Tests for gitignore matching and the tree walker."""
+
+import os
+
+from assistant import IgnoreRules, TreeWalker, gitignore_regex
+
+
+def rules(*lines, base=''):
+    return IgnoreRules(base, list(lines))
+
+
+def test_plain_name_matches_at_any_depth():
+    ignore = rules('build')
+    assert ignore.match('build', True)
+    assert ignore.match('src/build', True)
+    assert ignore.match('src/build.py', False) is None
+
+
+def test_leading_or_inner_slash_anchors_to_the_ignore_file():
+    ignore = rules('/dist', 'docs/*.html')
+    assert ignore.match('dist', True)
+    assert ignore.match('pkg/dist', True) is None
+    assert ignore.match('docs/index.html', False)
+    assert ignore.match('pkg/docs/index.html', False) is None
+
+
+def test_wildcards():
+    ignore = rules('*.pyc', 'cache-?', '**/logs/**', '[ab]*.tmp')
+    assert ignore.match('a/b/c.pyc', False)
+    assert ignore.match('cache-1', True)
+    assert ignore.match('cache-12', True) is None
+    assert ignore.match('x/logs/today.txt', False)
+    assert ignore.match('apple.tmp', False)
+    assert ignore.match('cherry.tmp', False) is None
+
+
+def test_directory_only_rules_skip_files():
+    ignore = rules('out/')
+    assert ignore.match('out', True)
+    assert ignore.match('out', False) is None
+
+
+def test_last_matching_rule_wins_and_negation_reincludes():
+    ignore = rules('*.log', '!keep.log')
+    assert ignore.match('debug.log', False)
+    assert ignore.match('keep.log', False) is False
+
+
+def test_comments_blank_lines_and_escapes():
+    ignore = rules('# comment', '', r'\#hash', r'\!bang')
+    assert ignore.match('#hash', False)
+    assert ignore.match('!bang', False)
+    assert ignore.match('comment', False) is None
+
+
+def test_malformed_patterns_are_skipped():
+    ignore = rules('[z-a]', '*.log')
+    assert len(ignore.rules) == 1
+    assert ignore.match('debug.log', False)
+
+
+def test_listing_survives_a_malformed_pattern(assistant, make_tree):
+    assistant.working_directory = make_tree({'.gitignore': '[z-a]\n*.log\n', 'a.py': '', 'b.log': ''})
+    assert assistant.list_files() == 'a.py'
+
+
+def test_rules_of_a_subdirectory_only_apply_below_it():
+    ignore = rules('*.txt', base='docs/')
+    assert ignore.match('docs/a.txt', False)
+    assert ignore.match('a.txt', False) is None
+
+
+def test_negated_character_class():
+    assert gitignore_regex('[!a]') == '(?:.*/)?[^a]'
+
+
+def test_tree_walker_honors_nested_ignore_files(make_tree):
+    root = make_tree({
+        '.gitignore': 'build/\n*.log\n',
+        'src/main.py': '',
+        'src/debug.log': '',
+        'src/.gitignore': 'generated.py\n',
+        'src/generated.py': '',
+        'build/out.py': '',
+    })
+    walker = TreeWalker(root, root)
+    found = sorted(os.path.relpath(entry.path, root) for entry, _ in walker.walk())
+    # Hidden files, such as the ignore files themselves, are not listed
+    assert found == [os.path.join('src', 'main.py')]
+
+
+def test_tree_walker_includes_agrees_with_the_walk(make_tree):
+    files = {
+        '.gitignore': 'build/\n*.log\n',
+        'src/main.py': '',
+        'src/debug.log': '',
+        'src/.gitignore': 'generated.py\n',
+        'src/generated.py': '',
+        'build/out.py': '',
+        'node_modules/lib.py': '',
+    }
+    root = make_tree(files)
+    walker = TreeWalker(root, root)
+    included = [path for path in files if walker.includes(os.path.join(root, path))]
+    assert included == ['src/main.py']
+    assert not TreeWalker(root, root, extensions=['.txt']).includes(os.path.join(root, 'src/main.py'))
+    assert not walker.includes(os.path.join(os.path.dirname(root), 'elsewhere.py'))
@@ -0,0 +1,156 @@
+"""Tests for routing between the tool and answer models."""
+
+import pytest
+
+from assistant import ModelRouter
+
+TOOLS = [
+    {'function': {'name': 'read_file', 'parameters': {'required': ['file_path']}}},
+    {'function': {'name': 'list_files', 'parameters': {}}},
+]
+
+
+def turn(content=(), tool_calls=()):
+    return {'content': list(content), 'tool_calls': list(tool_calls), 'usage': {}}
+
+
+def call(name, arguments):
+    return {'function': {'name': name, 'arguments': arguments}}
+
+
+def chunk(content='', tool_calls=None, done=False):
+    message = {'role': 'assistant', 'content': content}
+    if tool_calls:
+        message['tool_calls'] = tool_calls
+    return {'message': message, 'done': done}
+
+
+class ScriptedClient:
+    """Stands in for ollama.Client, replying from a script per model."""
+
+    def __init__(self, replies):
+        self.replies = {model: list(chunks) for model, chunks in replies.items()}
+        self.requests = []
+        self.consumed = []
+
+    def chat(self, **arguments):
+        self.requests.append(arguments)
+        chunks = self.replies[arguments['model']].pop(0)
+        if not arguments['stream']:
+            return chunks[-1]
+        return self._stream(chunks)
+
+    def _stream(self, chunks):
+        for item in chunks:
+            self.consumed.append(item)
+            yield item
+
+
+def test_options_are_merged_per_phase():
+    router = ModelRouter('big', 'small', options={'tool': {'num_predict': 64}, 'answer': {'top_k': 5}})
+    assert router.options == {'tool': {'temperature': 0.2, 'num_predict': 64}, 'answer': {'top_k': 5}}
+    router = ModelRouter('big', 'small', options={'tool': {'temperature': 0.0}})
+    assert router.options['tool'] == {'temperature': 0.0}
+
+
+def test_unknown_phase_is_rejected():
+    with pytest.raises(ValueError, match="Unknown phase 'draft'"):
+        ModelRouter('big', 'small', options={'draft': {}})
+
+
+def test_request_merges_context_size_and_keep_alive():
+    router = ModelRouter('big', 'small', options={'tool': {'num_ctx': 4096, 'keep_alive': '1h'}})
+    assert router.request('tool', 32768, '5m') == {
+        'model': 'small',
+        'options': {'num_ctx': 4096, 'temperature': 0.2},
+        'keep_alive': '1h',
+    }
+    assert router.request('answer', 32768, '5m') == {
+        'model': 'big', 'options': {'num_ctx': 32768}, 'keep_alive': '5m'
+    }
+    # keep_alive is taken from a copy, not from the configured options
+    assert router.options['tool']['keep_alive'] == '1h'
+
+
+def test_phases_stop_using_the_tool_model_after_the_limit():
+    router = ModelRouter('big', 'small', max_tool_iterations=2)
+    assert router.phases(0) == ('tool', 'answer')
+    assert router.phases(1) == ('tool', 'answer')
+    assert router.phases(2) == ('answer',)
+    unrouted = ModelRouter('big')
+    assert not unrouted.enabled
+    assert unrouted.phases(0) == ('answer',)
+
+
+def test_review_keeps_complete_tool_calls():
+    kept = turn(['Reading it.'], [call('read_file', {'file_path': 'a.py'}), call('list_files', {})])
+    assert ModelRouter.review('tool', kept, TOOLS) is None
+
+
+@pytest.mark.parametrize('response, reason', [
+    (turn(['The answer is 4.']), 'no tool call'),
+    (turn(tool_calls=[call('delete_everything', {})]), 'unknown tool'),
+    (turn(tool_calls=[call('read_file', '{"file_path": "a.py"}')]), 'malformed arguments'),
+    (turn(tool_calls=[call('list_files', {}), call('read_file', {})]), 'missing arguments'),
+])
+def test_review_rejects_unusable_tool_phase_responses(response, reason):
+    assert ModelRouter.review('tool', response, TOOLS) == reason
+    assert ModelRouter.review('answer', response, TOOLS) is None
+
+
+def test_abandon_only_long_tool_phase_text():
+    preamble = 'x' * ModelRouter.TOOL_PREAMBLE_CHARS
+    assert not ModelRouter.abandon('tool', turn([preamble]))
+    assert ModelRouter.abandon('tool', turn([preamble, 'y']))
+    assert not ModelRouter.abandon('tool', turn([preamble, 'y'], [call('list_files', {})]))
+    assert not ModelRouter.abandon('answer', turn([preamble, 'y']))
+
+
+def test_rejected_responses_are_escalated_and_counted(assistant):
+    assistant.router = ModelRouter('big', 'small')
+    assistant.client = ScriptedClient({
+        'small': [
+            [chunk(tool_calls=[call('list_files', {})]), chunk(done=True)],
+            [chunk(tool_calls=[call('read_file', {})]), chunk(done=True)],
+            [chunk('Nothing'), chunk(done=True)],
+        ],
+        'big': [
+            [chunk(tool_calls=[call('list_files', {})]), chunk(done=True)],
+            [chunk('Nothing here.'), chunk(done=True)],
+        ],
+    })
+    assert assistant.chat('What is in this directory?', stream=True) == 'Nothing here.'
+    models = [request['model'] for request in assistant.client.requests]
+    # Kept tool call; rejected tool call and its escalation; rejected answer and its escalation
+    assert models == ['small', 'small', 'big', 'small', 'big']
+    routing = assistant.tracer.stats()['routing']
+    assert routing['escalations'] == {'missing arguments': 1, 'no tool call': 1}
+    assert routing['tool']['calls'] == 3
+    assert routing['answer']['calls'] == 2
+
+
+def test_plain_answer_from_the_tool_model_is_cut_off(assistant):
+    assistant.router = ModelRouter('big', 'small')
+    rambling = [chunk('word ' * 20) for _ in range(50)] + [chunk(done=True)]
+    assistant.client = ScriptedClient({
+        'small': [rambling],
+        'big': [[chunk('Short answer.'), chunk(done=True)]],
+    })
+    assert assistant.chat('Hello', stream=True) == 'Short answer.'
+    # Abandoned once its text passed the preamble allowance
+    tool_chunks = len(assistant.client.consumed) - 2
+    assert tool_chunks == ModelRouter.TOOL_PREAMBLE_CHARS // 100 + 1
+    assert assistant.tracer.stats()['routing']['escalations'] == {'no tool call': 1}
+    assert all(message['content'] != 'word ' * 20 for message in assistant.conversation_history)
+
+
+def test_tool_model_is_skipped_after_max_tool_iterations(assistant):
+    assistant.router = ModelRouter('big', 'small', max_tool_iterations=1)
+    listing = [chunk(tool_calls=[call('list_files', {})]), chunk(done=True)]
+    assistant.client = ScriptedClient({
+        'small': [listing],
+        'big': [listing, [chunk('Done.'), chunk(done=True)]],
+    })
+    assert assistant.chat('List twice', stream=True) == 'Done.'
+    assert [request['model'] for request in assistant.client.requests] == ['small', 'big', 'big']
+    assert 'escalations' not in assistant.tracer.stats()['routing']
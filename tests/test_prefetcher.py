@@ -0,0 +1,87 @@
+"""Tests for the speculative file prefetcher."""
+
+import os
+
+import pytest
+
+from assistant import Prefetcher, file_stamp
+
+TREE = {
+    'pkg/__init__.py': '',
+    'pkg/core.py': (
+        'import os\n'
+        'import pkg.models\n'
+        'from .helpers import slugify\n'
+        'from . import settings\n'
+        'from pkg.db import (connect,\n'
+        '    close)\n'
+    ),
+    'pkg/models.py': '',
+    'pkg/helpers.py': '',
+    'pkg/settings.py': '',
+    'pkg/db/__init__.py': '',
+    'tests/test_core.py': '',
+    'web/app.ts': "import { f } from './lib/f';\nconst g = require('../shared/g');\n",
+    'web/lib/f.ts': '',
+    'web/app.test.ts': '',
+    'shared/g.js': '',
+    'README.md': '# Project\n',
+    'node_modules/dep/index.js': '',
+}
+
+
+@pytest.fixture
+def root(make_tree):
+    return make_tree(TREE)
+
+
+def predicted(prefetcher, root, tool_name, arguments, result=''):
+    paths = prefetcher.predict(root, tool_name, arguments, result)
+    return [os.path.relpath(path, root).replace(os.sep, '/') for path in paths]
+
+
+def test_read_file_predicts_python_imports_and_tests(root):
+    paths = predicted(Prefetcher(), root, 'read_file', {'filepath': 'pkg/core.py'})
+    assert paths[:4] == ['pkg/models.py', 'pkg/helpers.py', 'pkg/__init__.py', 'pkg/settings.py']
+    assert 'pkg/db/__init__.py' in paths
+    assert paths[-1] == 'tests/test_core.py'
+    assert 'pkg/core.py' not in paths
+
+
+def test_read_file_predicts_script_imports_and_tests(root):
+    paths = predicted(Prefetcher(), root, 'read_file', {'filepath': 'web/app.ts'})
+    assert paths == ['web/lib/f.ts', 'shared/g.js', 'web/app.test.ts']
+
+
+def test_search_hits_and_listing_entry_points(root):
+    result = "\npkg/models.py:\n  Line 1: x\n\nnode_modules/dep/index.js:\n  Line 1: y"
+    assert predicted(Prefetcher(), root, 'search_code', {}, result) == ['pkg/models.py']
+    listing = "README.md\npkg/core.py\nnode_modules/dep/index.js"
+    assert predicted(Prefetcher(), root, 'list_files', {}, listing) == ['README.md']
+
+
+def test_prediction_is_capped(root):
+    assert len(predicted(Prefetcher(max_files=2), root, 'read_file', {'filepath': 'pkg/core.py'})) == 2
+
+
+def test_prefetched_file_is_served_until_it_changes(root):
+    prefetcher = Prefetcher()
+    prefetcher._prefetch(root, 'list_files', {}, 'README.md')
+    readme = os.path.join(root, 'README.md')
+
+    assert prefetcher.take(readme, file_stamp(readme)) == b'# Project\n'
+    assert prefetcher.take(readme, file_stamp(readme)) is None
+
+    prefetcher._prefetch(root, 'list_files', {}, 'README.md')
+    with open(readme, 'a') as f:
+        f.write('More\n')
+    assert prefetcher.take(readme, file_stamp(readme)) is None
+    stats = prefetcher.stats()
+    assert (stats['hits'], stats['misses'], stats['wasted']) == (1, 2, 1)
+
+
+def test_errors_are_not_prefetched(root):
+    prefetcher = Prefetcher()
+    prefetcher.schedule(root, 'list_files', {}, 'Error: Directory not found: x')
+    prefetcher.executor.shutdown(wait=True)
+    assert prefetcher.stats()['predicted'] == 0
@@ -0,0 +1,61 @@
+"""Tests for read_file's line ranges and limits."""
+
+import os
+
+import pytest
+
+
+@pytest.fixture
+def source(assistant):
+    path = os.path.join(assistant.working_directory, 'a.py')
+    with open(path, 'w') as f:
+        f.write(''.join(f'line {number}\n' for number in range(1, 11)))
+    return 'a.py'
+
+
+def test_whole_small_file_is_returned_as_is(assistant, source):
+    assert assistant.read_file(source).startswith('line 1\n')
+
+
+def test_line_range_has_header(assistant, source):
+    result = assistant.read_file(source, start_line=3, end_line=4)
+    assert result == '[a.py: lines 3-4 of 10; 8 lines not shown. Use start_line/end_line to read other parts]\nline 3\nline 4\n'
+
+
+def test_max_bytes_cuts_at_a_line_boundary(assistant, source):
+    result = assistant.read_file(source, max_bytes=14)
+    assert result.startswith('[a.py: lines 1-2 of 10;')
+    assert result.endswith('\nline 1\nline 2\n')
+
+
+def test_start_line_beyond_end_of_file_is_an_error(assistant, source):
+    assert assistant.read_file(source, start_line=50) == 'Error: start_line 50 beyond end of file (10 lines)'
+    assert assistant.read_file(source, start_line=0).startswith('Error: start_line must be at least 1')
+
+
+def test_non_positive_max_bytes_is_an_error(assistant, source):
+    assert assistant.read_file(source, max_bytes=0).startswith('Error: max_bytes must be positive')
+    assert assistant.read_file(source, max_bytes=-5).startswith('Error: max_bytes must be positive')
+
+
+def file_sections(result):
+    return result.rsplit('\n\n[Read ', 1)[0]
+
+
+def test_read_files_keeps_sections_within_the_byte_budget(assistant):
+    root = assistant.working_directory
+    with open(os.path.join(root, 'small.py'), 'w') as f:
+        f.write('x = 1\n')
+    for name in ('big.txt', 'wide.txt'):
+        with open(os.path.join(root, name), 'w', encoding='utf-8') as f:
+            f.write(''.join(f'héllo wörld {number} ✓\n' for number in range(400)))
+    budget = 2000
+    result = assistant.read_files(['*.py', '*.txt'], max_total_bytes=budget)
+    assert len(file_sections(result).encode('utf-8')) <= budget
+    assert '===== small.py =====\nx = 1\n' in result
+    assert result.count('lines not shown') == 2
+    assert '2 truncated to fit the 2000 byte budget' in result
+
+
+def test_read_files_rejects_non_positive_budget(assistant, source):
+    assert assistant.read_files([source], max_total_bytes=0).startswith('Error: max_total_bytes')
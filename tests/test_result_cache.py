@@ -0,0 +1,118 @@
+"""Tests for the tool result cache."""
+
+import os
+
+from assistant import ToolResultCache
+
+
+def cached(cache, key, paths):
+    cache.put(key, 'result', cache.stamp(paths))
+
+
+def test_entry_is_served_while_inputs_are_unchanged(tmp_path):
+    path = tmp_path / 'a.py'
+    path.write_text('x = 1\n')
+    cache = ToolResultCache()
+    cached(cache, ('read', str(path)), [str(path)])
+    assert cache.get(('read', str(path))) == 'result'
+    assert cache.stats()['hits'] == 1
+
+
+def test_changed_input_invalidates_entry(tmp_path):
+    path = tmp_path / 'a.py'
+    path.write_text('x = 1\n')
+    cache = ToolResultCache()
+    cached(cache, ('read', str(path)), [str(path)])
+    path.write_text('x = 22\n')
+    assert cache.get(('read', str(path))) is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_invalidate_path_drops_file_and_parent_listings(tmp_path):
+    directory = tmp_path / 'pkg'
+    directory.mkdir()
+    path = directory / 'a.py'
+    other = tmp_path / 'b.py'
+    for file in (path, other):
+        file.write_text('')
+    cache = ToolResultCache()
+    cached(cache, ('read', 'a'), [str(path)])
+    cached(cache, ('list', 'root'), [str(tmp_path)])
+    cached(cache, ('read', 'b'), [str(other)])
+
+    cache.invalidate(str(path))
+    assert cache.get(('read', 'a')) is None
+    assert cache.get(('list', 'root')) is None
+    assert cache.get(('read', 'b')) == 'result'
+    assert cache.stats()['invalidations'] == 2
+
+
+def test_invalidate_everything():
+    cache = ToolResultCache()
+    cache.put(('search', 1), 'result', {})
+    cache.invalidate()
+    assert cache.get(('search', 1)) is None
+    assert cache.stats()['bytes'] == 0
+
+
+def test_size_bound_evicts_least_recently_used():
+    cache = ToolResultCache(max_bytes=40)
+    for key in 'abcd':
+        cache.put((key,), 'x' * 10, {})
+    cache.get(('a',))
+    cache.put(('e',), 'x' * 10, {})
+    assert cache.get(('b',)) is None
+    assert cache.get(('a',)) is not None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_oversized_results_are_not_cached():
+    cache = ToolResultCache(max_bytes=40)
+    cache.put(('big',), 'x' * 11, {})
+    assert cache.get(('big',)) is None
+
+
+def test_size_counts_utf8_bytes():
+    cache = ToolResultCache(max_bytes=40)
+    cache.put(('ascii',), 'x' * 10, {})
+    assert cache.stats()['bytes'] == 10
+    # Ten characters, but 30 bytes: over a quarter of the limit
+    cache.put(('wide',), '\u20ac' * 10, {})
+    assert cache.get(('wide',)) is None
+    cache.put(('narrow',), '\u20ac' * 3, {})
+    assert cache.stats()['bytes'] == 19
+    cache.invalidate()
+    assert cache.stats()['bytes'] == 0
+
+
+def test_missing_input_is_stamped_as_none(tmp_path):
+    path = str(tmp_path / 'later.py')
+    cache = ToolResultCache()
+    cached(cache, ('read', path), [path])
+    assert cache.get(('read', path)) == 'result'
+    with open(path, 'w') as f:
+        f.write('')
+    assert os.path.exists(path)
+    assert cache.get(('read', path)) is None
+
+
+def test_cached_tool_results_follow_edits_to_the_files_they_show(assistant):
+    path = os.path.join(assistant.working_directory, 'a.py')
+    with open(path, 'w') as f:
+        f.write('needle = 1\n')
+    assert 'needle = 1' in assistant.search_code('needle')
+    with open(path, 'w') as f:
+        f.write('needle = 22\n')
+    stamp = os.stat(path).st_mtime_ns + 10**9
+    os.utime(path, ns=(stamp, stamp))
+    assert 'needle = 22' in assistant.search_code('needle')
+
+
+def test_cached_listing_sees_new_files(assistant):
+    root = assistant.working_directory
+    open(os.path.join(root, 'a.py'), 'w').close()
+    assert 'b.py' not in assistant.list_files()
+    open(os.path.join(root, 'b.py'), 'w').close()
+    stamp = os.stat(root).st_mtime_ns + 10**9
+    os.utime(root, ns=(stamp, stamp))
+    assert 'b.py' in assistant.list_files()
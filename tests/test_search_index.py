@@ -0,0 +1,99 @@
+"""Tests for the trigram search index."""
+
+import os
+import time
+
+import pytest
+
+import assistant as assistant_module
+from assistant import SearchIndex
+
+
+@pytest.fixture
+def index(make_tree):
+    root = make_tree({'a.py': 'def alpha():\n    pass\n', 'b.txt': 'beta gamma\n'})
+    return SearchIndex(root)
+
+
+def write(index, relpath, content):
+    path = os.path.join(index.root, relpath)
+    with open(path, 'w') as f:
+        f.write(content)
+    stamp = os.stat(path).st_mtime_ns + 10**9
+    os.utime(path, ns=(stamp, stamp))
+
+
+def test_candidates_narrow_down_by_trigrams(index):
+    assert index.candidates(['alpha']) == ['a.py']
+    assert index.candidates(['GAMMA']) == ['b.txt']
+    assert index.candidates(['alpha', 'gamma']) == ['a.py', 'b.txt']
+    assert index.candidates([r'def \w+\(\)'], regex=True) == ['a.py']
+
+
+def test_unwatched_index_sees_outside_edits_on_next_use(index, monkeypatch):
+    index.update()
+    monkeypatch.setattr(SearchIndex, 'RESCAN_MIN_INTERVAL', 0)
+    write(index, 'c.py', 'delta = 1\n')
+    write(index, 'b.txt', 'epsilon\n')
+    assert index.candidates(['delta']) == ['c.py']
+    assert index.candidates(['epsilon']) == ['b.txt']
+
+
+def test_slow_scans_wait_for_the_refresh_interval(index, monkeypatch):
+    index.update()
+    monkeypatch.setattr(SearchIndex, 'RESCAN_MIN_INTERVAL', 0)
+    index.scan_seconds = SearchIndex.RESCAN_CHEAP_SECONDS
+    write(index, 'c.py', 'delta = 1\n')
+    assert index.candidates(['delta']) == []
+    index.refresh_interval = 0
+    assert index.candidates(['delta']) == ['c.py']
+
+
+def test_watched_index_only_rechecks_reported_files(index, monkeypatch):
+    index.update()
+    index.watched = True
+    monkeypatch.setattr(SearchIndex, 'RESCAN_MIN_INTERVAL', 0)
+    write(index, 'c.py', 'delta = 1\n')
+    assert index.candidates(['delta']) == []
+    index.invalidate(os.path.join(index.root, 'c.py'))
+    assert index.candidates(['delta']) == ['c.py']
+
+
+def test_generation_changes_only_with_content(index):
+    generation = index.update()
+    assert index.update() == generation
+    write(index, 'a.py', 'def alpha2():\n    pass\n')
+    index.invalidate(os.path.join(index.root, 'a.py'))
+    assert index.update() == generation + 1
+
+
+def test_changes_are_saved_once_after_the_delay(index, monkeypatch):
+    monkeypatch.setattr(assistant_module, 'INDEX_SAVE_DELAY', 0.2)
+    saves = []
+    dump = index._dump
+    monkeypatch.setattr(index, '_dump', lambda: saves.append(1) or dump())
+    index.update()
+    index.watched = True
+    for number in range(5):
+        write(index, 'a.py', f'value_{number} = 1\n')
+        index.invalidate(os.path.join(index.root, 'a.py'))
+        index.update()
+    assert saves == []
+    assert not os.path.exists(index.index_path)
+    deadline = time.monotonic() + 5
+    while not saves and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert saves == [1]
+    assert not index.unsaved
+    assert SearchIndex(index.root).candidates(['value_4']) == ['a.py']
+
+
+def test_save_writes_pending_changes_at_once(index, monkeypatch):
+    monkeypatch.setattr(assistant_module, 'INDEX_SAVE_DELAY', 60)
+    index.update()
+    index.save()
+    assert index._save_timer is None
+    reloaded = SearchIndex(index.root)
+    with reloaded.lock:
+        reloaded._load()
+    assert sorted(reloaded.files) == ['a.py', 'b.txt']
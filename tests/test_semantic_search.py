@@ -0,0 +1,144 @@
+"""Tests for the embedding index and the semantic_search tool."""
+
+import os
+
+import pytest
+
+pytest.importorskip('numpy')
+
+import assistant as assistant_module
+from assistant import EmbeddingIndex, HashEmbeddings, SymbolIndex
+
+SOURCES = {
+    'billing/invoice.py': (
+        'def compute_invoice_total(items):\n'
+        '    """Sum the price of every invoice line item."""\n'
+        '    return sum(item.price for item in items)\n'
+    ),
+    'auth/login.py': (
+        'def check_user_password(user, password):\n'
+        '    """Verify the login password of a user."""\n'
+        '    return user.password_hash == hash(password)\n'
+    ),
+    'web/invoice_page.js': (
+        'function renderInvoicePage(invoice) {\n'
+        '  return invoice.total;\n'
+        '}\n'
+    ),
+}
+
+
+class CountingEmbeddings(HashEmbeddings):
+    """HashEmbeddings that remembers how many texts it embedded."""
+
+    def __init__(self):
+        super().__init__()
+        self.texts = 0
+
+    def embed(self, texts):
+        self.texts += len(texts)
+        return super().embed(texts)
+
+
+def touch(path, content):
+    """Rewrite a file with a later mtime than before."""
+    before = os.stat(path).st_mtime_ns
+    with open(path, 'w') as f:
+        f.write(content)
+    os.utime(path, ns=(before + 10**9, before + 10**9))
+
+
+def test_build_embeds_every_definition(make_tree):
+    index = EmbeddingIndex(SymbolIndex(make_tree(SOURCES)), HashEmbeddings())
+    index.update()
+
+    titles = {chunk[3] for chunk in index.chunks if chunk is not None}
+    assert 'function compute_invoice_total' in titles
+    assert 'function check_user_password' in titles
+    assert 'function renderInvoicePage' in titles
+    assert index.pending == 0
+
+
+def test_search_ranks_the_matching_definition_first(make_tree):
+    index = EmbeddingIndex(SymbolIndex(make_tree(SOURCES)), HashEmbeddings())
+    index.update()
+
+    assert index.search('verify user password')[0][1] == os.path.join('auth', 'login.py')
+    assert index.search('compute invoice total price')[0][1] == os.path.join('billing', 'invoice.py')
+
+
+def test_search_honors_file_pattern(make_tree):
+    index = EmbeddingIndex(SymbolIndex(make_tree(SOURCES)), HashEmbeddings())
+    index.update()
+
+    results = index.search('invoice total', limit=5, file_pattern='*.js')
+    assert results
+    assert all(relpath.endswith('.js') for _, relpath, _, _, _ in results)
+
+
+def test_update_embeds_only_changed_files(make_tree):
+    root = make_tree(SOURCES)
+    backend = CountingEmbeddings()
+    index = EmbeddingIndex(SymbolIndex(root), backend)
+    generation = index.update()
+    embedded = backend.texts
+
+    login = os.path.join(root, 'auth', 'login.py')
+    touch(login, 'def reset_forgotten_password(user):\n    return None\n')
+    index.symbols.invalidate(login)
+    assert index.update() == generation + 1
+    assert backend.texts == embedded + 1
+
+    titles = {chunk[3] for chunk in index.chunks if chunk is not None}
+    assert 'function reset_forgotten_password' in titles
+    assert 'function check_user_password' not in titles
+
+
+def test_update_drops_removed_files(make_tree):
+    root = make_tree(SOURCES)
+    index = EmbeddingIndex(SymbolIndex(root), HashEmbeddings())
+    index.update()
+
+    os.remove(os.path.join(root, 'web', 'invoice_page.js'))
+    index.symbols.invalidate()
+    index.update()
+    assert all(chunk[0] != os.path.join('web', 'invoice_page.js') for chunk in index.chunks if chunk)
+
+
+def many_sources(count):
+    """More one-function files than fit into one embedding batch."""
+    return {
+        f'module_{i}.py': f'def handler_{i}(request):\n    return request\n'
+        for i in range(count)
+    }
+
+
+def test_time_limit_embeds_one_batch_and_leaves_the_rest_pending(make_tree):
+    files = assistant_module.EMBED_BATCH_SIZE + 8
+    index = EmbeddingIndex(SymbolIndex(make_tree(many_sources(files))), HashEmbeddings())
+    index.update(seconds=0)
+    assert index.pending == 8
+    assert index.search('handler request')
+
+    index.update_in_background()
+    index._updater.join(10)
+    assert index.pending == 0
+    assert index.search('invoice')
+
+
+def test_semantic_search_tool(assistant, make_tree):
+    assistant.working_directory = make_tree(SOURCES)
+
+    result = assistant.semantic_search('verify user password', limit=1)
+    assert result.startswith(os.path.join('auth', 'login.py') + ':1-3')
+    assert 'similarity' in result
+
+
+def test_semantic_search_answers_from_a_partial_index(assistant, make_tree, monkeypatch):
+    assistant.working_directory = make_tree(many_sources(assistant_module.EMBED_BATCH_SIZE + 8))
+    monkeypatch.setattr(assistant_module, 'SEMANTIC_INDEX_SECONDS', 0)
+
+    assert 'Still embedding: 8 file(s)' in assistant.semantic_search('handler')
+
+    assistant.embedding_index._updater.join(10)
+    assert 'Still embedding' not in assistant.semantic_search('handler')
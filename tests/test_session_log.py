@@ -0,0 +1,72 @@
+"""Tests for the on-disk session log."""
+
+import importlib.util
+import os
+
+import pytest
+
+from assistant import SessionLog
+
+COMPRESSIONS = [None, 'gzip'] + (['zstd'] if importlib.util.find_spec('zstandard') else [])
+
+MESSAGES = [
+    {'role': 'user', 'content': 'List the files'},
+    {'role': 'assistant', 'content': '', 'tool_calls': [{'function': {'name': 'list_files', 'arguments': {}}}]},
+    {'role': 'tool', 'content': 'a.py\nb.py'},
+    {'role': 'assistant', 'content': 'There are two files.'},
+]
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+def test_round_trip(compression):
+    log = SessionLog.create('abc123', compression, working_directory='/work')
+    for message in MESSAGES:
+        log.append(message)
+    log.append_directory('/elsewhere')
+    log.append_blob('result-1', 'x' * 5000)
+    log.close()
+
+    header, messages, blobs, end = SessionLog.open(log.path).load()
+    assert header['id'] == 'abc123'
+    assert header['working_directory'] == '/elsewhere'
+    assert messages == MESSAGES
+    assert end == os.path.getsize(log.path)
+    assert log.read_blob(*blobs['result-1']) == 'x' * 5000
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+def test_torn_tail_is_ignored_and_truncated(compression):
+    log = SessionLog.create('torn', compression)
+    for message in MESSAGES:
+        log.append(message)
+    log.close()
+    complete = os.path.getsize(log.path)
+    with open(log.path, 'ab') as f:
+        f.write(log._compress(b'{"type": "message", "message": {"role": "user"}}\n')[:-3])
+
+    reopened = SessionLog.open(log.path)
+    _, messages, _, end = reopened.load()
+    assert messages == MESSAGES
+    assert end == complete
+
+    reopened.truncate(end)
+    reopened.append({'role': 'user', 'content': 'Next question'})
+    reopened.close()
+    assert SessionLog.open(log.path).load()[1][-1]['content'] == 'Next question'
+
+
+def test_find_and_list_sessions():
+    for session_id in ('aaa111', 'aab222'):
+        log = SessionLog.create(session_id)
+        log.append({'role': 'user', 'content': f'prompt of {session_id}'})
+        log.close()
+
+    assert SessionLog.find('aaa').endswith('aaa111.jsonl')
+    assert SessionLog.find('aa') is None
+    prompts = {session['id']: session['prompt'] for session in SessionLog.sessions()}
+    assert prompts == {'aaa111': 'prompt of aaa111', 'aab222': 'prompt of aab222'}
+
+
+def test_unknown_compression():
+    with pytest.raises(ValueError):
+        SessionLog('x.jsonl', 'lz4')
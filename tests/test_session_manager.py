@@ -0,0 +1,86 @@
+"""Tests for the concurrency limits of SessionManager."""
+
+import asyncio
+
+import pytest
+
+from assistant import SessionManager
+
+
+class FakeAsyncClient:
+    """Streams a fixed answer slowly and records how many requests overlap."""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.active = 0
+        self.peak = 0
+        self.requests = 0
+
+    async def chat(self, **arguments):
+        self.requests += 1
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+
+        async def stream():
+            try:
+                for word in ('Hello', ' there'):
+                    await asyncio.sleep(self.delay)
+                    yield {'message': {'role': 'assistant', 'content': word}, 'done': False}
+                yield {'message': {'role': 'assistant', 'content': ''}, 'done': True, 'eval_count': 2}
+            finally:
+                self.active -= 1
+
+        return stream()
+
+
+def manager(**kwargs):
+    instance = SessionManager('test-model', **kwargs)
+    instance.client = FakeAsyncClient()
+    return instance
+
+
+def test_session_limit():
+    sessions = manager(max_sessions=2)
+    sessions.create_session()
+    session_id = sessions.create_session()
+    with pytest.raises(RuntimeError):
+        sessions.create_session()
+    sessions.close_session(session_id)
+    sessions.create_session()
+
+
+def test_sessions_talk_to_the_managers_host():
+    sessions = manager(host='http://ollama.example:11500')
+    session = sessions.sessions[sessions.create_session()]
+    assert session.host == 'http://ollama.example:11500'
+    assert str(session.embedding_backend.client._client.base_url) == 'http://ollama.example:11500'
+
+
+def test_unknown_working_directory(tmp_path):
+    with pytest.raises(ValueError):
+        manager().create_session(str(tmp_path / 'missing'))
+
+
+def test_model_requests_are_bounded_across_sessions():
+    sessions = manager(max_concurrent_requests=2)
+
+    async def run():
+        ids = [sessions.create_session() for _ in range(6)]
+        return await asyncio.gather(*(sessions.chat(session_id, 'Hi') for session_id in ids))
+
+    assert asyncio.run(run()) == ['Hello there'] * 6
+    assert sessions.client.requests == 6
+    assert sessions.client.peak == 2
+
+
+def test_messages_to_one_session_are_serialized():
+    sessions = manager(max_concurrent_requests=4)
+
+    async def run():
+        session_id = sessions.create_session()
+        await asyncio.gather(*(sessions.chat(session_id, f'Question {i}') for i in range(3)))
+        return sessions.sessions[session_id].conversation_history
+
+    history = asyncio.run(run())
+    assert sessions.client.peak == 1
+    assert [message['role'] for message in history] == ['user', 'assistant'] * 3
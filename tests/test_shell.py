@@ -0,0 +1,93 @@
+"""Tests for the persistent shell that runs commands."""
+
+import pytest
+
+from assistant import OutputBuffer, ShellSession, _ShellStream
+
+SENTINEL = b'__sentinel__'
+
+
+@pytest.fixture
+def shell(tmp_path):
+    session = ShellSession()
+    yield lambda command, timeout=10, **kwargs: session.run(command, str(tmp_path), timeout, **kwargs)
+    session.close()
+
+
+def test_environment_carries_over(shell):
+    assert shell('export GREETING=hello') == ('', '', 0, None)
+    assert shell('echo "$GREETING"') == ('hello\n', '', 0, None)
+
+
+def test_each_command_starts_in_the_working_directory(shell, tmp_path):
+    shell('cd /')
+    assert shell('pwd')[0] == f'{tmp_path}\n'
+
+
+def test_exit_status_and_stderr(shell):
+    stdout, stderr, status, note = shell('echo out; echo err >&2; false')
+    assert (stdout, stderr, status, note) == ('out\n', 'err\n', 1, None)
+
+
+def test_output_without_trailing_newline(shell):
+    assert shell('printf abc') == ('abc', '', 0, None)
+
+
+def test_timeout_restarts_the_shell(shell):
+    shell('export KEPT=yes')
+    stdout, _, status, note = shell('echo started; sleep 5', timeout=0.5)
+    assert stdout == 'started\n'
+    assert status is None
+    assert note.startswith('Error: Command timed out after 0.5 seconds')
+    assert shell('echo "${KEPT:-reset}"')[0] == 'reset\n'
+
+
+def test_exit_reports_and_restarts(shell):
+    stdout, _, status, note = shell('echo bye; exit 3')
+    assert stdout == 'bye\n'
+    assert status == 3
+    assert note == 'Note: The shell exited with code 3 and will be restarted'
+    assert shell('echo again') == ('again\n', '', 0, None)
+
+
+def test_large_output_keeps_head_and_tail(shell):
+    lines = []
+    stdout, _, status, _ = shell('seq 1 100000', on_output=lambda stream, line: lines.append(line))
+    assert status == 0
+    assert stdout.startswith('1\n2\n3\n')
+    assert stdout.endswith('\n99999\n100000\n')
+    assert 'characters omitted' in stdout
+    assert len(stdout) < 40 * 1024
+    # The callback still sees every line
+    assert len(lines) == 100000 and lines[-1] == '100000'
+
+
+def test_output_buffer_counts_what_it_omits():
+    buffer = OutputBuffer(head_chars=10, tail_chars=10)
+    for number in range(100):
+        buffer.write(f'{number:03d}\n')
+    value = buffer.getvalue()
+    head, rest = value.split('\n... [', 1)
+    omitted, tail = rest.split(' characters omitted] ...\n')
+    assert head == '000\n001\n00'
+    assert tail == '098\n099\n'
+    assert len(head) + int(omitted) + len(tail) == 400
+
+
+def test_stream_finds_a_sentinel_split_across_reads():
+    lines = []
+    stream = _ShellStream('stdout', lambda name, line: lines.append(line))
+    assert stream.feed(b'hello\npartial', SENTINEL) is None
+    assert stream.feed(b' line__senti', SENTINEL) is None
+    assert stream.feed(b'nel__ 7', SENTINEL) is None  # waits for the end of the line
+    assert stream.feed(b'\n', SENTINEL) == '7'
+    assert stream.finished
+    assert stream.buffer.getvalue() == 'hello\npartial line'
+    assert lines == ['hello', 'partial line']
+
+
+def test_stream_decodes_characters_split_across_reads():
+    stream = _ShellStream('stdout', None)
+    stream.feed('caf'.encode() + b'\xc3', SENTINEL)
+    stream.feed(b'\xa9\n' + SENTINEL + b' 0\n', SENTINEL)
+    assert stream.buffer.getvalue() == 'café\n'
@@ -0,0 +1,113 @@
+"""Tests for the symbol index."""
+
+import os
+
+import pytest
+
+import assistant as assistant_module
+from assistant import SearchIndex, SymbolIndex
+
+
+@pytest.fixture
+def index(make_tree):
+    root = make_tree({'a.py': 'def alpha():\n    pass\n'})
+    return SymbolIndex(root)
+
+
+def write(index, relpath, content):
+    path = os.path.join(index.root, relpath)
+    with open(path, 'w') as f:
+        f.write(content)
+    stamp = os.stat(path).st_mtime_ns + 10**9
+    os.utime(path, ns=(stamp, stamp))
+
+
+def names(matches):
+    return [(relpath, definition[4]) for relpath, definition in matches]
+
+
+def test_definitions_are_found_by_plain_and_qualified_name(index):
+    write(index, 'b.py', 'class Parser:\n    def parse(self):\n        pass\n')
+    assert names(index.definitions('alpha')) == [('a.py', 'alpha')]
+    assert names(index.definitions('Parser.parse')) == [('b.py', 'Parser.parse')]
+
+
+def test_unwatched_index_sees_outside_edits_on_next_use(index, monkeypatch):
+    index.update()
+    monkeypatch.setattr(SymbolIndex, 'RESCAN_MIN_INTERVAL', 0)
+    write(index, 'c.py', 'def gamma():\n    pass\n')
+    assert names(index.definitions('gamma')) == [('c.py', 'gamma')]
+
+
+def test_slow_scans_wait_for_the_refresh_interval(index, monkeypatch):
+    index.update()
+    monkeypatch.setattr(SymbolIndex, 'RESCAN_MIN_INTERVAL', 0)
+    index.scan_seconds = SymbolIndex.RESCAN_CHEAP_SECONDS
+    write(index, 'c.py', 'def gamma():\n    pass\n')
+    assert index.definitions('gamma') == []
+    index.refresh_interval = 0
+    assert names(index.definitions('gamma')) == [('c.py', 'gamma')]
+
+
+def test_tuple_unpacking_defines_each_name(index):
+    write(index, 'c.py', 'first, (second, *rest) = 1, (2, 3)\n[left, right] = 4, 5\n')
+    assert [definition[0] for definition in index.snapshot()['c.py'][2]] == [
+        'first', 'second', 'rest', 'left', 'right'
+    ]
+
+
+def test_outline_keeps_ignored_files_out_of_the_index(index):
+    index.update()
+    write(index, '.gitignore', 'build/\n')
+    os.mkdir(os.path.join(index.root, 'build'))
+    write(index, 'build/gen.py', 'def generated():\n    pass\n')
+    assert index.outline(os.path.join('build', 'gen.py')) is None
+    assert index.definitions('generated') == []
+    assert [definition[0] for definition in index.outline('a.py')] == ['alpha']
+
+
+def test_file_outline_parses_ignored_files_directly(assistant):
+    root = assistant.working_directory
+    assistant.symbol_index.update()
+    with open(os.path.join(root, '.gitignore'), 'w') as f:
+        f.write('build/\n')
+    os.mkdir(os.path.join(root, 'build'))
+    with open(os.path.join(root, 'build', 'gen.py'), 'w') as f:
+        f.write('class Generated:\n    value = 1\n')
+    result = assistant.file_outline('build/gen.py')
+    assert 'class Generated' in result
+    assert 'variable Generated.value' in result
+    assert assistant.find_definition('Generated').startswith('No definition found')
+
+
+def test_watched_index_never_parses_ignored_files(index):
+    index.update()
+    index.watched = True
+    write(index, '.gitignore', 'build/\n')
+    index.invalidate(os.path.join(index.root, '.gitignore'))
+    index.update()
+    os.mkdir(os.path.join(index.root, 'build'))
+    for relpath in (os.path.join('build', 'gen.py'), '.hidden.py'):
+        write(index, relpath, 'def generated():\n    pass\n')
+        index.invalidate(os.path.join(index.root, relpath))
+    assert index.definitions('generated') == []
+    write(index, 'c.py', 'def generated():\n    pass\n')
+    index.invalidate(os.path.join(index.root, 'c.py'))
+    assert names(index.definitions('generated')) == [('c.py', 'generated')]
+
+
+def test_watched_index_drops_files_when_ignore_rules_change(index):
+    index.update()
+    index.watched = True
+    write(index, '.gitignore', 'a.py\n')
+    index.invalidate(os.path.join(index.root, '.gitignore'))
+    assert index.definitions('alpha') == []
+
+
+def test_saved_index_is_reused_without_parsing(index, monkeypatch):
+    index.update()
+    index.save()
+    reloaded = SymbolIndex(index.root)
+    monkeypatch.setattr(assistant_module, 'parse_symbols_file', lambda path: pytest.fail(f"parsed {path}"))
+    assert names(reloaded.definitions('alpha')) == [('a.py', 'alpha')]
+    assert reloaded.index_path != SearchIndex(index.root).index_path
@@ -0,0 +1,143 @@
+"""Tests for running the tool calls of one turn concurrently."""
+
+import threading
+import time
+
+import pytest
+
+
+class Recorder:
+    """Stands in for execute_tool, recording when each call starts and ends."""
+
+    def __init__(self, delays=None, failing=()):
+        self.delays = delays or {}
+        self.failing = failing
+        self.events = []
+        self.lock = threading.Lock()
+
+    def __call__(self, name, arguments):
+        label = arguments['label']
+        with self.lock:
+            self.events.append(('start', label))
+        time.sleep(self.delays.get(label, 0.01))
+        with self.lock:
+            self.events.append(('end', label))
+        if label in self.failing:
+            raise RuntimeError(f"{label} failed")
+        return f"result of {label}"
+
+    def index(self, kind, label):
+        return self.events.index((kind, label))
+
+
+@pytest.fixture
+def recorder(assistant, monkeypatch):
+    recorder = Recorder()
+    monkeypatch.setattr(assistant, 'execute_tool', recorder)
+    return recorder
+
+
+def call(name, label, **arguments):
+    return (name, dict(arguments, label=label))
+
+
+def test_independent_reads_overlap(assistant, recorder):
+    recorder.delays = {'a': 0.2, 'b': 0.2}
+    results = assistant.execute_tool_calls([
+        call('read_file', 'a', filepath='a.py'),
+        call('search_code', 'b', query='x'),
+    ])
+    assert results == ['result of a', 'result of b']
+    assert recorder.index('start', 'b') < recorder.index('end', 'a')
+
+
+def test_write_waits_for_an_earlier_read_of_the_same_file(assistant, recorder):
+    recorder.delays = {'read': 0.2}
+    assistant.execute_tool_calls([
+        call('read_file', 'read', filepath='a.py'),
+        call('write_file', 'write', filepath='a.py', content=''),
+        call('read_file', 'other', filepath='b.py'),
+    ])
+    assert recorder.index('start', 'write') > recorder.index('end', 'read')
+    # A file the write does not touch is read right away
+    assert recorder.index('start', 'other') < recorder.index('end', 'read')
+
+
+def test_write_waits_for_a_listing_of_its_directory(assistant, recorder):
+    recorder.delays = {'list': 0.2}
+    assistant.execute_tool_calls([
+        call('list_files', 'list', directory='src'),
+        call('edit_file', 'edit', filepath='src/a.py'),
+    ])
+    assert recorder.index('start', 'edit') > recorder.index('end', 'list')
+
+
+def test_commands_serialize_against_everything(assistant, recorder):
+    recorder.delays = {'read': 0.15, 'command': 0.15}
+    assistant.execute_tool_calls([
+        call('read_file', 'read', filepath='a.py'),
+        call('execute_command', 'command', command='make'),
+        call('read_file', 'after', filepath='b.py'),
+    ])
+    assert recorder.index('start', 'command') > recorder.index('end', 'read')
+    assert recorder.index('start', 'after') > recorder.index('end', 'command')
+
+
+def test_results_keep_call_order(assistant, recorder):
+    recorder.delays = {'slow': 0.2, 'fast': 0.01}
+    results = assistant.execute_tool_calls([
+        call('read_file', 'slow', filepath='a.py'),
+        call('read_file', 'fast', filepath='b.py'),
+    ])
+    assert recorder.index('end', 'fast') < recorder.index('end', 'slow')
+    assert results == ['result of slow', 'result of fast']
+
+
+def test_failing_dependency_does_not_block_its_dependents(assistant, recorder):
+    recorder.failing = {'read'}
+    results = assistant.execute_tool_calls([
+        call('read_file', 'read', filepath='a.py'),
+        call('write_file', 'write', filepath='a.py', content=''),
+    ])
+    assert results[0] == 'Error executing tool read_file: read failed'
+    assert results[1] == 'result of write'
+    assert recorder.index('start', 'write') > recorder.index('end', 'read')
+
+
+def test_tool_conflicts(assistant):
+    conflict = assistant._tool_calls_conflict
+    read = ('read_file', {'filepath': 'a.py'})
+    assert not conflict(read, ('search_code', {'query': 'x'}))
+    assert conflict(read, ('write_file', {'filepath': 'a.py'}))
+    assert not conflict(read, ('write_file', {'filepath': 'b.py'}))
+    assert conflict(('write_file', {'filepath': 'src/a.py'}), ('list_files', {'directory': 'src'}))
+    assert conflict(('write_file', {'filepath': 'a.py'}), ('search_code', {'query': 'x'}))
+    assert conflict(read, ('execute_command', {'command': 'ls'}))
+    assert conflict(read, ('unknown_tool', {}))
+
+
+def test_async_calls_follow_the_same_rules(make_tree):
+    import asyncio
+
+    from assistant import AsyncQwenCodeAssistant, HashEmbeddings
+
+    session = AsyncQwenCodeAssistant(
+        working_directory=make_tree({}),
+        watch=False,
+        session_log=False,
+        prefetch=False,
+        embedding_backend=HashEmbeddings()
+    )
+    recorder = Recorder(delays={'read': 0.2}, failing={'read'})
+    session.execute_tool = recorder
+    try:
+        results = asyncio.run(session.execute_tool_calls_async([
+            call('read_file', 'read', filepath='a.py'),
+            call('write_file', 'write', filepath='a.py', content=''),
+            call('read_file', 'other', filepath='b.py'),
+        ]))
+    finally:
+        session.shell.close()
+    assert results == ['Error executing tool read_file: read failed', 'result of write', 'result of other']
+    assert recorder.index('start', 'write') > recorder.index('end', 'read')
+    assert recorder.index('start', 'other') < recorder.index('end', 'read')
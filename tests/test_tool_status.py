@@ -0,0 +1,36 @@
+"""Tests for how tool failures are told apart from results."""
+
+import os
+
+from assistant import ToolError
+
+
+def errors(assistant, tool):
+    return assistant.tracer.stats()['tools'][tool]['errors']
+
+
+def test_results_that_read_like_errors_are_not_failures(assistant):
+    with open(os.path.join(assistant.working_directory, 'log.txt'), 'w') as f:
+        f.write('Error: disk full\n')
+    result = assistant.execute_tool('read_file', {'filepath': 'log.txt'})
+    assert result == 'Error: disk full\n'
+    assert not isinstance(result, ToolError)
+    assert errors(assistant, 'read_file') == 0
+
+
+def test_failed_tools_return_tool_errors(assistant):
+    result = assistant.execute_tool('read_file', {'filepath': 'missing.txt'})
+    assert isinstance(result, ToolError)
+    assert result == 'Error: File not found: missing.txt'
+    assert isinstance(assistant.execute_tool('list_files', {'directory': 'nowhere'}), ToolError)
+    assert isinstance(assistant.execute_tool('no_such_tool', {}), ToolError)
+    assert errors(assistant, 'read_file') == 1
+    assert errors(assistant, 'no_such_tool') == 1
+
+
+def test_command_output_starting_with_error_is_not_a_failure(assistant):
+    result = assistant.execute_tool('execute_command', {'command': 'echo "Error: expected"'})
+    assert result.startswith('Error: expected')
+    assert errors(assistant, 'execute_command') == 0
+    assert isinstance(assistant.execute_tool('execute_command', {'command': 'rm -rf /'}), ToolError)
+    assert errors(assistant, 'execute_command') == 1